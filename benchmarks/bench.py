@@ -0,0 +1,246 @@
+"""
+    Benchmarks for the hot paths of the simulator, the visualization and the optimizers. Every
+    benchmark runs at a few problem sizes and reports a rate (work done per second), so bigger
+    is always better. Everything runs headless (matplotlib's Agg backend), and the results are
+    written as JSON together with a description of the machine they were taken on.
+
+    To catch performance regressions, save a baseline once:
+
+        python benchmarks/bench.py --save-baseline
+
+    and later runs compare against it. The run fails (exit status 1) when any benchmark is slower
+    than the baseline by more than --threshold (20% by default). Rates from a different machine
+    aren't comparable, so we warn when the baseline's machine doesn't match this one.
+"""
+
+import os
+import sys
+import json
+import timeit
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as pl
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ["simulation_ex", "examples", "machine_learning"]:
+    sys.path.insert(0, os.path.join(ROOT, folder))
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+BENCHMARKS = []
+
+def benchmark(name, sizes, unit):
+    """
+        Registers a benchmark. The decorated function takes a problem size and sets everything
+        up, then returns (run, work): a function that does the timed work, and how many units
+        of work one call to it does.
+    """
+
+    def register(f):
+        BENCHMARKS.append((name, sizes, unit, f))
+        return f
+    return register
+
+@benchmark("quadrotor.step", ["semi_implicit", "rk4", "rk45"], "steps/s")
+def quadrotor_step(integrator):
+    import config as cfg
+    import quadrotor as quad
+    iris = quad.Quadrotor(dict(cfg.params, integrator=integrator))
+    rpm = np.full(4, iris.hov_rpm)
+    steps = 200
+
+    def run():
+        iris.reset()
+        for _ in range(steps):
+            iris.step(rpm)
+    return run, steps
+
+@benchmark("quadrotor_batch.step", [1, 100, 10000], "vehicle-steps/s")
+def batch_step(n):
+    import config as cfg
+    from quadrotor_batch import QuadrotorBatch
+    batch = QuadrotorBatch(cfg.params, n)
+    rpm = np.full((n, 4), batch.hov_rpm)
+    steps = 50
+
+    def run():
+        batch.reset()
+        for _ in range(steps):
+            batch.step(rpm)
+    return run, n*steps
+
+@benchmark("visualization.draw3d", [1, 16, 256], "frames/s")
+def draw3d(n):
+    """
+        Frame rate of drawing and rasterizing n vehicles (n = 1 is Visualization.draw3d itself,
+        more go through draw_swarm, which draw3d uses underneath).
+    """
+
+    import config as cfg
+    import quadrotor as quad
+    import animation as ani
+    iris = quad.Quadrotor(cfg.params)
+    vis = ani.Visualization(iris, 10)
+    fig = pl.figure()
+    ax = fig.add_subplot(111, projection="3d")
+    rng = np.random.default_rng(0)
+    xyz = rng.uniform(-3., 3., (n, 3))
+    R = np.broadcast_to(np.eye(3), (n, 3, 3))
+    frames = 5
+
+    def run():
+        for _ in range(frames):
+            if n == 1:
+                vis.draw3d(ax)
+            else:
+                vis.draw_swarm(ax, xyz, R)
+            fig.canvas.draw()
+    return run, frames
+
+@benchmark("optim_es.CEM.step", [1000, 10000, 100000], "iterations/s")
+def cem_step(samples):
+    """
+        CEM.step() on the regression problem from optim_es.optimize_f, with the same cost and
+        elite fraction. optimize_f itself runs to a loss threshold and prints every iteration,
+        so we time a fixed number of steps instead, and the work done doesn't depend on how
+        lucky the sampling is.
+    """
+
+    from optim_es import CEM
+    rng = np.random.default_rng(0)
+    x = np.vstack([np.linspace(0., 10., 100), np.ones(100)])
+    y_targ = np.array([2., -1.]).dot(x)+rng.normal(0., 0.5, 100)
+
+    def cost(theta):
+        err = theta.dot(x)-y_targ
+        return 0.5*np.mean(err**2, axis=1)
+
+    iterations = 5
+
+    def run():
+        cem = CEM(cost, np.zeros(2), 100., samples=samples, elite_frac=0.2, seed=0)
+        for _ in range(iterations):
+            cem.step()
+    return run, iterations
+
+@benchmark("mcmc.Sampler.run", [1, 64, 1024], "samples/s")
+def mcmc_sampler(chains):
+    # Sampler.run on the normal-mean posterior from the MCMC notebook, with `chains` parallel
+    # chains (the notebook's own scalar loop is timed against it in mcmc.main)
+    from mcmc import Sampler
+    rng = np.random.default_rng(0)
+    data = rng.normal(1.5, 3., 100)
+    sigma = data.std()
+
+    def log_prob(theta):
+        mu = theta[:, 0:1]
+        return -0.5*(((data-mu)/sigma)**2).sum(axis=1)-0.5*mu[:, 0]**2
+
+    iterations = 500
+
+    def run():
+        sampler = Sampler(log_prob, 1, chains=chains, seed=0)
+        sampler.run(iterations, burn_in=0, verbose=False)
+    return run, iterations*chains
+
+def machine():
+    # what the numbers were measured on
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"platform": platform.platform(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "matplotlib": matplotlib.__version__,
+            "commit": commit,
+            "time": datetime.now(timezone.utc).isoformat()}
+
+def run_all(pattern=None, repeat=3):
+    """
+        Runs every benchmark whose name contains pattern. Each one is called once to warm up
+        and then timed `repeat` times; we keep the fastest, since anything slower is noise from
+        the rest of the machine. Returns {"name[size]": {"rate": ..., "unit": ...}}.
+    """
+
+    results = {}
+    for name, sizes, unit, setup in BENCHMARKS:
+        if pattern is not None and pattern not in name:
+            continue
+        for size in sizes:
+            key = "{}[{}]".format(name, size)
+            run, work = setup(size)
+            run()
+            best = min(timeit.repeat(run, number=1, repeat=repeat))
+            results[key] = {"rate": work/best, "unit": unit, "seconds": best}
+            print("{:45s} {:14.1f} {}".format(key, work/best, unit))
+            pl.close("all")
+    return results
+
+def compare(results, baseline, threshold):
+    """
+        Ratio of every rate to the baseline. Returns the keys that got slower by more than
+        threshold (as a fraction, so 0.2 allows 20%).
+    """
+
+    slower = []
+    old = baseline["results"]
+    print("\n{:45s} {:>10s}".format("Compared to baseline", "speed"))
+    for key, r in results.items():
+        if key not in old:
+            print("{:45s} {:>10s}".format(key, "new"))
+            continue
+        ratio = r["rate"]/old[key]["rate"]
+        flag = ""
+        if ratio < 1.-threshold:
+            slower.append(key)
+            flag = "  REGRESSION"
+        print("{:45s} {:9.2f}x{}".format(key, ratio, flag))
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", "--pattern", help="only run benchmarks whose name contains this")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline JSON file (default: %(default)s)")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slow-down as a fraction (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    report = {"machine": machine(), "results": run_all(args.pattern, args.repeat)}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Saved baseline to {}".format(args.baseline))
+        return 0
+    if not os.path.exists(args.baseline):
+        print("No baseline at {}, nothing to compare against".format(args.baseline))
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    ours, theirs = report["machine"], baseline["machine"]
+    different = [k for k in ["platform", "machine", "processor", "cpus", "python", "numpy"] if ours.get(k) != theirs.get(k)]
+    if different:
+        print("Warning: the baseline was taken on a different setup ({})".format(", ".join(different)))
+    slower = compare(report["results"], baseline, args.threshold)
+    if slower:
+        print("\n{} benchmark(s) slower than the baseline by more than {:.0%}".format(len(slower), args.threshold))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,38 +1,22 @@
-import numpy as np
-from math import sin, cos, pi
-
-
-def V_dot(V):
-    return T(V)*cos(alpha+epsilon)-Cd(alpha)*V**2-sin(gamma)
-
-def gamma_dot(V):
-    return (1/V)*(T(V)*sin(alpha+epsilon)*Cl(alpha)*V**2)*cos(sigma)-(1/V)*cos(gamma)
-
-def psi_dot(V):
-    return (1/V/cos(gamma))*(T(V)*sin(alpha*epsilon)+Cl(alpha)*V**2)*sin(sigma)
-
-def h_dot(V):
-    return V*sin(gamma)
+"""
+Trajectory optimization for the glider turn: starting from level flight at V = 1, find the
+angle of attack and bank angle profiles that bring the aircraft to V_f = 0.6 and heading
+psi_f = pi/3 after t_f = 2.4 (everything non-dimensional).
 
-def x_dot(V):
-    return V*cos(gamma)*cos(psi)
-
-def y_dot(V):
-    return V*cos(gamma)*sin(psi)
-
-def T(V):
-    0.2476-0.04312*V+0.008392*V**2
-
-def Cd(alpha):
-    0.07351-0.08617*alpha+1.996*alpha**2
+The point-mass dynamics work on whole arrays of candidates at once, with the state as a
+(candidates, 6) array of [V, gamma, psi, h, x, y]. The controls are piecewise linear in time,
+set by their values at `nodes` evenly spaced times, so a candidate is a vector of 2*nodes
+numbers. That lets us
+    - search thousands of control profiles in one pass with CEM (see optim_es.py), and
+    - solve the terminal conditions exactly by shooting: the Jacobian of the final state
+      with respect to every control value comes from one batched rollout of perturbed
+      profiles, and Gauss-Newton steps take it the rest of the way.
+"""
 
-def Cl(alpha):
-    if alpha <= 12.*pi/180:
-        return 0.1667+6.231*alpha
-    elif alpha > 12.*pi/180:
-        return 0.1667+6.231*alpha+21.65*((alpha-12*pi/180)**2)
-    else: 
-        return 0
+import time
+import numpy as np
+from math import pi
+from optim_es import CEM
 
 v0 = 1.
 gamma0 = 0.
@@ -45,8 +29,202 @@ V_f = 0.6
 psi_f = pi/3.
 t_f = 2.4
 
-dt = 0.01
-steps = int(t_f/dt)
+# thrust angle relative to the body, and the control limits (stall is at 12 degrees, but the
+# lift model extends past it)
+epsilon = 0.
+alpha_lim = (-5.*pi/180, 30.*pi/180)
+sigma_lim = (-80.*pi/180, 80.*pi/180)
+
+def T(V):
+    return 0.2476-0.04312*V+0.008392*V**2
+
+def Cd(alpha):
+    return 0.07351-0.08617*alpha+1.996*alpha**2
+
+def Cl(alpha):
+    stall = 12.*pi/180
+    return 0.1667+6.231*alpha+21.65*np.maximum(alpha-stall, 0.)**2
+
+def dynamics(state, alpha, sigma):
+    """
+    Time derivatives of the (candidates, 6) state for (candidates,) arrays of controls
+    """
+
+    V, gamma, psi = state[:, 0], state[:, 1], state[:, 2]
+    thrust = T(V)
+    lift = thrust*np.sin(alpha+epsilon)+Cl(alpha)*V**2
+    cos_gamma = np.cos(gamma)
+    out = np.empty_like(state)
+    out[:, 0] = thrust*np.cos(alpha+epsilon)-Cd(alpha)*V**2-np.sin(gamma)
+    out[:, 1] = (lift*np.cos(sigma)-cos_gamma)/V
+    out[:, 2] = lift*np.sin(sigma)/(V*cos_gamma)
+    out[:, 3] = V*np.sin(gamma)
+    out[:, 4] = V*cos_gamma*np.cos(psi)
+    out[:, 5] = V*cos_gamma*np.sin(psi)
+    return out
+
+def interpolation(nodes, dt, t_end=t_f):
+    """
+    (times, nodes) matrix that maps control node values to the control at every RK4 stage
+    time (t, t+dt/2, t+dt for each step), so all the controls of a batch are one product.
+    """
+
+    steps = int(round(t_end/dt))
+    t = np.arange(steps)[:, None]*dt+np.array([0., 0.5*dt, dt])
+    knots = np.linspace(0., t_end, nodes)
+    return np.stack([np.interp(t.ravel(), knots, e) for e in np.eye(nodes)], axis=1)
+
+def simulate(theta, dt=0.02, trajectory=False):
+    """
+    RK4 rollouts of a (candidates, 2*nodes) array of control profiles, the angle of attack
+    nodes first and then the bank angle nodes. Returns the final states, or every state
+    (steps+1, candidates, 6) with trajectory=True. Candidates that stall out (V <= 0) come
+    back as nan.
+    """
+
+    theta = np.atleast_2d(theta)
+    nodes = theta.shape[1]//2
+    W = interpolation(nodes, dt)
+    steps = W.shape[0]//3
+    alpha = np.clip(theta[:, :nodes].dot(W.T), *alpha_lim).reshape(-1, steps, 3)
+    sigma = np.clip(theta[:, nodes:].dot(W.T), *sigma_lim).reshape(-1, steps, 3)
+
+    state = np.empty((theta.shape[0], 6))
+    state[:] = [v0, gamma0, psi0, h0, x0, y0]
+    states = [state] if trajectory else None
+    with np.errstate(all="ignore"):
+        for i in range(steps):
+            a0, a1, a2 = alpha[:, i, 0], alpha[:, i, 1], alpha[:, i, 2]
+            s0, s1, s2 = sigma[:, i, 0], sigma[:, i, 1], sigma[:, i, 2]
+            k1 = dynamics(state, a0, s0)
+            k2 = dynamics(state+0.5*dt*k1, a1, s1)
+            k3 = dynamics(state+0.5*dt*k2, a1, s1)
+            k4 = dynamics(state+dt*k3, a2, s2)
+            state = state+dt/6.*(k1+2.*k2+2.*k3+k4)
+            state[state[:, 0] <= 0.] = np.nan
+            if trajectory:
+                states.append(state)
+    return np.stack(states) if trajectory else state
+
+def residuals(final):
+    # terminal condition errors, (candidates, 2)
+    return np.stack([final[:, 0]-V_f, final[:, 2]-psi_f], axis=1)
+
+def search(nodes=6, samples=2048, iterations=15, altitude_weight=1e-2, seed=0, dt=0.02, verbose=False):
+    """
+    Sampled-control search with CEM: every iteration evaluates `samples` control profiles
+    in one batched rollout. The cost is the squared terminal error, plus a small penalty on
+    the change in altitude, so the search prefers level turns over dives and zooms.
+    """
+
+    def cost(theta):
+        final = simulate(theta, dt)
+        c = (residuals(final)**2).sum(axis=1)+altitude_weight*final[:, 3]**2
+        return np.where(np.isfinite(c), c, np.inf)
+
+    mean = np.concatenate([np.full(nodes, 8.*pi/180), np.zeros(nodes)])
+    std = np.concatenate([np.full(nodes, 5.*pi/180), np.full(nodes, 30.*pi/180)])
+    cem = CEM(cost, mean, std, samples=samples, elite_frac=0.05, chunk_size=samples, seed=seed)
+    for _ in range(iterations):
+        elite_cost = cem.step()
+        if verbose:
+            print("--- Iteration: {}, elite cost: {:.5f} ---".format(cem.iteration, elite_cost))
+    return cem.best()[0]
+
+def shoot(theta, tol=1e-8, max_iter=20, h=1e-6, dt=0.02):
+    """
+    Solves the terminal conditions by shooting from an initial control profile. The nominal
+    profile and one forward-difference perturbation per control value go through a single
+    batched rollout, which gives the (2, 2*nodes) Jacobian of the terminal errors. There are
+    more controls than conditions, so each Gauss-Newton step is the minimum-norm one (the
+    pseudo-inverse), which changes the profile as little as possible. Returns the profile
+    and the final terminal error.
+    """
+
+    theta = np.array(theta, dtype=float)
+    n = theta.shape[0]
+    batch = np.tile(theta, (n+1, 1))
+    for _ in range(max_iter):
+        batch[:] = theta
+        batch[np.arange(1, n+1), np.arange(n)] += h
+        r = residuals(simulate(batch, dt))
+        if not np.all(np.isfinite(r)):
+            return theta, np.inf
+        if np.abs(r[0]).max() < tol:
+            break
+        J = (r[1:]-r[0]).T/h
+        theta -= np.linalg.lstsq(J, r[0], rcond=None)[0]
+    return theta, np.abs(r[0]).max()
+
+def nominal(nodes=6):
+    # constant 8 degrees angle of attack and 20 degrees of bank, a gentle decelerating turn
+    return np.concatenate([np.full(nodes, 8.*pi/180), np.full(nodes, 20.*pi/180)])
+
+def solve(theta=None, nodes=6, tol=1e-8, samples=2048, iterations=15, seed=0, dt=0.02, verbose=False):
+    """
+    Shoots from theta (the nominal profile by default). If that doesn't converge, the
+    sampled search finds a better starting point and we shoot again from there.
+    """
+
+    theta, err = shoot(nominal(nodes) if theta is None else theta, tol=tol, dt=dt)
+    if err < tol:
+        return theta, err
+    theta = search(nodes, samples, iterations, seed=seed, dt=dt, verbose=verbose)
+    return shoot(theta, tol=tol, dt=dt)
+
+def main():
+    """
+    Solves the maneuver and compares the batched rollout with scalar, one step at a time
+    rollouts of the same dynamics.
+    """
+
+    from math import sin, cos
+
+    t0 = time.perf_counter()
+    theta, err = solve()
+    elapsed = time.perf_counter()-t0
+    nodes = theta.shape[0]//2
+    final = simulate(theta)[0]
+    print("Shooting from the nominal profile: {:.3f} s, terminal error {:.1e}".format(elapsed, err))
+    print("alpha nodes (deg): {}".format(np.round(theta[:nodes]*180/pi, 2)))
+    print("sigma nodes (deg): {}".format(np.round(theta[nodes:]*180/pi, 2)))
+    print("final V {:.4f}, psi {:.4f} (target {:.4f}, {:.4f}), gamma {:.4f}, h {:.4f}".format(
+        final[0], final[2], V_f, psi_f, final[1], final[3]))
+
+    t0 = time.perf_counter()
+    theta_search = search(samples=512, iterations=5)
+    _, err = shoot(theta_search)
+    print("Search (5 x 512 profiles) then shooting: {:.3f} s, terminal error {:.1e}".format(time.perf_counter()-t0, err))
+
+    # scalar Euler rollouts, the way the original loop stepped the dynamics
+    def scalar(theta, dt=0.01):
+        knots = np.linspace(0., t_f, nodes)
+        V, gamma, psi, h, x, y = v0, gamma0, psi0, h0, x0, y0
+        for i in range(int(round(t_f/dt))):
+            alpha = min(max(float(np.interp(i*dt, knots, theta[:nodes])), alpha_lim[0]), alpha_lim[1])
+            sigma = min(max(float(np.interp(i*dt, knots, theta[nodes:])), sigma_lim[0]), sigma_lim[1])
+            thrust = 0.2476-0.04312*V+0.008392*V**2
+            cl = 0.1667+6.231*alpha+21.65*max(alpha-12.*pi/180, 0.)**2
+            lift = thrust*sin(alpha+epsilon)+cl*V**2
+            dV = thrust*cos(alpha+epsilon)-(0.07351-0.08617*alpha+1.996*alpha**2)*V**2-sin(gamma)
+            dgamma = (lift*cos(sigma)-cos(gamma))/V
+            dpsi = lift*sin(sigma)/(V*cos(gamma))
+            h, x, y = h+dt*V*sin(gamma), x+dt*V*cos(gamma)*cos(psi), y+dt*V*cos(gamma)*sin(psi)
+            V, gamma, psi = V+dt*dV, gamma+dt*dgamma, psi+dt*dpsi
+        return V, psi
+
+    rng = np.random.default_rng(1)
+    batch = theta+0.01*rng.standard_normal((4096, theta.shape[0]))
+    t0 = time.perf_counter()
+    for row in batch[:100]:
+        scalar(row)
+    per_scalar = (time.perf_counter()-t0)/100
+    t0 = time.perf_counter()
+    simulate(batch)
+    per_batched = (time.perf_counter()-t0)/batch.shape[0]
+    print("Scalar Euler rollout: {:.2f} ms, batched RK4 rollout: {:.4f} ms per candidate ({:.0f}x)".format(
+        1e3*per_scalar, 1e3*per_batched, per_scalar/per_batched))
+    print("Scalar check of the solution: V {:.4f}, psi {:.4f}".format(*scalar(theta)))
 
-for t in range(steps):
-    
\ No newline at end of file
+if __name__ == "__main__":
+    main()
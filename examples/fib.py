@@ -3,9 +3,18 @@
 """
 Simple recursive Fibionacci example to demostrate the principle of recursion.
 
+It's also our microbenchmark baseline, so it comes with the faster versions that answer
+its own question: a loop, fast doubling, a memo for repeated queries, and F(n) mod m for
+whole arrays of n at once.
+
 -- Sean Morrison, 2018
 """
 
+import sys
+import time
+import numpy as np
+from functools import lru_cache
+
 # a recursive example of a function that calculates the nth Fibionacci number.
 # This function is inefficient. Can you see why? How could it be improved?
 def fib(n):
@@ -16,5 +25,82 @@ def fib(n):
 	else:
 		return fib(n-1)+fib(n-2)
 
-n = 6
-print("Fibionacci number {} is {}".format(n, fib(n)))
\ No newline at end of file
+# fib(n-1) and fib(n-2) both recompute everything below them, so the number of calls grows
+# like F(n) itself, and for big n we run out of stack first. Working upwards from the
+# bottom instead needs n additions and no recursion.
+def fib_loop(n):
+	a, b = 0, 1
+	for _ in range(n):
+		a, b = b, a+b
+	return a
+
+# Fast doubling: from F(k) and F(k+1) we get
+#
+#   F(2k)   = F(k)*(2*F(k+1)-F(k))
+#   F(2k+1) = F(k)^2+F(k+1)^2
+#
+# so we can walk down the bits of n, doubling k at every bit and stepping by one where
+# the bit is set. That's O(log n) big-integer multiplications instead of n additions.
+def fib_doubling(n):
+	if n < 0:
+		raise ValueError("n must be non-negative")
+	a, b = 0, 1
+	for bit in bin(n)[2:]:
+		a, b = a*(2*b-a), a*a+b*b
+		if bit == "1":
+			a, b = b, a+b
+	return a
+
+# the same thing with a bounded memo for repeated queries. F(10^6) has about 200,000
+# digits, so an unbounded cache could grow without limit; the LRU cache throws out the
+# least recently used values once it holds maxsize of them.
+fib_cached = lru_cache(maxsize=128)(fib_doubling)
+
+# F(n) mod m for a whole array of n, with the same doubling done elementwise in uint64.
+# Every product is of two numbers below m, so m has to be below 2^32 for them to fit.
+# Shorter n just have leading zero bits, which leave (F(0), F(1)) = (0, 1) unchanged.
+def fib_mod(n, m):
+	n = np.asarray(n, dtype=np.uint64)
+	if m < 2 or m > 2**32:
+		raise ValueError("m must be between 2 and 2^32")
+	m = np.uint64(m)
+	a = np.zeros(n.shape, dtype=np.uint64)
+	b = np.ones(n.shape, dtype=np.uint64) % m
+	bits = int(n.max()).bit_length() if n.size else 0
+	for i in range(bits-1, -1, -1):
+		c = a*((2*b+m-a) % m) % m
+		d = (a*a % m+b*b % m) % m
+		set_bit = ((n >> np.uint64(i)) & np.uint64(1)).astype(bool)
+		a = np.where(set_bit, d, c)
+		b = np.where(set_bit, (c+d) % m, d)
+	return a
+
+def benchmark(n_max=10**6, m=10**9+7):
+	# times every version at growing n, skipping the ones that would take too long
+	def timed(f, *args):
+		t0 = time.perf_counter()
+		f(*args)
+		return time.perf_counter()-t0
+
+	print("{:>8s} {:>12s} {:>12s} {:>12s} {:>12s}".format("n", "recursive", "loop", "doubling", "cached"))
+	n = 10
+	while n <= n_max:
+		row = [timed(fib, n) if n <= 25 else None, timed(fib_loop, n) if n <= 10**5 else None,
+			timed(fib_doubling, n)]
+		fib_cached(n)
+		row.append(timed(fib_cached, n))
+		print("{:>8d} ".format(n)+" ".join("{:>10.3e} s".format(t) if t is not None else "{:>12s}".format("-") for t in row))
+		n *= 10
+
+	ns = np.arange(n_max+1)
+	t = timed(fib_mod, ns, m)
+	print("F(n) mod {} for all {} n up to {}: {:.3f} s".format(m, ns.shape[0], n_max, t))
+	check = np.random.default_rng(0).integers(0, n_max+1, 20)
+	assert all(int(r) == fib_doubling(int(k)) % m for k, r in zip(check, fib_mod(check, m)))
+	assert fib_loop(1000) == fib_doubling(1000) == fib_cached(1000)
+
+if __name__ == "__main__":
+	n = 6
+	print("Fibionacci number {} is {}".format(n, fib(n)))
+	if "--benchmark" in sys.argv:
+		benchmark()
@@ -1,57 +1,204 @@
 # -*- coding: utf-8 -*-
 """
 Linear regression example using gradient descent. The purpose of this
-script is to give an idea of how nested functions can be used.
+script is to give an idea of how nested functions can be used, and how to
+train on data that doesn't fit in memory by streaming it in mini-batches.
 
 -- Sean Morrison, 2018
 """
 
 # we'll use numpy here since it makes sense to do so. Also a good time to
 # introduce it, since we'll be using it for the quadrotor simulation.
+import os
+import sys
+import time
+import tempfile
 import numpy as np
 import matplotlib.pyplot as plt
 
+def batches(data, batch_size):
+    """
+    Yields (X, y) mini-batches. data is either a pair of arrays (X, y) with one row per
+    sample -- ordinary arrays, or np.memmap/np.load(..., mmap_mode="r") arrays for data on
+    disk -- or a function that returns a fresh iterable of (X, y) batches each time it's
+    called (e.g. a generator reading from a file or a socket). Slicing a memmap only
+    reads those rows from disk, so memory stays constant whatever the size of the file.
+    """
+
+    if callable(data):
+        yield from data()
+        return
+    X, y = data
+    for start in range(0, X.shape[0], batch_size):
+        yield np.asarray(X[start:start+batch_size]), np.asarray(y[start:start+batch_size])
+
+def gradient(theta, X, y):
+    # gradient of the mean squared-error 0.5*mean((X*theta-y)^2), summed over the batch
+    # rather than averaged, so batches of different sizes can be combined
+    err = X.dot(theta)-y
+    return X.T.dot(err), 0.5*err.dot(err)
+
+class Momentum:
+    """
+    Gradient descent with (heavy ball) momentum. momentum=0 is plain gradient descent.
+    """
+
+    def __init__(self, lr=1e-2, momentum=0.9):
+        self.lr = lr
+        self.momentum = momentum
+        self.v = None
+
+    def update(self, theta, grad):
+        if self.v is None:
+            self.v = np.zeros_like(theta)
+        self.v *= self.momentum
+        self.v -= self.lr*grad
+        theta += self.v
+
+class Adam:
+    """
+    Adam: momentum on the gradient, scaled by a running estimate of its magnitude, with
+    the bias of the zero initialization corrected.
+    """
+
+    def __init__(self, lr=1e-2, beta1=0.9, beta2=0.999, eps=1e-8):
+        self.lr = lr
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.eps = eps
+        self.m = None
+        self.v = None
+        self.t = 0
+
+    def update(self, theta, grad):
+        if self.m is None:
+            self.m = np.zeros_like(theta)
+            self.v = np.zeros_like(theta)
+        self.t += 1
+        self.m += (1.-self.beta1)*(grad-self.m)
+        self.v += (1.-self.beta2)*(grad**2-self.v)
+        m_hat = self.m/(1.-self.beta1**self.t)
+        v_hat = self.v/(1.-self.beta2**self.t)
+        theta -= self.lr*m_hat/(np.sqrt(v_hat)+self.eps)
+
+class Trainer:
+    """
+    Mini-batch gradient descent on the least-squares loss. Each epoch streams through the
+    data once, updating theta after every batch. We stop when the norm of the average
+    gradient over an epoch drops below tol. We use the norm rather than the mean of the
+    gradient, since the mean is signed: positive and negative components cancel, so it can
+    be tiny far away from the minimum, or stay negative forever. Progress is printed at most
+    once every log_every seconds, since printing every iteration costs more than the
+    iteration itself. If max_epochs runs out first, fit() says so, and converged is left
+    False.
+    """
+
+    def __init__(self, optimizer, batch_size=256, tol=1e-4, max_epochs=1000, log_every=1.):
+        self.optimizer = optimizer
+        self.batch_size = batch_size
+        self.tol = tol
+        self.max_epochs = max_epochs
+        self.log_every = log_every
+        self.converged = False
+        self.epochs = 0
+
+    def fit(self, theta, data):
+        theta = np.array(theta, dtype=float)
+        last_log = time.perf_counter()
+        for epoch in range(1, self.max_epochs+1):
+            grad_sum = np.zeros_like(theta)
+            loss_sum = 0.
+            n = 0
+            for X, y in batches(data, self.batch_size):
+                grad, loss = gradient(theta, X, y)
+                self.optimizer.update(theta, grad/X.shape[0])
+                grad_sum += grad
+                loss_sum += loss
+                n += X.shape[0]
+            grad_norm = np.linalg.norm(grad_sum/n)
+            now = time.perf_counter()
+            self.converged = grad_norm < self.tol
+            if now-last_log > self.log_every or self.converged or epoch == self.max_epochs:
+                print("--- Epoch: {}, Loss: {:.5f}, |grad|: {:.2e} ---".format(epoch, loss_sum/n, grad_norm))
+                last_log = now
+            if self.converged:
+                break
+        self.epochs = epoch
+        if not self.converged:
+            print("--- Stopped after {} epochs without converging: |grad| {:.2e} > tol {:.2e} ---".format(
+                epoch, grad_norm, self.tol))
+        return theta
+
+def lstsq(data, batch_size=65536):
+    """
+    Closed-form least squares, for comparison. We stream through the data once and add up
+    X^T*X and X^T*y, which are only (features, features) and (features,), and then solve
+    the normal equations. This also runs in constant memory.
+    """
+
+    XtX, Xty = 0., 0.
+    for X, y in batches(data, batch_size):
+        XtX = XtX+X.T.dot(X)
+        Xty = Xty+X.T.dot(y)
+    return np.linalg.lstsq(XtX, Xty, rcond=None)[0]
+
 # We have a bunch of datapoints y_hat that follows a linear pattern.
 # we want to find a set of theta values Y=theta_0*X+theta_1 that match the
 # line Y=A*X+B that generated the data.
-def optimize_f(theta, x, y_targ):
-    # outer optimization function
-    
-    def cost(pred, targ):
-        # mean squared-error cost function
-        loss = -0.5*(pred-targ)**2
-        grad = targ-pred
-        return np.mean(loss), grad
-    
-    # We can either optimize for a fixed number of iterations and take the 
-    # result, or optimize until the gradient goes to zero (local minima). 
-    # We do the latter here since it makes more sense. Since we don't know
-    # how long the optimization process will take, we use a while loop.
-    iteration = 1
-    while True:
-        y_pred = theta.dot(x_act)
-        loss, grad = cost(y_pred, y_targ)
-        print("--- Iteration: {}, Loss: {:.5f} ---".format(iteration, loss))
-        theta += alpha*x_act.dot(grad)
-        if np.mean(grad) < thresh:
-            break
-        iteration += 1
-        
-thresh = 1e-10                                      # termination threshold
-alpha = 1e-3                                        # learning rate
-x = np.linspace(-1, 1, 100)                         # x range
-x_act = np.vstack([x, np.ones(x.shape)])            # add 1s vector for Y=THETA*X
-A = np.random.randn()*10                            # generate random slope
-B = np.random.randn()*10                            # generate random intercept
-y = A*x+B+0.8*np.random.randn(100)                  # add noise to the function
-theta = np.random.randn(2)                          # generate two random THETA vals
-theta_start = theta.copy()                          # save initial THETA vals
-optimize_f(theta, x, y)                             # call optimization fn
-print("A: {}".format(A))
-print("B: {}".format(B))
-print("Theta init: {}".format(theta_start))
-print("Optimized Theta: {}".format(theta))
-fig = plt.figure()                                  # create a figure
-plt.scatter(x,y)                                    # scatter plot of data
-plt.plot(x, theta.dot(x_act), "-r")                 # plot the line given by THETA
-fig.show()                                          # show plot
\ No newline at end of file
+def optimize_f(theta, x, y_targ, thresh=1e-6, alpha=1e-1, batch_size=None):
+    # fits theta to data with one row [x, 1] per sample. By default the batch is the whole
+    # dataset. Mini-batch gradients are noisy, so with a small batch_size the gradient norm
+    # levels off at some multiple of alpha times the noise; raise thresh to match.
+    trainer = Trainer(Momentum(lr=alpha), batch_size=batch_size or x.shape[0], tol=thresh)
+    return trainer.fit(theta, (x, y_targ))
+
+def make_dataset(path, n, A, B, chunk=1000000):
+    # writes a dataset of n rows to .npy files on disk, a chunk at a time
+    X = np.lib.format.open_memmap(path+"_X.npy", mode="w+", dtype=np.float64, shape=(n, 2))
+    y = np.lib.format.open_memmap(path+"_y.npy", mode="w+", dtype=np.float64, shape=(n,))
+    rng = np.random.default_rng(0)
+    for start in range(0, n, chunk):
+        x = rng.uniform(-1, 1, min(chunk, n-start))
+        X[start:start+x.shape[0], 0] = x
+        X[start:start+x.shape[0], 1] = 1.
+        y[start:start+x.shape[0]] = A*x+B+0.8*rng.standard_normal(x.shape[0])
+    X.flush()
+    y.flush()
+    return np.load(path+"_X.npy", mmap_mode="r"), np.load(path+"_y.npy", mmap_mode="r")
+
+def streaming_demo(n=10000000):
+    # fits a dataset on disk that we never load into memory all at once. Batches of 8192
+    # rows give Adam enough updates per epoch to converge within max_epochs for files of
+    # 1e5 rows and up.
+    with tempfile.TemporaryDirectory() as tmp:
+        X, y = make_dataset(os.path.join(tmp, "data"), n, 3., -2.)
+        t0 = time.perf_counter()
+        trainer = Trainer(Adam(lr=1e-2), batch_size=8192, tol=1e-3, max_epochs=100)
+        theta = trainer.fit(np.zeros(2), (X, y))
+        t1 = time.perf_counter()
+        exact = lstsq((X, y))
+        t2 = time.perf_counter()
+        print("Streaming Adam on {} rows: {} after {} epochs in {:.1f} s".format(n, theta, trainer.epochs, t1-t0))
+        print("Closed-form least squares: {} in {:.1f} s".format(exact, t2-t1))
+        del X, y
+
+if __name__ == "__main__" and "--stream" in sys.argv:
+    streaming_demo()
+elif __name__ == "__main__":
+    x = np.linspace(-1, 1, 100)                         # x range
+    x_act = np.vstack([x, np.ones(x.shape)]).T          # one row [x, 1] per sample for Y=X*THETA
+    A = np.random.randn()*10                            # generate random slope
+    B = np.random.randn()*10                            # generate random intercept
+    y = A*x+B+0.8*np.random.randn(100)                  # add noise to the function
+    theta = np.random.randn(2)                          # generate two random THETA vals
+    theta_start = theta.copy()                          # save initial THETA vals
+    theta = optimize_f(theta, x_act, y)                 # call optimization fn
+    print("A: {}".format(A))
+    print("B: {}".format(B))
+    print("Theta init: {}".format(theta_start))
+    print("Optimized Theta: {}".format(theta))
+    print("Least squares Theta: {}".format(lstsq((x_act, y))))
+    fig = plt.figure()                                  # create a figure
+    plt.scatter(x,y)                                    # scatter plot of data
+    plt.plot(x, x_act.dot(theta), "-r")                 # plot the line given by THETA
+    plt.show()                                          # show plot
@@ -1,61 +1,325 @@
 # -*- coding: utf-8 -*-
 """
-Linear regression example using gradient descent. The purpose of this
-script is to give an idea of how nested functions can be used.
+Linear regression example using the cross-entropy method (CEM). The purpose of this
+script is to give an idea of how nested functions can be used, and how a population
+based optimizer can be written so that it works for any objective.
 
 -- Sean Morrison, 2018
 """
 
 # we'll use numpy here since it makes sense to do so. Also a good time to
 # introduce it, since we'll be using it for the quadrotor simulation.
+import os
+import sys
+import time
 import numpy as np
 import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory, util
+
+def call(objective, theta, seed):
+    # stochastic objectives also get the seed for this iteration (see CEM)
+    return objective(theta) if seed is None else objective(theta, seed)
+
+def split(n, parts):
+    bounds = np.linspace(0, n, min(n, parts)+1).astype(int)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+class Vectorized:
+    """
+    Evaluates the whole chunk with one call to the objective, in this process. This is
+    the right choice when the objective is already vectorized with numpy.
+    """
+
+    def evaluate(self, objective, theta, seed=None):
+        return call(objective, theta, seed)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class Threaded(Vectorized):
+    """
+    Splits the chunk into one slice per thread. Threads share the GIL, so this only
+    helps if the objective spends its time in code that releases it (big numpy
+    operations, compiled extensions, I/O).
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count()
+        self.pool = ThreadPoolExecutor(self.workers)
+
+    def evaluate(self, objective, theta, seed=None):
+        parts = [self.pool.submit(call, objective, theta[a:b], seed) for a, b in split(theta.shape[0], self.workers)]
+        return np.concatenate([f.result() for f in parts])
+
+    def close(self):
+        self.pool.shutdown()
+
+# shared memory blocks a worker process has attached to, by name
+attached = {}
+
+def detach(keep=()):
+    # closes the worker's handles on every block except the ones in keep
+    for name in [name for name in attached if name not in keep]:
+        attached.pop(name).close()
+
+def init_worker():
+    # runs once in every worker process: close whatever is still attached on the way out
+    util.Finalize(None, detach, exitpriority=10)
+
+def view(name, shape):
+    if name not in attached:
+        attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=np.float64, buffer=attached[name].buf)
+
+def evaluate_shared(objective, names, shape, start, stop, seed):
+    # runs in a worker process: read our rows of theta, write our slice of the costs. When
+    # the parent has reallocated, the old blocks are gone, so let go of them here too.
+    detach(names)
+    theta = view(names[0], shape)
+    cost = view(names[1], (shape[0],))
+    cost[start:stop] = call(objective, theta[start:stop], seed)
+
+class Processes(Vectorized):
+    """
+    Splits the chunk into one slice per worker process. The parameter matrix and the
+    costs are passed through shared memory, so the only things pickled per task are the
+    objective (by reference, so it must be a module level function), a couple of block
+    names and the row range. Use this for objectives that hold the GIL, like rollouts
+    written as plain Python loops. Use a large chunk_size with this backend, since
+    every chunk is a round trip to the workers. Workers keep their handles on the
+    blocks between chunks, and close them when the blocks are reallocated or when the
+    worker exits.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count()
+        self.pool = ProcessPoolExecutor(self.workers, initializer=init_worker)
+        self.blocks = None
+        self.rows = 0
+
+    def allocate(self, rows, dims):
+        self.release()
+        self.blocks = [shared_memory.SharedMemory(create=True, size=rows*dims*8),
+                        shared_memory.SharedMemory(create=True, size=rows*8)]
+        self.rows, self.dims = rows, dims
+
+    def release(self):
+        if self.blocks is not None:
+            for block in self.blocks:
+                block.close()
+                block.unlink()
+            self.blocks = None
+
+    def evaluate(self, objective, theta, seed=None):
+        n, dims = theta.shape
+        if self.blocks is None or n > self.rows or dims != self.dims:
+            self.allocate(n, dims)
+        shape = (n, dims)
+        np.ndarray(shape, dtype=np.float64, buffer=self.blocks[0].buf)[:] = theta
+        names = [block.name for block in self.blocks]
+        parts = [self.pool.submit(evaluate_shared, objective, names, shape, a, b, seed) for a, b in split(n, self.workers)]
+        for f in parts:
+            f.result()
+        return np.ndarray((n,), dtype=np.float64, buffer=self.blocks[1].buf).copy()
+
+    def close(self):
+        self.pool.shutdown()
+        self.release()
+
+class CEM:
+    """
+    Cross-entropy method. Every iteration we sample a population of parameter vectors
+    from a Gaussian, evaluate them, and refit the Gaussian to the best (elite) ones.
+
+    The objective takes a (chunk, dims) array of parameter vectors and returns a
+    (chunk,) array of costs to minimize. The population is sampled and evaluated
+    in chunks of chunk_size, and we only ever keep the running set of elites plus one
+    chunk. The number of elites is elite_frac of the population, but at most max_elite
+    (or n_elite if given, capped at the population size), so memory is bounded by
+    max_elite+chunk_size rows however large the population gets. Elites are picked with
+    np.argpartition, which is O(n) instead of the O(n log n) of sorting everything.
+
+    With full_cov=True the Gaussian has a full covariance matrix, otherwise it has a
+    separate standard deviation for each dimension.
+
+    Chunks are evaluated by a backend: Vectorized (the default), Threaded or Processes.
+    For noisy objectives, like rollouts with random disturbances, set stochastic=True.
+    The objective is then called as objective(theta, seed), with the same seed for every
+    member of the population in an iteration. These are common random numbers: every
+    candidate sees the same disturbances, so the elites are picked on their parameters
+    rather than on luck. All the sampling happens in this process from one seeded
+    generator, so for a fixed seed the results don't depend on the backend or on the
+    number of workers.
+    """
+
+    def __init__(self, objective, mean, std, samples=10000, elite_frac=0.2, n_elite=None,
+                max_elite=1000, chunk_size=1024, full_cov=False, min_std=1e-6, seed=None,
+                backend=None, stochastic=False):
+        self.objective = objective
+        self.backend = backend or Vectorized()
+        self.stochastic = stochastic
+        self.mean = np.array(mean, dtype=float).ravel()
+        self.dims = self.mean.shape[0]
+        std = np.broadcast_to(np.asarray(std, dtype=float), (self.dims,))
+        self.full_cov = full_cov
+        if full_cov:
+            self.cov = np.diag(std**2)
+        else:
+            self.std = std.copy()
+        self.samples = samples
+        self.n_elite = min(n_elite or max(1, min(int(elite_frac*samples), max_elite)), samples)
+        self.chunk_size = min(chunk_size, samples)
+        self.min_std = min_std
+        self.rng = np.random.default_rng(seed)
+
+        # elites live in the first n_elite rows, the current chunk in the rest
+        self.pool = np.empty((self.n_elite+self.chunk_size, self.dims))
+        self.pool_cost = np.empty(self.n_elite+self.chunk_size)
+        self.filled = 0
+        self.iteration = 0
+        self.evals = 0
+        self.eval_time = 0.
+
+    def sample(self, n):
+        z = self.rng.standard_normal((n, self.dims))
+        if self.full_cov:
+            L = np.linalg.cholesky(self.cov+self.min_std**2*np.eye(self.dims))
+            return self.mean+z.dot(L.T)
+        return self.mean+z*self.std
+
+    def step(self):
+        """
+        One CEM iteration. Returns the mean cost of the elites.
+        """
+
+        k = self.n_elite
+        filled = 0
+        done = 0
+        seed = int(self.rng.integers(2**32)) if self.stochastic else None
+        while done < self.samples:
+            n = min(self.chunk_size, self.samples-done)
+            theta = self.sample(n)
+            t0 = time.perf_counter()
+            cost = self.backend.evaluate(self.objective, theta, seed)
+            self.eval_time += time.perf_counter()-t0
+            done += n
+
+            # append the chunk after the current elites, and keep the best k of the lot
+            self.pool[filled:filled+n] = theta
+            self.pool_cost[filled:filled+n] = cost
+            filled += n
+            if filled > k:
+                idx = np.argpartition(self.pool_cost[:filled], k-1)[:k]
+                self.pool[:k] = self.pool[idx]
+                self.pool_cost[:k] = self.pool_cost[idx]
+                filled = k
+        self.filled = filled
+        self.evals += self.samples
+        self.iteration += 1
+
+        elites = self.pool[:filled]
+        self.mean = elites.mean(axis=0)
+        if self.full_cov:
+            self.cov = np.atleast_2d(np.cov(elites, rowvar=False))
+        else:
+            self.std = np.maximum(elites.std(axis=0), self.min_std)
+        return self.pool_cost[:filled].mean()
+
+    def best(self):
+        """
+        Best parameter vector found in the last iteration, and its cost
+        """
+
+        i = np.argmin(self.pool_cost[:self.filled])
+        return self.pool[i].copy(), self.pool_cost[i]
+
+    def evals_per_second(self):
+        return self.evals/self.eval_time if self.eval_time > 0. else float("nan")
+
+    def run(self, thresh, max_iter=1000, verbose=True):
+        """
+        Iterates until the mean elite cost drops below thresh, or max_iter iterations
+        """
+
+        for _ in range(max_iter):
+            cost = self.step()
+            if verbose:
+                print("--- Iteration: {}, Loss: {:.5f}, {:.0f} evals/s ---".format(self.iteration, cost, self.evals_per_second()))
+            if cost < thresh:
+                break
+        return self.mean
 
 # We have a bunch of datapoints y_hat that follows a linear pattern.
 # we want to find a set of theta values Y=theta_0*X+theta_1 that match the
 # line Y=A*X+B that generated the data.
-def optimize_f(x, y_targ, mean=0., std=100., samples=10000, elite_frac=0.2):
+def optimize_f(x, y_targ, thresh, mean=0., std=100., samples=10000, elite_frac=0.2):
     # outer optimization function
-    
-    def cost(pred, targ):
-        # mean squared-error cost function
-        loss = -0.5*(pred-targ)**2
-        return np.mean(loss, axis=0)
-    
-    best_n = int(elite_frac*samples)
-
-    # We can either optimize for a fixed number of iterations and take the 
-    # result, or optimize until the gradient goes to zero (local minima). 
-    # We do the latter here since it makes more sense. Since we don't know
-    # how long the optimization process will take, we use a while loop.
-    iteration = 1
-    mu, dev = mean, std
-    while True:
-        theta = np.random.normal(mu, dev, (x.shape[0], samples))
-        y_pred = theta.T.dot(x)
-        loss = cost(y_pred, np.tile(y_targ, (samples, 1)))
-        idxs = np.argsort(loss)
-        best = idxs[-best_n:]
-        print("--- Iteration: {}, Loss: {:.5f} ---".format(iteration, loss[idxs[best]].mean()))
-        if np.abs(loss[idxs[best]].mean()) < thresh:
-            break
-        best_theta = theta[:, best]
-        mu, dev = best_theta.mean(), best_theta.std()
-        iteration += 1
-    return theta
-
-thresh = 1e-2                                      # termination threshold
-alpha = 1e-3                                        # learning rate
-x = np.linspace(-1, 1, 100)                         # x range
-x_act = np.vstack([x, np.ones(x.shape)])            # add 1s vector for Y=THETA*X
-A = np.random.randn()*10                            # generate random slope
-B = np.random.randn()*10                            # generate random intercept
-y = A*x+B+0.8*np.random.randn(100)                  # add noise to the function
-theta = optimize_f(x_act, y)                             # call optimization fn
-print("A: {}".format(A))
-print("B: {}".format(B))
-print("Optimized Theta: {}".format(theta))
-fig = plt.figure()                                  # create a figure
-plt.scatter(x,y)                                    # scatter plot of data
-plt.plot(x, theta.dot(x_act), "-r")                 # plot the line given by THETA
-fig.show()                                          # show plot
\ No newline at end of file
+
+    def cost(theta):
+        # mean squared-error cost for every row of theta at once. theta.dot(x) is
+        # (chunk, points) and y_targ broadcasts against it, so there's no need to tile.
+        err = theta.dot(x)-y_targ
+        return 0.5*np.mean(err**2, axis=1)
+
+    # We can either optimize for a fixed number of iterations and take the
+    # result, or optimize until the loss is small enough. We do the latter
+    # here, with the noise in the data setting how small the loss can get.
+    cem = CEM(cost, np.full(x.shape[0], mean), std, samples=samples, elite_frac=elite_frac)
+    return cem.run(thresh)
+
+def rollout(theta, seed, steps=2000, dt=0.01):
+    # Cost of a PD altitude controller with gains theta = (kp, kd) on a point mass, with
+    # a random gust force. Written as a plain Python loop to stand in for a rollout of
+    # Quadrotor.step(), i.e. something that holds the GIL and can't be vectorized.
+    gusts = np.random.default_rng(seed).normal(0., 2., steps).tolist()
+    cost = np.empty(theta.shape[0])
+    for i, (kp, kd) in enumerate(theta.tolist()):
+        z, w, J = 0., 0., 0.
+        for gust in gusts:
+            u = kp*(1.-z)-kd*w
+            w += (u+gust)*dt
+            z += w*dt
+            J += (1.-z)**2+1e-3*u**2
+        cost[i] = J*dt if J == J and J < 1e6 else 1e6
+    return cost
+
+def compare_backends(samples=2000, iterations=3, seed=0):
+    # runs the same stochastic optimization on every backend, and checks they agree
+    results = {}
+    for name, backend in [("vectorized", Vectorized()), ("threads", Threaded()),
+                        ("processes x2", Processes(2)), ("processes", Processes())]:
+        with backend:
+            cem = CEM(rollout, [5., 1.], [5., 1.], samples=samples, chunk_size=samples, seed=seed,
+                    backend=backend, stochastic=True)
+            t0 = time.perf_counter()
+            for _ in range(iterations):
+                cem.step()
+            print("{:14s}: {:8.0f} evals/s, mean {}".format(name, cem.evals/(time.perf_counter()-t0), cem.mean))
+            results[name] = cem.mean
+    ref = results["vectorized"]
+    print("Identical across backends: {}".format(all(np.array_equal(ref, m) for m in results.values())))
+
+if __name__ == "__main__" and "--backends" in sys.argv:
+    compare_backends()
+elif __name__ == "__main__":
+    thresh = 0.4                                        # termination threshold (noise variance is 0.64)
+    x = np.linspace(-1, 1, 100)                         # x range
+    x_act = np.vstack([x, np.ones(x.shape)])            # add 1s vector for Y=THETA*X
+    A = np.random.randn()*10                            # generate random slope
+    B = np.random.randn()*10                            # generate random intercept
+    y = A*x+B+0.8*np.random.randn(100)                  # add noise to the function
+    theta = optimize_f(x_act, y, thresh)                # call optimization fn
+    print("A: {}".format(A))
+    print("B: {}".format(B))
+    print("Optimized Theta: {}".format(theta))
+    fig = plt.figure()                                  # create a figure
+    plt.scatter(x,y)                                    # scatter plot of data
+    plt.plot(x, theta.dot(x_act), "-r")                 # plot the line given by THETA
+    plt.show()                                          # show plot
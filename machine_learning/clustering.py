@@ -0,0 +1,413 @@
+"""
+    Vectorized clustering for the Clustering notebook. The notebook loops over every centroid,
+    every point and every centroid again to do the assignment step. Here all the point-centroid
+    distances come from one matrix expansion,
+
+        |x-c|^2 = |x|^2-2*x.c+|c|^2
+
+    which is a single matrix multiply, X.dot(C.T), for the whole dataset (done in chunks of
+    rows, so memory stays bounded for big datasets).
+
+    The Gaussian mixture model works in log space throughout. Responsibilities come from a
+    log-sum-exp over an (n, k) array of log densities, so points far from every component don't
+    underflow to 0/0 the way products of pdfs do.
+"""
+
+import time
+import numpy as np
+
+def sq_distances(X, C, X_sq=None):
+    """
+        (n, k) squared distances between the rows of X (n, dim) and C (k, dim). Rounding can
+        make the expansion slightly negative for points sitting on a centroid, so clip at 0.
+    """
+
+    X_sq = np.einsum('ij,ij->i', X, X) if X_sq is None else X_sq
+    d = X_sq[:, None]-2.*X.dot(C.T)+np.einsum('ij,ij->i', C, C)
+    return np.maximum(d, 0., out=d)
+
+def assign(X, C, chunk=2**16):
+    """
+        Index of the closest centroid for every row of X, and the squared distance to it
+    """
+
+    labels = np.empty(X.shape[0], dtype=np.intp)
+    dist = np.empty(X.shape[0])
+    for start in range(0, X.shape[0], chunk):
+        d = sq_distances(X[start:start+chunk], C)
+        labels[start:start+chunk] = d.argmin(axis=1)
+        dist[start:start+chunk] = d[np.arange(d.shape[0]), labels[start:start+chunk]]
+    return labels, dist
+
+def kmeans_pp(X, k, rng):
+    """
+        k-means++ seeding: the first centroid is a random point, and every next one is drawn
+        with probability proportional to the squared distance to the closest centroid so far.
+        This spreads the starting centroids out, which avoids most bad local minima. We only
+        need the distances to the newest centroid each round, so it's O(n*k) overall.
+    """
+
+    C = np.empty((k, X.shape[1]))
+    C[0] = X[rng.integers(X.shape[0])]
+    closest = sq_distances(X, C[:1])[:, 0]
+    for i in range(1, k):
+        p = closest/closest.sum() if closest.sum() > 0. else None
+        C[i] = X[rng.choice(X.shape[0], p=p)]
+        np.minimum(closest, sq_distances(X, C[i:i+1])[:, 0], out=closest)
+    return C
+
+def centroid_sums(X, labels, k):
+    # per-cluster sums and counts with bincount, which is much faster than np.add.at
+    counts = np.bincount(labels, minlength=k)
+    sums = np.stack([np.bincount(labels, weights=X[:, j], minlength=k) for j in range(X.shape[1])], axis=1)
+    return sums, counts
+
+class KMeans:
+    """
+        Lloyd's algorithm: assign every point to its closest centroid, move every centroid to
+        the mean of its points, and repeat until no centroid moves more than tol (or max_iter
+        iterations). A centroid that loses all its points is moved to the point furthest from
+        its centroid.
+
+        After fit(), labels holds the cluster of every point, and groups(X) gives the points of
+        each cluster as a list of arrays, the same as `groups` in the notebook.
+    """
+
+    def __init__(self, k, tol=1e-6, max_iter=300, chunk=2**16, seed=None):
+        self.k = k
+        self.tol = tol
+        self.max_iter = max_iter
+        self.chunk = chunk
+        self.rng = np.random.default_rng(seed)
+        self.centroids = None
+
+    def fit(self, X, init=None):
+        X = np.asarray(X, dtype=float)
+        C = kmeans_pp(X, self.k, self.rng) if init is None else np.array(init, dtype=float)
+        for it in range(1, self.max_iter+1):
+            labels, dist = assign(X, C, self.chunk)
+            sums, counts = centroid_sums(X, labels, self.k)
+            C_new = sums/np.maximum(counts, 1)[:, None]
+            for i in np.flatnonzero(counts == 0):
+                far = dist.argmax()
+                C_new[i] = X[far]
+                dist[far] = 0.
+            shift = np.sqrt(((C_new-C)**2).sum(axis=1)).max()
+            C = C_new
+            if shift < self.tol:
+                break
+        self.centroids = C
+        self.labels, dist = assign(X, C, self.chunk)
+        self.inertia = dist.sum()
+        self.iterations = it
+        return self
+
+    def predict(self, X):
+        return assign(np.asarray(X, dtype=float), self.centroids, self.chunk)[0]
+
+    def groups(self, X):
+        order = np.argsort(self.labels, kind="stable")
+        bounds = np.cumsum(np.bincount(self.labels, minlength=self.k))[:-1]
+        return np.split(np.asarray(X)[order], bounds)
+
+class MiniBatchKMeans(KMeans):
+    """
+        Mini-batch k-means (Sculley, 2010) for data that's too big to pass over many times, or
+        that arrives as a stream. Each batch is assigned to the current centroids, and every
+        centroid moves towards the mean of its batch points with a step size of 1/(points it
+        has seen so far), so the centroids are running averages that settle down over time.
+
+        fit() takes either an array, which is sampled in random batches, or a function that
+        returns a fresh iterable of batches each time it's called (e.g. chunks of a memmap or a
+        file). partial_fit(batch) does a single update, for true streaming, and carries on from
+        wherever the centroids and their counts are. fit() always starts over.
+    """
+
+    def __init__(self, k, batch_size=4096, epochs=10, tol=1e-3, chunk=2**16, seed=None):
+        super().__init__(k, tol=tol, chunk=chunk, seed=seed)
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.seen = np.zeros(k)
+
+    def partial_fit(self, batch):
+        batch = np.asarray(batch, dtype=float)
+        if self.centroids is None:
+            self.centroids = kmeans_pp(batch, self.k, self.rng)
+        labels, _ = assign(batch, self.centroids, self.chunk)
+        sums, counts = centroid_sums(batch, labels, self.k)
+        self.seen += counts
+        hit = counts > 0
+        step = counts[hit]/self.seen[hit]
+        self.centroids[hit] += step[:, None]*(sums[hit]/counts[hit][:, None]-self.centroids[hit])
+
+    def fit(self, data):
+        self.centroids = None
+        self.seen = np.zeros(self.k)
+        for epoch in range(self.epochs):
+            old = None if self.centroids is None else self.centroids.copy()
+            if callable(data):
+                batches = data()
+            else:
+                order = self.rng.permutation(data.shape[0])
+                batches = (data[np.sort(order[i:i+self.batch_size])] for i in range(0, data.shape[0], self.batch_size))
+            for batch in batches:
+                self.partial_fit(batch)
+            # stop once a whole pass over the data hardly moves the centroids
+            if old is not None and np.sqrt(((self.centroids-old)**2).sum(axis=1)).max() < self.tol:
+                break
+        self.iterations = epoch+1
+        if not callable(data):
+            self.labels, dist = assign(data, self.centroids, self.chunk)
+            self.inertia = dist.sum()
+        return self
+
+def outer(X):
+    # (n, dim*dim) array of the flattened outer products x*x^T of the rows of X
+    return (X[:, :, None]*X[:, None, :]).reshape(X.shape[0], -1)
+
+def logsumexp(a, axis=1):
+    # log(sum(exp(a))) without overflow or underflow, by pulling out the largest term
+    m = a.max(axis=axis, keepdims=True)
+    m[~np.isfinite(m)] = 0.
+    return np.log(np.exp(a-m).sum(axis=axis))+m.squeeze(axis)
+
+class GaussianMixture:
+    """
+        Gaussian mixture model fitted with expectation-maximization (EM). covariance is "full"
+        for a full covariance matrix per component, or "diag" for independent dimensions, which
+        is cheaper and needs less data. reg is added to the covariance diagonals, so a
+        component that collapses onto a single point can't make its covariance singular.
+
+        Every EM iteration is a single pass over the data in chunks of rows. For each chunk we
+        compute the (chunk, k) log responsibilities and add up everything the M-step needs:
+        the responsibility totals and the first and second moments. Memory therefore depends
+        on the chunk size and not on n. Iteration stops when the mean log-likelihood per point
+        improves by less than tol.
+
+        EM only finds a local maximum, and with many components, starting from k-means++ points
+        and one shared covariance tends to leave pairs of components sharing a cluster. So the
+        starting mixture comes from k-means instead, on a subsample of up to 100000 points: the
+        weights, means and covariances of its clusters. k-means has local minima of its own, so
+        with n_init > 1 it is run that many times and the fit with the lowest inertia is kept.
+        fit(X, init=(weights, means, covs)) starts from a given mixture instead. After fit(),
+        converged says whether the log-likelihood settled within max_iter iterations.
+
+        The Mahalanobis distances are expanded the same way as the k-means distances,
+
+            (x-mu)^T*P*(x-mu) = vec(x*x^T).vec(P)-2*x^T*P*mu+mu^T*P*mu
+
+        so for all points and components at once they're two matrix products with the
+        precision matrices P, which are inverted once per iteration from their Cholesky
+        factors. The outer products x*x^T also give the second moments for the M-step.
+    """
+
+    def __init__(self, k, covariance="full", tol=1e-6, max_iter=500, reg=1e-6, n_init=1, chunk=2**15, seed=None):
+        if covariance not in ("full", "diag"):
+            raise ValueError("covariance must be 'full' or 'diag', got {!r}".format(covariance))
+        self.k = k
+        self.covariance = covariance
+        self.tol = tol
+        self.max_iter = max_iter
+        self.reg = reg
+        self.n_init = n_init
+        self.chunk = chunk
+        self.rng = np.random.default_rng(seed)
+
+    def log_prob(self, X, XX=None):
+        """
+            (n, k) array of log(weight_j*N(x_i | mu_j, cov_j)). XX is the (n, dim*dim) array of
+            outer products x*x^T, if the caller already has it.
+        """
+
+        d = X.shape[1]
+        if self.covariance == "diag":
+            prec = 1./self.covs
+            quad = (X**2).dot(prec.T)-2.*X.dot((self.means*prec).T)+(self.means**2*prec).sum(axis=1)
+        else:
+            XX = outer(X) if XX is None else XX
+            quad = XX.dot(self.prec_flat)-2.*X.dot(self.prec_means.T)+self.mean_prec_mean
+        np.maximum(quad, 0., out=quad)
+        return np.log(self.weights)-0.5*(quad+self.log_det+d*np.log(2.*np.pi))
+
+    def set_covs(self, covs):
+        """
+            Sets the covariances and precomputes what log_prob needs from them (and from the
+            means, so set those first)
+        """
+
+        self.covs = covs
+        if self.covariance == "diag":
+            self.log_det = np.log(covs).sum(axis=1)
+            return
+        k, d, _ = covs.shape
+        self.chol = np.linalg.cholesky(covs)
+        L_inv = np.linalg.solve(self.chol, np.broadcast_to(np.eye(d), covs.shape))
+        prec = np.einsum('kji,kjl->kil', L_inv, L_inv)
+        self.log_det = 2.*np.log(np.diagonal(self.chol, axis1=1, axis2=2)).sum(axis=1)
+        self.prec_flat = prec.reshape(k, d*d).T
+        self.prec_means = np.einsum('kij,kj->ki', prec, self.means)
+        self.mean_prec_mean = np.einsum('ki,ki->k', self.prec_means, self.means)
+
+    def maximize(self, Nk, S1, S2, n):
+        """
+            M-step: weights, means and covariances from the responsibility totals Nk and the
+            responsibility weighted sums of x (S1) and of x*x^T, or x^2 for "diag" (S2)
+        """
+
+        # Nk can't be exactly zero, but keep it away from it anyway
+        Nk = np.maximum(Nk, 10.*np.finfo(float).eps)
+        d = S1.shape[1]
+        self.weights = Nk/n
+        self.means = S1/Nk[:, None]
+        if self.covariance == "full":
+            covs = S2.reshape(-1, d, d)/Nk[:, None, None]-self.means[:, :, None]*self.means[:, None, :]+self.reg*np.eye(d)
+        else:
+            covs = S2/Nk[:, None]-self.means**2+self.reg
+        self.set_covs(covs)
+
+    def fit(self, X, init=None):
+        X = np.asarray(X, dtype=float)
+        X = X[:, None] if X.ndim == 1 else X
+        n, d = X.shape
+
+        # work relative to the data mean, so the second moments don't lose precision
+        offset = X.mean(axis=0)
+        X = X-offset
+        if init is None:
+            sub = X[self.rng.choice(n, min(n, 100000), replace=False)]
+            fits = [KMeans(self.k, tol=1e-4, chunk=self.chunk, seed=self.rng).fit(sub) for _ in range(self.n_init)]
+            r = np.eye(self.k)[min(fits, key=lambda km: km.inertia).labels]
+            xx = outer(sub) if self.covariance == "full" else sub**2
+            self.maximize(r.sum(axis=0), r.T.dot(sub), r.T.dot(xx), sub.shape[0])
+        else:
+            weights, means, covs = init
+            self.weights = np.array(weights, dtype=float)
+            self.means = np.array(means, dtype=float)-offset
+            self.set_covs(np.array(covs, dtype=float))
+
+        prev = -np.inf
+        self.converged = False
+        for it in range(1, self.max_iter+1):
+            Nk = np.zeros(self.k)
+            S1 = np.zeros((self.k, d))
+            S2 = np.zeros((self.k, d, d)) if self.covariance == "full" else np.zeros((self.k, d))
+            ll = 0.
+            for start in range(0, n, self.chunk):
+                x = X[start:start+self.chunk]
+                xx = outer(x) if self.covariance == "full" else x**2
+                lp = self.log_prob(x, xx)
+
+                # log-sum-exp, keeping the exponentials for the responsibilities
+                m = lp.max(axis=1, keepdims=True)
+                r = np.exp(lp-m)
+                total = r.sum(axis=1, keepdims=True)
+                r /= total
+                ll += (np.log(total)+m).sum()
+                Nk += r.sum(axis=0)
+                S1 += r.T.dot(x)
+                S2 += r.T.dot(xx).reshape(S2.shape)
+            ll /= n
+            self.maximize(Nk, S1, S2, n)
+            if abs(ll-prev) < self.tol:
+                self.converged = True
+                break
+            prev = ll
+
+        self.means = self.means+offset
+        self.set_covs(self.covs)
+        self.log_likelihood = ll
+        self.iterations = it
+        return self
+
+    def score_samples(self, X):
+        """
+            Log density of every row of X under the mixture
+        """
+
+        X = np.asarray(X, dtype=float)
+        X = X[:, None] if X.ndim == 1 else X
+        return np.concatenate([logsumexp(self.log_prob(X[i:i+self.chunk])) for i in range(0, X.shape[0], self.chunk)])
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=float)
+        X = X[:, None] if X.ndim == 1 else X
+        return np.concatenate([self.log_prob(X[i:i+self.chunk]).argmax(axis=1) for i in range(0, X.shape[0], self.chunk)])
+
+    def sample(self, m):
+        """
+            m draws from the mixture in one go: the number of draws from each component comes
+            from a single multinomial draw, and every point is mean+L*z with z standard normal.
+            Returns the (m, dim) points, in random order, and the component of each.
+        """
+
+        counts = self.rng.multinomial(m, self.weights/self.weights.sum())
+        labels = self.rng.permutation(np.repeat(np.arange(self.k), counts))
+        z = self.rng.standard_normal((m, self.means.shape[1]))
+        if self.covariance == "diag":
+            return self.means[labels]+np.sqrt(self.covs[labels])*z, labels
+        return self.means[labels]+np.einsum('nij,nj->ni', self.chol[labels], z), labels
+
+def blobs(n, centres, std, rng):
+    # n points split over Gaussian blobs around each centre
+    centres = np.asarray(centres, dtype=float)
+    idx = rng.integers(centres.shape[0], size=n)
+    return centres[idx]+std*rng.standard_normal((n, centres.shape[1])), idx
+
+def main():
+    """
+        The notebook's three blobs, and then a couple of million points
+    """
+
+    rng = np.random.default_rng(0)
+    centres = [[2.5, 2.5], [-0.5, -0.5], [0.25, 2.5]]
+    X, _ = blobs(300, centres, 0.5, rng)
+    km = KMeans(3, seed=0).fit(X)
+    print("Notebook data: centroids {}, {} iterations, group sizes {}".format(
+        np.round(km.centroids, 3).tolist(), km.iterations, [g.shape[0] for g in km.groups(X)]))
+
+    for n, dim, k in [(2000000, 2, 3), (1000000, 8, 10)]:
+        X, _ = blobs(n, rng.uniform(-10., 10., (k, dim)), 1., rng)
+        t0 = time.perf_counter()
+        km = KMeans(k, seed=0).fit(X)
+        t1 = time.perf_counter()
+        mb = MiniBatchKMeans(k, seed=0).fit(X)
+        t2 = time.perf_counter()
+        print("{} points in {}-D, k = {}: KMeans {:.2f} s ({} iterations), MiniBatchKMeans {:.2f} s, inertia ratio {:.4f}".format(
+            n, dim, k, t1-t0, km.iterations, t2-t1, mb.inertia/km.inertia))
+
+    # the notebook's 1D mixture
+    x = np.concatenate([rng.normal(-1.5, 1., 250), rng.normal(3.5, 2., 250)])
+    gmm = GaussianMixture(2, seed=0).fit(x)
+    order = np.argsort(gmm.means[:, 0])
+    print("Notebook GMM: mus {}, sigmas {}, mix {}, {} iterations".format(
+        np.round(gmm.means[order, 0], 3), np.round(np.sqrt(gmm.covs[order, 0, 0]), 3), np.round(gmm.weights[order], 3), gmm.iterations))
+
+    # a million points from a 50 component mixture
+    truth = GaussianMixture(50, seed=1)
+    truth.means = rng.uniform(-20., 20., (50, 2))
+    truth.weights = rng.dirichlet(np.ones(50)*5.)
+    A = rng.normal(0., 0.6, (50, 2, 2))
+    truth.set_covs(np.einsum('kij,klj->kil', A, A)+0.05*np.eye(2))
+    t0 = time.perf_counter()
+    X, _ = truth.sample(1000000)
+    t1 = time.perf_counter()
+    print("Sampled {} points in {:.3f} s, mean log-likelihood under the true mixture {:.4f}".format(
+        X.shape[0], t1-t0, truth.score_samples(X).mean()))
+
+    # EM can only climb to a local maximum. Started from the true mixture it stays there (and
+    # fits this sample slightly better), while k-means starts get close to it, but can keep a
+    # pair of overlapping components merged and split another one in two. Diagonal covariances
+    # can't represent the tilted components at all, so they stop further away.
+    fits = [("full, from the true mixture", {"covariance": "full"}, (truth.weights, truth.means, truth.covs)),
+            ("full, best of 3 k-means starts", {"covariance": "full", "n_init": 3}, None),
+            ("diag, best of 3 k-means starts", {"covariance": "diag", "n_init": 3}, None)]
+    for name, options, init in fits:
+        t2 = time.perf_counter()
+        gmm = GaussianMixture(50, tol=1e-4, max_iter=200, seed=0, **options).fit(X, init)
+        print("k = 50, {}: mean log-likelihood {:.4f}, {} after {} iterations, {:.1f} s".format(
+            name, gmm.log_likelihood, "converged" if gmm.converged else "not converged", gmm.iterations,
+            time.perf_counter()-t2))
+    print("Far away point log density {:.1f}".format(gmm.score_samples(np.array([[1e4, 1e4]]))[0]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+    Streaming Monte Carlo integration. The notebooks draw all of their samples in one go (or
+    one per loop iteration), so memory grows with the sample count. Here the integrand is
+    evaluated one block at a time and only running statistics are kept, so memory is constant
+    however many samples we take, and we can stop as soon as the standard error is small
+    enough instead of picking a sample count up front.
+"""
+
+import time
+import numpy as np
+from collections import namedtuple
+from scipy.stats import qmc
+from scipy.special import ndtri
+
+Estimate = namedtuple("Estimate", ["value", "stderr", "samples", "converged"])
+
+class Welford:
+    """
+        Running mean and variance, updated a block at a time. Merging a whole block at once
+        (Chan et al.) gives the same answer as Welford's one-at-a-time update, without a
+        Python loop over the samples.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def update(self, values):
+        n = values.shape[0]
+        mean = values.mean()
+        total = self.count+n
+        delta = mean-self.mean
+        self.m2 += ((values-mean)**2).sum()+delta**2*self.count*n/total
+        self.mean += delta*n/total
+        self.count = total
+
+    def var(self):
+        return self.m2/(self.count-1) if self.count > 1 else np.inf
+
+    def stderr(self):
+        return np.sqrt(self.var()/self.count)
+
+class Normal:
+    """
+        Normal proposal for importance sampling, one independent normal per dimension. Points
+        are drawn by pushing uniforms through the inverse CDF, so quasi-random points stay
+        evenly spread after the transformation.
+    """
+
+    def __init__(self, mu, sigma):
+        self.mu = np.asarray(mu, dtype=float)
+        self.sigma = np.asarray(sigma, dtype=float)
+
+    def transform(self, u):
+        return self.mu+self.sigma*ndtri(u)
+
+    def pdf(self, x):
+        z = (x-self.mu)/self.sigma
+        return np.prod(np.exp(-0.5*z**2)/(self.sigma*np.sqrt(2.*np.pi)), axis=1)
+
+def integrate(f, a, b, tol=None, method="random", proposal=None, block=2**16, max_samples=10**9,
+            replicates=8, seed=None):
+    """
+        Integrates f over the box [a, b] (scalars for 1D, or arrays of bounds, one per
+        dimension). f is vectorized: it takes an (n,) array of points in 1D or an (n, dim)
+        array otherwise, and returns n values. Stops when the standard error drops below tol,
+        or after max_samples evaluations. Returns an Estimate(value, stderr, samples, converged).
+
+        method is "random" for pseudo-random points, or "sobol"/"halton" for low-discrepancy
+        sequences, which fill the box much more evenly and typically converge close to O(1/n)
+        rather than O(1/sqrt(n)). Their points aren't independent, though, so the sample variance
+        says nothing about the error. Instead we run `replicates` independently scrambled
+        sequences side by side, and take the standard error from the spread of their means.
+        In 1D, scrambling alone isn't enough: every scrambled Sobol sequence puts one point in
+        each of the 2^k equal strata, and their means come out identical, so each replicate is
+        also shifted by its own uniform random offset (mod 1). A zero spread only counts as
+        converged if f itself was constant over every point so far; otherwise it just means
+        the replicates can't see the error yet, and we keep going.
+
+        With a proposal (e.g. Normal(mu, sigma)) the points are drawn from the proposal instead
+        of uniformly over the box, and weighted by 1/q(x), i.e. importance sampling:
+
+            integral = E_q[f(x)*1(x in box)/q(x)]
+    """
+
+    a, b = np.atleast_1d(np.asarray(a, dtype=float)), np.atleast_1d(np.asarray(b, dtype=float))
+    dim = a.shape[0]
+    volume = np.prod(b-a)
+    tol = 0. if tol is None else tol
+
+    def values(u):
+        if proposal is None:
+            x = a+(b-a)*u
+            w = volume
+        else:
+            x = proposal.transform(u)
+            inside = np.all((x >= a) & (x <= b), axis=1)
+            w = inside/proposal.pdf(x)
+        y = f(x[:, 0] if dim == 1 else x)
+        return y*w
+
+    if method == "random":
+        rng = np.random.default_rng(seed)
+        stats = Welford()
+        while stats.count < max_samples:
+            n = min(block, max_samples-stats.count)
+            stats.update(values(rng.random((n, dim))))
+            if stats.count > block and stats.stderr() < tol:
+                break
+        stderr = stats.stderr()
+        return Estimate(stats.mean, stderr, stats.count, stderr < tol)
+
+    engine = {"sobol": qmc.Sobol, "halton": qmc.Halton}[method]
+    seeds = np.random.SeedSequence(seed).spawn(replicates)
+    rngs = [np.random.default_rng(s) for s in seeds]
+    engines = [engine(dim, scramble=True, seed=rng) for rng in rngs]
+    shifts = [rng.random(dim) if dim == 1 else None for rng in rngs]
+    per = max(1, block//replicates)
+    sums = np.zeros(replicates)
+    count = 0
+    lo, hi = np.inf, -np.inf
+    while count*replicates < max_samples:
+        for r, e in enumerate(engines):
+            u = e.random(per)
+            if shifts[r] is not None:
+                u += shifts[r]
+                u %= 1.
+            v = values(u)
+            lo, hi = min(lo, v.min()), max(hi, v.max())
+            sums[r] += v.sum()
+        count += per
+        means = sums/count
+        stderr = means.std(ddof=1)/np.sqrt(replicates)
+        converged = stderr < tol and (stderr > 0. or lo == hi)
+        if count > per and converged:
+            break
+    return Estimate(means.mean(), stderr, count*replicates, converged)
+
+def main():
+    """
+        The notebook examples, run to a requested standard error with each method
+    """
+
+    from math import pi
+    cases = [("x^2 on [0, 6]", lambda x: x**2, 0., 6., None, 72.),
+            ("x^2 on [0, 6], importance sampled", lambda x: x**2, 0., 6., Normal(3.5, 2.), 72.),
+            ("pi, indicator of unit circle", lambda x: (x**2).sum(axis=1) < 1., [-1., -1.], [1., 1.], None, pi),
+            ("exp(g(x)*y) on [0,1]x[0,2]", lambda x: np.exp(np.sqrt(1.25+np.cos(2*pi*x[:, 0]))*x[:, 1]),
+                [0., 0.], [1., 2.], None, None)]
+    tol = 1e-3
+    for name, f, a, b, proposal, exact in cases:
+        print(name)
+        for method in ["random", "sobol", "halton"]:
+            t0 = time.perf_counter()
+            est = integrate(f, a, b, tol=tol, method=method, proposal=proposal, max_samples=10**8, seed=0)
+            err = "" if exact is None else ", error {:.1e}".format(abs(est.value-exact))
+            print("    {:7s}: {:.6f} +- {:.1e}{}, {} samples, {:.2f} s".format(
+                method, est.value, est.stderr, err, est.samples, time.perf_counter()-t0))
+
+if __name__ == "__main__":
+    main()
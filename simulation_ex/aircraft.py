@@ -0,0 +1,230 @@
+import numpy as np
+from math import sqrt, pi
+from collections.abc import Mapping
+from integrators import INTEGRATORS
+
+# raw parameters (see config.py), and the options that take string values
+RAW = ["mass", "prop_radius", "n_motors", "hov_p", "l", "Jxx", "Jyy", "Jzz", "kt", "kq", "kd", "km", "g", "dt"]
+OPTIONS = {"integrator": "semi_implicit",
+            "attitude": "euler",
+            "layout": "+"}
+
+# derived quantities, in the order they are packed into a flat float64 buffer
+SCALARS = ["hov_rpm", "max_rpm", "max_thrust", "terminal_velocity", "terminal_rotation"]
+ARRAYS = [("J", (3, 3)),
+        ("J_diag", (3,)),
+        ("J_inv", (3, 3)),
+        ("J_inv_diag", (3,)),
+        ("G", (3, 1)),
+        ("arm_angles", (4,)),
+        ("mixer", (4, 4)),
+        ("u_to_rpm", (4, 4)),
+        ("moment_arm", (3, 4))]
+
+class AircraftParams(Mapping):
+    """
+        Immutable, validated aircraft parameters, with every derived quantity the simulations
+        need computed once up front:
+
+            J, J_inv            -- inertia matrix and its inverse (and the diagonals J_diag, J_inv_diag)
+            G                   -- gravity vector in the inertial frame
+            mixer               -- maps rpm^2 to [thrust, Mx, My, Mz]
+            u_to_rpm            -- inverse of the mixer, maps [thrust, Mx, My, Mz] to rpm^2
+            moment_arm          -- bottom three rows of the mixer, kt and l already multiplied in
+            hov_rpm, max_rpm, max_thrust, terminal_velocity, terminal_rotation
+
+        Build one with AircraftParams(config.params). Bad configs fail here with a list of
+        everything that is wrong, instead of deep inside a run.
+
+        The motor layout is set with params["layout"]. For a '+' quadrotor the arms lie along
+        the body axes; for an 'x' quadrotor they are rotated by pi/4 around the body z-axis.
+        Thrust is unaffected, but the roll and pitch moment arms change, which all ends up in
+        the mixer.
+
+        AircraftParams is also a read-only Mapping of the raw values, so it can be passed
+        anywhere a params dict is expected, and dict(p) gives the params dict back. Array
+        attributes are read-only. For sharing across processes, share() puts all the numbers
+        into one block of shared memory and returns a small handle, and attach(handle) rebuilds
+        the object in another process as views into that block, without copying or re-deriving
+        anything.
+    """
+
+    def __init__(self, params, _packed=None):
+        params = dict(params)
+        extra = {k: v for k, v in params.items() if k not in RAW and k not in OPTIONS}
+        options = {k: params.get(k, v) for k, v in OPTIONS.items()}
+        validate(params, options)
+
+        if _packed is None:
+            _packed = np.zeros(pack_size())
+            fill(_packed, params, options)
+        _packed.flags.writeable = False
+
+        set_ = object.__setattr__
+        set_(self, "_raw", {k: params[k] for k in RAW})
+        set_(self, "_options", options)
+        set_(self, "_extra", extra)
+        set_(self, "_packed", _packed)
+        set_(self, "_shm", None)
+        for key in RAW:
+            set_(self, key, params[key])
+        for key, value in options.items():
+            set_(self, key, value)
+        for key, value in zip(SCALARS, _packed[:len(SCALARS)]):
+            set_(self, key, float(value))
+        for key, (start, shape) in offsets().items():
+            size = int(np.prod(shape))
+            set_(self, key, _packed[start:start+size].reshape(shape))
+
+    @classmethod
+    def create(cls, params):
+        """
+            Returns params unchanged if it's already an AircraftParams, so simulations can
+            accept either a dict or an AircraftParams without re-validating.
+        """
+
+        if isinstance(params, cls):
+            return params
+        return cls(params)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("AircraftParams is immutable; build a new one from a modified dict")
+
+    def __getitem__(self, key):
+        for d in (self._raw, self._options, self._extra):
+            if key in d:
+                return d[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from self._raw
+        yield from self._options
+        yield from self._extra
+
+    def __len__(self):
+        return len(self._raw)+len(self._options)+len(self._extra)
+
+    def __repr__(self):
+        return "AircraftParams({})".format(dict(self))
+
+    def __reduce__(self):
+        return (AircraftParams, (dict(self),))
+
+    def replace(self, **changes):
+        """
+            New AircraftParams with some values changed
+        """
+
+        params = dict(self)
+        params.update(changes)
+        return AircraftParams(params)
+
+    def share(self):
+        """
+            Copies the packed numbers into shared memory and returns (shm, handle). handle is a
+            small tuple that pickles cheaply; pass it to worker processes and call
+            AircraftParams.attach(handle) there. Keep shm alive in the parent for as long as the
+            workers need it, then call shm.close() and shm.unlink().
+        """
+
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(create=True, size=self._packed.nbytes)
+        np.ndarray(self._packed.shape, dtype=np.float64, buffer=shm.buf)[:] = self._packed
+        handle = (shm.name, self._packed.shape[0], self._raw, self._options, self._extra)
+        return shm, handle
+
+    @classmethod
+    def attach(cls, handle):
+        """
+            Rebuilds an AircraftParams from a handle returned by share(). The derived arrays are
+            views into the shared memory block.
+        """
+
+        from multiprocessing import shared_memory
+        name, size, raw, options, extra = handle
+        shm = shared_memory.SharedMemory(name=name)
+        packed = np.ndarray((size,), dtype=np.float64, buffer=shm.buf)
+        params = dict(raw)
+        params.update(options)
+        params.update(extra)
+        p = cls(params, _packed=packed)
+        object.__setattr__(p, "_shm", shm)
+        return p
+
+def validate(params, options):
+    """
+        Raises a ValueError listing every problem with the params dict
+    """
+
+    errors = []
+    for key in RAW:
+        if key not in params:
+            errors.append("missing '{}'".format(key))
+        elif not isinstance(params[key], (int, float, np.number)) or isinstance(params[key], bool):
+            errors.append("'{}' must be a number, got {!r}".format(key, params[key]))
+    if not errors:
+        for key in RAW:
+            if key != "n_motors" and not params[key] > 0.:
+                errors.append("'{}' must be positive, got {}".format(key, params[key]))
+        if params["n_motors"] != 4:
+            errors.append("'n_motors' must be 4 for a quadrotor, got {}".format(params["n_motors"]))
+        if not 0. < params["hov_p"] < 1.:
+            errors.append("'hov_p' must be between 0 and 1, got {}".format(params["hov_p"]))
+    if options["layout"] not in ("+", "x"):
+        errors.append("'layout' must be '+' or 'x', got {!r}".format(options["layout"]))
+    if options["attitude"] not in ("euler", "quaternion"):
+        errors.append("'attitude' must be 'euler' or 'quaternion', got {!r}".format(options["attitude"]))
+    if options["integrator"] not in INTEGRATORS:
+        errors.append("'integrator' must be one of {}, got {!r}".format(", ".join(INTEGRATORS), options["integrator"]))
+    if errors:
+        raise ValueError("Invalid aircraft params: "+"; ".join(errors))
+
+def offsets():
+    out = {}
+    start = len(SCALARS)
+    for key, shape in ARRAYS:
+        out[key] = (start, shape)
+        start += int(np.prod(shape))
+    return out
+
+def pack_size():
+    return len(SCALARS)+sum(int(np.prod(shape)) for _, shape in ARRAYS)
+
+def fill(packed, params, options):
+    """
+        Computes the derived quantities and writes them into the flat buffer packed
+    """
+
+    mass, g, kt, kq, l = params["mass"], params["g"], params["kt"], params["kq"], params["l"]
+    J_diag = np.array([params["Jxx"], params["Jyy"], params["Jzz"]], dtype=float)
+
+    # motor i sits at arm angle phi_i. For '+' these are 0, pi/2, pi, 3pi/2, which reproduces
+    # the original mixer; 'x' rotates every arm by pi/4.
+    offset = pi/4. if options["layout"] == "x" else 0.
+    arm_angles = np.array([offset+i*pi/2. for i in range(4)])
+    roll = np.round(np.sin(arm_angles), 15)
+    pitch = np.round(-np.cos(arm_angles), 15)
+    mixer = np.array([[kt, kt, kt, kt],
+                    l*kt*roll,
+                    l*kt*pitch,
+                    [-kq, kq, -kq, kq]])
+
+    # important physical limits
+    hov_rpm = sqrt((mass*g)/params["n_motors"]/kt)
+    max_rpm = sqrt(1./params["hov_p"])*hov_rpm
+    max_thrust = kt*max_rpm**2
+    terminal_velocity = sqrt((max_thrust+mass*g)/params["kd"])
+    terminal_rotation = sqrt(l*max_thrust/params["km"])
+
+    values = {"J": np.diag(J_diag),
+            "J_diag": J_diag,
+            "J_inv": np.diag(1./J_diag),
+            "J_inv_diag": 1./J_diag,
+            "G": np.array([[0.], [0.], [-g]]),
+            "arm_angles": arm_angles,
+            "mixer": mixer,
+            "u_to_rpm": np.linalg.inv(mixer),
+            "moment_arm": mixer[1:]}
+    packed[:len(SCALARS)] = [hov_rpm, max_rpm, max_thrust, terminal_velocity, terminal_rotation]
+    for key, (start, shape) in offsets().items():
+        packed[start:start+int(np.prod(shape))] = np.ravel(values[key])
@@ -1,25 +1,41 @@
-from mpl_toolkits.mplot3d import Axes3D
-import matplotlib.pyplot as pl
-from math import sin, cos, pi
+from math import pi
 import numpy as np
-import numpy.matlib
 
 class Visualization:
+    """
+        Draws the aircraft as a body axes triad plus four rotor circles. The rotor circles are
+        stored once as a single (4, n+1, 3) array of points in the body frame, so putting them in
+        the inertial frame is one matrix multiply with the body-to-inertial matrix R and a
+        broadcast add of the position. They are drawn with one persistent Line3DCollection per
+        axes, and the body axes with another, which are updated in place on every call instead
+        of adding new artists. The same path draws a whole swarm (e.g. a QuadrotorBatch) in one
+        frame with draw_swarm().
+
+        mplot3d is imported when the first Visualization is created rather than with the module,
+        so anything that only imports this module (e.g. for type checks, or a physics-only worker
+        process) doesn't pay for matplotlib.
+    """
+
     def __init__(self, aircraft, n, quaternion=False):
+        from mpl_toolkits.mplot3d.art3d import Line3DCollection
+        self.Line3DCollection = Line3DCollection
         self.aircraft = aircraft
         self.r = aircraft.prop_radius
         self.l = aircraft.l
         self.n = n
 
-        self.p1 = np.array([[cos(2*pi/n*x)*self.r, sin(2*pi/n*x)*self.r, 0] for x in range(n+1)])
-        self.p2 = np.array([[cos(2*pi/n*x)*self.r, sin(2*pi/n*x)*self.r, 0] for x in range(n+1)])
-        self.p3 = np.array([[cos(2*pi/n*x)*self.r, sin(2*pi/n*x)*self.r, 0] for x in range(n+1)])
-        self.p4 = np.array([[cos(2*pi/n*x)*self.r, sin(2*pi/n*x)*self.r, 0] for x in range(n+1)])
+        # rotor hub positions, rotated by pi/4 about the body z-axis for an 'x' layout
+        params = getattr(aircraft, "params", None)
+        offset = pi/4. if getattr(params, "layout", "+") == "x" else 0.
+        hub_angles = offset+np.array([0., -pi/2., pi, pi/2.])
+        hubs = self.l*np.stack([np.cos(hub_angles), np.sin(hub_angles), np.zeros(4)], axis=1)
 
-        self.p1 += np.array([[self.l, 0.0, 0.0] for x in range(n+1)])
-        self.p2 += np.array([[0.0, -self.l, 0.0] for x in range(n+1)])
-        self.p3 += np.array([[-self.l, 0.0, 0.0] for x in range(n+1)])
-        self.p4 += np.array([[0.0, self.l, 0.0] for x in range(n+1)])
+        angles = 2*pi/n*np.arange(n+1)
+        circle = self.r*np.stack([np.cos(angles), np.sin(angles), np.zeros(n+1)], axis=1)
+        self.rotors = circle[None, :, :]+hubs[:, None, :]
+        self.p1, self.p2, self.p3, self.p4 = self.rotors
+
+        self.artists = {}
 
         if quaternion:
             self.x_i = np.array([[0.],
@@ -37,64 +53,74 @@ class Visualization:
             self.q_mult = self.aircraft.q_mult
             self.q_conj = self.aircraft.q_conj
 
+    def transform(self, xyz, R):
+        """
+            Rotor points in the inertial frame for one vehicle at position xyz (3,) with
+            body-to-inertial matrix R (3, 3), or for N vehicles with xyz (N, 3) and R (N, 3, 3).
+            Returns (4, n+1, 3) or (N, 4, n+1, 3).
+        """
+
+        if R.ndim == 2:
+            return self.rotors.dot(R.T)+xyz
+        return np.einsum('kpj,nij->nkpi', self.rotors, R)+xyz[:, None, None, :]
+
+    def draw_swarm(self, ax, xyz, R):
+        """
+            Draws N vehicles at positions xyz (N, 3) with body-to-inertial matrices R (N, 3, 3)
+            in one go. Every rotor circle of every vehicle goes into the same Line3DCollection.
+            The artists are created on the first draw on ax (or after ax has been cleared) and
+            updated in place after that.
+        """
+
+        xyz = np.asarray(xyz).reshape(-1, 3)
+        R = np.asarray(R).reshape(-1, 3, 3)
+
+        # body axes are the columns of R; segments go from xyz to xyz+axis
+        axes = np.swapaxes(R, 1, 2)
+        body_segs = np.stack([np.broadcast_to(xyz[:, None, :], axes.shape), xyz[:, None, :]+axes], axis=2)
+        body_segs = body_segs.reshape(-1, 2, 3)
+        body_colors = np.tile(['red', 'green', 'blue'], xyz.shape[0])
+        rotor_segs = self.transform(xyz, R).reshape(-1, self.n+1, 3)
+
+        art = self.artists.get(ax)
+        if art is None or art[2] not in ax.collections:
+            centres, = ax.plot(xyz[:, 0], xyz[:, 1], xyz[:, 2], 'o', color='black')
+            body = self.Line3DCollection(body_segs, colors=body_colors)
+            rotors = self.Line3DCollection(rotor_segs, colors='black')
+            ax.add_collection3d(body)
+            ax.add_collection3d(rotors)
+            self.artists[ax] = (centres, body, rotors)
+        else:
+            centres, body, rotors = art
+            centres.set_data_3d(xyz[:, 0], xyz[:, 1], xyz[:, 2])
+            body.set_segments(body_segs)
+            body.set_color(body_colors)
+            rotors.set_segments(rotor_segs)
+
+    def draw_pose(self, ax, xyz, R):
+        """
+            Draws a single vehicle at position xyz with body-to-inertial matrix R
+        """
+
+        self.draw_swarm(ax, np.ravel(xyz)[None, :], R[None, :, :])
+
+    def draw_batch(self, ax, batch):
+        """
+            Draws every vehicle in a QuadrotorBatch
+        """
+
+        self.draw_swarm(ax, batch.xyz, batch.R1(batch.zeta))
+
     def draw3d(self, ax):
-        xyz, R = self.aircraft.xyz, self.aircraft.R1(self.aircraft.zeta).T
-        
-        ax.scatter(xyz[0,0], xyz[1,0], xyz[2,0], color='black')
-        ax.quiver(xyz[0,0], xyz[1,0], xyz[2,0], R[0,0], R[0,1], R[0,2], pivot='tail', color='red')
-        ax.quiver(xyz[0,0], xyz[1,0], xyz[2,0], R[1,0], R[1,1], R[1,2], pivot='tail', color='green')
-        ax.quiver(xyz[0,0], xyz[1,0], xyz[2,0], R[2,0], R[2,1], R[2,2], pivot='tail', color='blue')
-       
-        # rotate to aircraft attitude
-        p1 = np.einsum('ij,kj->ik', self.p1, R.T)
-        p2 = np.einsum('ij,kj->ik', self.p2, R.T)
-        p3 = np.einsum('ij,kj->ik', self.p3, R.T)
-        p4 = np.einsum('ij,kj->ik', self.p4, R.T)
-
-        # shift to z
-        p1 = np.matlib.repmat(xyz.T,self.n+1,1)+p1
-        p2 = np.matlib.repmat(xyz.T,self.n+1,1)+p2
-        p3 = np.matlib.repmat(xyz.T,self.n+1,1)+p3
-        p4 = np.matlib.repmat(xyz.T,self.n+1,1)+p4
-
-        # plot rotated 
-        ax.plot(p1[:,0], p1[:,1], p1[:,2],'k')
-        ax.plot(p2[:,0], p2[:,1], p2[:,2],'k')
-        ax.plot(p3[:,0], p3[:,1], p3[:,2],'k')
-        ax.plot(p4[:,0], p4[:,1], p4[:,2],'k')
+        xyz, R = self.aircraft.xyz, self.aircraft.R1(self.aircraft.zeta)
+        self.draw_pose(ax, xyz, R)
 
     def draw3d_quat(self, ax):
         xyz, q = self.aircraft.xyz, self.aircraft.q
         Q_inv = self.q_conj(q)
-        Q = self.q_mult(Q_inv)
         r = self.R(Q_inv)
-        x_b = Q.dot(self.q_mult(self.x_i).dot(q))
-        y_b = Q.dot(self.q_mult(self.y_i).dot(q))
-        z_b = Q.dot(self.q_mult(self.z_i).dot(q))
-
-        ax.scatter(xyz[0,0], xyz[1,0], xyz[2,0], color='black')
-        ax.quiver(xyz[0,0], xyz[1,0], xyz[2,0], x_b[1,0], x_b[2,0], x_b[3,0], pivot='tail', color='red')
-        ax.quiver(xyz[0,0], xyz[1,0], xyz[2,0], y_b[1,0], y_b[2,0], y_b[3,0], pivot='tail', color='green')
-        ax.quiver(xyz[0,0], xyz[1,0], xyz[2,0], z_b[1,0], z_b[2,0], z_b[3,0], pivot='tail', color='blue')
-
-        # rotate to aircraft attitude
-        p1 = np.einsum('ij,kj->ki', r, self.p1)
-        p2 = np.einsum('ij,kj->ki', r, self.p2)
-        p3 = np.einsum('ij,kj->ki', r, self.p3)
-        p4 = np.einsum('ij,kj->ki', r, self.p4)
-
-        # shift to xyz
-        p1 = np.matlib.repmat(xyz.T, self.n+1,1)+p1
-        p2 = np.matlib.repmat(xyz.T, self.n+1,1)+p2
-        p3 = np.matlib.repmat(xyz.T, self.n+1,1)+p3
-        p4 = np.matlib.repmat(xyz.T, self.n+1,1)+p4
-
-        # plot rotated 
-        ax.plot(p1[:,0], p1[:,1], p1[:,2],'k')
-        ax.plot(p2[:,0], p2[:,1], p2[:,2],'k')
-        ax.plot(p3[:,0], p3[:,1], p3[:,2],'k')
-        ax.plot(p4[:,0], p4[:,1], p4[:,2],'k')
-    
+        self.draw_pose(ax, xyz, r)
+
     def R(self, p):
         p0, p1, p2, p3 = p[0,0], p[1,0], p[2,0], p[3,0]
         x11 = p0**2+p1**2-p2**2-p3**2
@@ -109,7 +135,6 @@ class Visualization:
         return np.array([[x11, x12, x13],
                         [x21, x22, x23],
                         [x31, x32, x33]])
-    
+
     def draw_goal(self, ax, goal):
         ax.scatter(goal[0,0], goal[1,0], goal[2,0], color='green')
-
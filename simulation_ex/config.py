@@ -15,11 +15,28 @@
         km = aerodynamic moment coefficient
         g = gravitational acceleration (positive in config, corrected in simulated)
         dt = solver time step
-    """
+        integrator = time integrator used by Quadrotor.step(); "semi_implicit", "rk4" or "rk45"
+        attitude = attitude representation; "euler" (zeta) or "quaternion" (q)
+        layout = motor layout; "+" (arms along the body axes) or "x" (arms rotated by pi/4)
 
-# Implement a dictionary here containing the parameters for the simulation. You can find the parameter
-# values in Table 1 of the handout. If you’re unsure of how to implement a dictionary, refer to the
-# workshop slides and the cheatsheet (hint: dictionary = {“name1”: value1, “name2”: value2, … “nameN”: valueN}).
-# the name of the dictionary should be params.
+    The raw dict is checked and turned into an AircraftParams (see aircraft.py) by the simulations,
+    which also computes the derived quantities (mixer, hover rpm, limits, ...) once.
+    """
 
-params = None
+params = {"mass": 0.65,
+            "prop_radius": 0.1,
+            "n_motors": 4,
+            "hov_p": 0.5,
+            "l": 0.23,
+            "Jxx": 7.5e-3,
+            "Jyy": 7.5e-3,
+            "Jzz": 1.3e-2,
+            "kt": 3.13e-5,
+            "kq": 7.5e-7,
+            "kd": 9e-3,
+            "km": 9e-4,
+            "g": 9.81,
+            "dt": 0.01,
+            "integrator": "semi_implicit",
+            "attitude": "euler",
+            "layout": "+"}
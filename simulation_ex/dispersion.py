@@ -0,0 +1,257 @@
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import quadrotor as quad
+from scheduler import Scheduler
+
+class ConstantSchedule:
+    def __init__(self, rpm):
+        self.rpm = np.asarray(rpm, dtype=float)
+
+    def __call__(self, t, aircraft):
+        return self.rpm
+
+def hold(rpm):
+    """
+        Control schedule that holds a constant rpm command. Returns a picklable object so it can
+        be sent to worker processes.
+    """
+
+    return ConstantSchedule(rpm)
+
+class Dispersion:
+    """
+        Monte Carlo dispersion study for the quadrotor. Each case draws a perturbed copy of the
+        params dict and an initial state, flies the same control schedule, and boils the whole
+        trajectory down to a small summary vector. The cases are independent, so we fan them out
+        over a process pool in chunks and stream the summaries back as they finish.
+
+        spec maps params keys to distributions. A distribution is a tuple:
+
+            ("normal", mean, std)
+            ("uniform", low, high)
+            ("lognormal", mean, sigma)      -- of the underlying normal, as in numpy
+            ("scale", low, high)            -- nominal value times a uniform factor
+
+        or any callable taking a numpy Generator and returning a value. init_spec does the same
+        for the initial state, with keys "xyz", "zeta", "uvw" and "pqr"; each draw is a 3-vector.
+
+        schedule is called as schedule(t, aircraft) once per control tick and returns the rpm
+        command that is held for the following ctrl_dt. The case is flown by scheduler.Scheduler,
+        so ctrl_dt doesn't have to be a multiple of params["dt"]. It has to be picklable, so use a module
+        level function or an object like ConstantSchedule, not a lambda.
+
+        Case i is always seeded from SeedSequence(seed, spawn_key=(i,)), so every case is
+        reproducible on its own, and the results don't depend on the number of workers, the
+        chunk size, or the order in which the chunks finish.
+    """
+
+    def __init__(self, params, spec, schedule, T, ctrl_dt, init_spec=None, summarize=None, seed=0):
+        self.params = dict(params)
+        self.spec = dict(spec)
+        self.init_spec = dict(init_spec or {})
+        self.schedule = schedule
+        self.T = T
+        self.ctrl_dt = ctrl_dt
+        self.summarize = summarize or default_summary
+        self.seed = seed
+
+    def rng(self, case):
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(case,)))
+
+    def sample_case(self, case):
+        """
+            Returns the params dict, the initial state (xyz, zeta, uvw, pqr) and the vector of
+            sampled parameter values for case number case.
+        """
+
+        rng = self.rng(case)
+        params = dict(self.params)
+        for key in sorted(self.spec):
+            params[key] = draw(rng, self.spec[key], self.params.get(key))
+        state = []
+        for key in ["xyz", "zeta", "uvw", "pqr"]:
+            if key in self.init_spec:
+                state.append(np.reshape(draw(rng, self.init_spec[key], 0., size=3), (3, 1)).astype(float))
+            else:
+                state.append(np.zeros((3, 1)))
+        sampled = np.array([params[key] for key in sorted(self.spec)], dtype=float)
+        return params, state, sampled
+
+    def run_case(self, case):
+        """
+            Flies one case and returns its summary vector: [case, sampled params..., summary...]
+        """
+
+        params, state, sampled = self.sample_case(case)
+        aircraft = quad.Quadrotor(params)
+        aircraft.set_state(*state)
+
+        rows = []
+        def record(t, aircraft):
+            rows.append(np.vstack(aircraft.get_state())[:, 0])
+
+        scheduler = Scheduler(aircraft)
+        scheduler.add(self.schedule, self.ctrl_dt, "schedule")
+        scheduler.add(record, self.ctrl_dt, "record")
+        scheduler.run(self.T)
+        traj = np.array(rows)
+        return np.concatenate([[case], sampled, self.summarize(traj)])
+
+    def digest(self):
+        """
+            sha256 of everything that defines a case other than its number: params, spec,
+            init_spec, T, ctrl_dt, the schedule and the summary function. The schedule and the
+            functions are pickled, so functions are compared by name, not by their code.
+        """
+
+        sweep = [sorted(self.params.items()), sorted(self.spec.items()), sorted(self.init_spec.items()),
+                self.T, self.ctrl_dt, self.schedule, self.summarize]
+        return hashlib.sha256(pickle.dumps(sweep, protocol=4)).hexdigest()
+
+    def run(self, n_cases, workers=None, chunk_size=None, out_dir=None):
+        """
+            Runs cases 0..n_cases-1 and yields (case_ids, summaries) arrays as chunks complete.
+            Chunks finish in whatever order the workers get to them, so sort on case_ids if the
+            order matters.
+
+            The default chunk size depends only on n_cases (up to 64 cases, and at least 256
+            chunks when there are enough cases), not on the number of workers, so the same sweep
+            is cut into the same chunks on any machine.
+
+            If out_dir is given, each finished chunk is written there as chunk_<first case>.npy,
+            and chunks whose file already exists are loaded instead of being re-run. This is how
+            an interrupted sweep is resumed: call run() again with the same arguments and only
+            the missing chunks are computed. Use load() to gather everything afterwards. The
+            chunk files only make sense for the sweep and the chunking that wrote them, so n_cases,
+            chunk_size, seed and digest() are recorded in out_dir/manifest.json, and resuming
+            with a different sweep or chunking raises ValueError rather than mixing in stale or
+            overlapping chunks.
+        """
+
+        workers = workers or os.cpu_count()
+        if chunk_size is None:
+            chunk_size = max(1, min(64, n_cases//256))
+        chunks = [range(i, min(i+chunk_size, n_cases)) for i in range(0, n_cases, chunk_size)]
+        if out_dir:
+            check_manifest(out_dir, {"n_cases": n_cases, "chunk_size": chunk_size, "seed": self.seed,
+                                    "sweep": self.digest()})
+
+        todo = []
+        for chunk in chunks:
+            path = chunk_path(out_dir, chunk.start) if out_dir else None
+            if path and os.path.exists(path):
+                data = np.load(path)
+                yield data[:, 0].astype(int), data[:, 1:]
+            else:
+                todo.append(chunk)
+        if not todo:
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_chunk, self, list(chunk)): chunk for chunk in todo}
+            for future in as_completed(futures):
+                data = future.result()
+                if out_dir:
+                    path = chunk_path(out_dir, futures[future].start)
+                    np.save(path+".tmp.npy", data)
+                    os.replace(path+".tmp.npy", path)
+                yield data[:, 0].astype(int), data[:, 1:]
+
+def draw(rng, dist, nominal, size=None):
+    """
+        Draws a value from a distribution spec (see Dispersion)
+    """
+
+    if callable(dist):
+        return dist(rng)
+    kind, a, b = dist
+    if kind == "normal":
+        return rng.normal(a, b, size)
+    if kind == "uniform":
+        return rng.uniform(a, b, size)
+    if kind == "lognormal":
+        return rng.lognormal(a, b, size)
+    if kind == "scale":
+        return nominal*rng.uniform(a, b, size)
+    raise ValueError("Unknown distribution '{}'".format(kind))
+
+def run_chunk(dispersion, cases):
+    return np.vstack([dispersion.run_case(case) for case in cases])
+
+def chunk_path(out_dir, start):
+    return os.path.join(out_dir, "chunk_{:08d}.npy".format(start))
+
+def check_manifest(out_dir, manifest):
+    """
+        Writes manifest to out_dir/manifest.json, or if it's already there, checks that it
+        matches the one that was written with the existing chunks
+    """
+
+    path = os.path.join(out_dir, "manifest.json")
+    if os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+        if saved != manifest:
+            raise ValueError("{} was written by a different sweep ({}), can't resume it with {}".format(
+                out_dir, saved, manifest))
+        return
+    os.makedirs(out_dir, exist_ok=True)
+    if any(f.startswith("chunk_") for f in os.listdir(out_dir)):
+        raise ValueError("{} has chunks but no manifest, so we can't tell how they were cut".format(out_dir))
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+
+def default_summary(traj):
+    """
+        Final state, followed by min/max altitude, max distance from the start point, and max
+        speed. traj is (ticks+1, n_states) with xyz in the first three columns and uvw in the
+        three columns before pqr.
+    """
+
+    xyz = traj[:, 0:3]
+    uvw = traj[:, -6:-3]
+    dist = np.linalg.norm(xyz-xyz[0], axis=1)
+    speed = np.linalg.norm(uvw, axis=1)
+    return np.concatenate([traj[-1], [xyz[:, 2].min(), xyz[:, 2].max(), dist.max(), speed.max()]])
+
+def load(out_dir):
+    """
+        Gathers every chunk in out_dir into (case_ids, summaries), sorted by case
+    """
+
+    files = sorted(f for f in os.listdir(out_dir) if f.startswith("chunk_") and f.endswith(".npy") and ".tmp" not in f)
+    data = np.vstack([np.load(os.path.join(out_dir, f)) for f in files])
+    data = data[np.argsort(data[:, 0])]
+    cases = data[:, 0].astype(int)
+    if np.any(cases[1:] == cases[:-1]):
+        raise ValueError("{} has overlapping chunks".format(out_dir))
+    return cases, data[:, 1:]
+
+def main():
+    import time
+    import config as cfg
+
+    params = cfg.params
+    spec = {"mass": ("scale", 0.9, 1.1),
+            "kt": ("scale", 0.95, 1.05),
+            "kd": ("scale", 0.5, 1.5),
+            "Jxx": ("scale", 0.9, 1.1),
+            "Jyy": ("scale", 0.9, 1.1)}
+    init_spec = {"zeta": ("normal", 0., 0.05),
+                "pqr": ("normal", 0., 0.1)}
+    hov_rpm = quad.Quadrotor(params).hov_rpm
+    study = Dispersion(params, spec, hold([hov_rpm]*4), T=2., ctrl_dt=0.05, init_spec=init_spec)
+
+    t0 = time.perf_counter()
+    results = [summary for _, summary in study.run(200)]
+    summaries = np.vstack(results)
+    print("200 cases in {:.2f} s".format(time.perf_counter()-t0))
+    final_xyz = summaries[:, len(spec):len(spec)+3]
+    print("Final position mean: {}, std: {}".format(final_xyz.mean(axis=0), final_xyz.std(axis=0)))
+
+if __name__ == "__main__":
+    main()
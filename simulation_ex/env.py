@@ -0,0 +1,305 @@
+import numpy as np
+import multiprocessing as mp
+from math import pi
+from multiprocessing import shared_memory
+from quadrotor_batch import QuadrotorBatch
+
+def splitmix64(x):
+    # SplitMix64 finalizer, a good 64 bit hash; uint64 arrays wrap around on overflow
+    x = x+np.uint64(0x9E3779B97F4A7C15)
+    x = (x^(x >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+    x = (x^(x >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+    return x^(x >> np.uint64(31))
+
+def uniforms(keys, counters, k):
+    """
+        (len(keys), k) uniforms in (0, 1). Row i is a hash of keys[i] and counters[i], so each
+        row is a pure function of its own key and counter and a whole batch is a few numpy calls.
+    """
+
+    stream = counters[:, None]*np.uint64(k)+np.arange(k, dtype=np.uint64)
+    bits = splitmix64(keys[:, None]^splitmix64(stream))
+    return ((bits >> np.uint64(11)).astype(np.float64)+0.5)*2.**-53
+
+class QuadrotorVecEnv:
+    """
+        Gym-style environment running N quadrotors in lockstep on top of QuadrotorBatch, for
+        training goal-reaching controllers. Everything is an (N, ...) array, so one call to step()
+        advances every vehicle by one control step (all of the physics substeps in between are
+        done by the batch) without any per-vehicle Python. ctrl_dt has to be a whole number of
+        physics steps, otherwise the constructor raises ValueError.
+
+        Actions are (N, 4) in [-1, 1]. 0 is hover, +1 is max rpm and -1 is zero rpm, with a
+        linear map on either side of hover:
+
+            rpm = hov_rpm*(1+action)                    for action < 0
+            rpm = hov_rpm+action*(max_rpm-hov_rpm)      for action >= 0
+
+        Observations are (N, 15): the goal position relative to the vehicle (3), sin and cos
+        of the Euler angles (6), and the body rates uvw (3) and pqr (3).
+
+        The reward is minus the distance to the goal, minus a small penalty on the action. An
+        episode ends when it runs out of time (T seconds) or the vehicle strays further than
+        max_dist from its goal. Finished episodes are reset automatically inside step(): the
+        observation returned for them is the first one of the new episode, and the last one of
+        the old episode is in info["terminal_obs"], like gym's vector environments.
+
+        Each vehicle has its own random stream, seeded through reset(seeds), so a vehicle's
+        sequence of goals and initial states only depends on its own seed. The streams are
+        counter based (see uniforms()): the draws for a vehicle's k-th episode are a hash of its
+        seed and k, so resetting any subset of vehicles is one batch of numpy calls.
+    """
+
+    obs_size = 15
+    action_size = 4
+
+    def __init__(self, params, n, T=5., ctrl_dt=0.05, goal_low=(-2., -2., 1.), goal_high=(2., 2., 4.),
+                start_noise=0.05, max_dist=5., action_cost=0.01):
+        self.n = n
+        self.batch = QuadrotorBatch(params, n)
+        self.T = T
+        self.ctrl_dt = ctrl_dt
+        self.substeps = int(round(ctrl_dt/self.batch.dt))
+        if self.substeps < 1 or abs(self.substeps*self.batch.dt-ctrl_dt) > 1e-9:
+            raise ValueError("ctrl_dt={} isn't a multiple of the physics step dt={}".format(ctrl_dt, self.batch.dt))
+        self.max_steps = int(round(T/ctrl_dt))
+        self.goal_low = np.array(goal_low, dtype=float)
+        self.goal_high = np.array(goal_high, dtype=float)
+        self.start_noise = start_noise
+        self.max_dist = max_dist
+        self.action_cost = action_cost
+
+        self.goals = np.zeros((n, 3))
+        self.steps = np.zeros(n, dtype=int)
+        self.returns = np.zeros(n)
+        self.seed(range(n))
+        self.obs = np.zeros((n, self.obs_size))
+
+    def reset(self, seeds=None):
+        """
+            Starts a new episode for every vehicle and returns the (N, 15) observations. seeds
+            is an optional sequence of N seeds, one per vehicle.
+        """
+
+        if seeds is not None:
+            self.seed(seeds)
+        self._reset(np.arange(self.n))
+        return self.observe()
+
+    def seed(self, seeds):
+        # one non-negative integer seed per vehicle; episode counters start again from zero
+        self.keys = splitmix64(np.asarray(list(seeds), dtype=np.uint64).reshape(self.n))
+        self.episodes = np.zeros(self.n, dtype=np.uint64)
+
+    def _reset(self, idx):
+        """
+            Samples new goals and initial states for the vehicles in idx, all at once. The
+            initial attitude and body rate noise are normals from Box-Muller.
+        """
+
+        u = uniforms(self.keys[idx], self.episodes[idx], 9)
+        self.episodes[idx] += np.uint64(1)
+        self.goals[idx] = self.goal_low+(self.goal_high-self.goal_low)*u[:, 0:3]
+        r = self.start_noise*np.sqrt(-2.*np.log(u[:, 3:6]))
+        angle = 2.*pi*u[:, 6:9]
+        state = self.batch.state
+        state[idx] = 0.
+        state[idx, 3:6] = r*np.cos(angle)
+        state[idx, 9:12] = r*np.sin(angle)
+        self.batch.rpm[idx] = 0.
+        self.steps[idx] = 0
+        self.returns[idx] = 0.
+
+    def observe(self, out=None):
+        """
+            Builds the observation array (written into out if given)
+        """
+
+        out = self.obs if out is None else out
+        b = self.batch
+        np.subtract(self.goals, b.xyz, out=out[:, 0:3])
+        np.sin(b.zeta, out=out[:, 3:6])
+        np.cos(b.zeta, out=out[:, 6:9])
+        out[:, 9:12] = b.uvw
+        out[:, 12:15] = b.pqr
+        return out
+
+    def goal(self, i):
+        """
+            Goal of vehicle i as a 3x1 column vector, for Visualization.draw_goal
+        """
+
+        return self.goals[i][:, None].copy()
+
+    def reward(self, actions):
+        dist = np.linalg.norm(self.goals-self.batch.xyz, axis=1)
+        return -dist-self.action_cost*np.einsum('ij,ij->i', actions, actions), dist
+
+    def step(self, actions):
+        """
+            Applies (N, 4) actions for one control step. Returns (obs, reward, done, info) with
+            obs (N, 15), reward (N,), done (N,) bool, and info a dict of arrays:
+
+                truncated       -- episode ended because it ran out of time
+                terminal_obs    -- last observation of every episode that just ended (N, 15);
+                                   rows for vehicles that are still running are undefined
+                episode_return  -- total reward of the episodes that just ended (0 elsewhere)
+                episode_length  -- length of the episodes that just ended (0 elsewhere)
+        """
+
+        b = self.batch
+        actions = np.clip(actions, -1., 1.)
+        rpm = np.where(actions < 0., b.hov_rpm*(1.+actions), b.hov_rpm+actions*(b.max_rpm-b.hov_rpm))
+        b.advance(rpm, self.substeps)
+        self.steps += 1
+
+        reward, dist = self.reward(actions)
+        self.returns += reward
+        failed = dist > self.max_dist
+        truncated = self.steps >= self.max_steps
+        done = failed | truncated
+
+        info = {"truncated": truncated & ~failed,
+                "terminal_obs": self.observe().copy(),
+                "episode_return": np.where(done, self.returns, 0.),
+                "episode_length": np.where(done, self.steps, 0)}
+        idx = np.flatnonzero(done)
+        if idx.size:
+            self._reset(idx)
+        return self.observe(), reward, done, info
+
+def _worker(conn, params, n, kwargs, seeds, names, start, stop):
+    """
+        Runs envs start..stop of a ShardedVecEnv. Reads actions from, and writes observations,
+        rewards and done flags to, the shared buffers; the pipe only carries commands.
+    """
+
+    env = QuadrotorVecEnv(params, stop-start, **kwargs)
+    env.seed(seeds)
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    obs, act, rew, done, term = ShardedVecEnv.views(blocks, n)
+    sl = slice(start, stop)
+    try:
+        while True:
+            cmd, arg = conn.recv()
+            if cmd == "reset":
+                obs[sl] = env.reset(None if arg is None else arg[sl])
+            elif cmd == "step":
+                o, r, d, info = env.step(act[sl])
+                obs[sl] = o
+                rew[sl] = r
+                done[sl] = d
+                term[sl] = info["terminal_obs"]
+            elif cmd == "close":
+                break
+            conn.send(None)
+    finally:
+        for block in blocks:
+            block.close()
+        conn.close()
+
+class ShardedVecEnv:
+    """
+        QuadrotorVecEnv split over several worker processes. Each worker owns a contiguous slice
+        of the vehicles. Observations, actions, rewards, done flags and terminal observations
+        live in shared memory, so a step only sends a short command down each pipe; no arrays
+        are pickled. The interface is the same as QuadrotorVecEnv, except that info only has
+        terminal_obs. The returned arrays are views into shared memory and are overwritten by
+        the next step, so copy them if you need to keep them.
+
+        Seeds work the same way as for QuadrotorVecEnv, so for a given set of seeds the results
+        don't depend on the number of workers.
+    """
+
+    obs_size = QuadrotorVecEnv.obs_size
+    action_size = QuadrotorVecEnv.action_size
+
+    def __init__(self, params, n, workers=None, **kwargs):
+        self.n = n
+        workers = min(n, workers or mp.cpu_count())
+        sizes = [n*self.obs_size*8, n*self.action_size*8, n*8, n, n*self.obs_size*8]
+        self.blocks = [shared_memory.SharedMemory(create=True, size=max(1, size)) for size in sizes]
+        self.obs, self.actions, self.rewards, self.dones, self.terminal_obs = self.views(self.blocks, n)
+
+        bounds = np.linspace(0, n, workers+1).astype(int)
+        params = dict(params)
+        self.conns = []
+        self.procs = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            parent, child = mp.Pipe()
+            proc = mp.Process(target=_worker, args=(child, params, n, kwargs, list(range(start, stop)),
+                                                    [b.name for b in self.blocks], start, stop), daemon=True)
+            proc.start()
+            child.close()
+            self.conns.append(parent)
+            self.procs.append(proc)
+
+    @staticmethod
+    def views(blocks, n):
+        obs = np.ndarray((n, ShardedVecEnv.obs_size), dtype=np.float64, buffer=blocks[0].buf)
+        act = np.ndarray((n, ShardedVecEnv.action_size), dtype=np.float64, buffer=blocks[1].buf)
+        rew = np.ndarray((n,), dtype=np.float64, buffer=blocks[2].buf)
+        done = np.ndarray((n,), dtype=np.bool_, buffer=blocks[3].buf)
+        term = np.ndarray((n, ShardedVecEnv.obs_size), dtype=np.float64, buffer=blocks[4].buf)
+        return obs, act, rew, done, term
+
+    def _broadcast(self, cmd, arg=None):
+        for conn in self.conns:
+            conn.send((cmd, arg))
+        for conn in self.conns:
+            conn.recv()
+
+    def reset(self, seeds=None):
+        self._broadcast("reset", None if seeds is None else list(seeds))
+        return self.obs
+
+    def step(self, actions):
+        self.actions[:] = actions
+        self._broadcast("step")
+        return self.obs, self.rewards, self.dones, {"terminal_obs": self.terminal_obs}
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+        for proc in self.procs:
+            proc.join()
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.conns, self.procs, self.blocks = [], [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def main():
+    import time
+    import config as cfg
+
+    for n in [1, 100, 1000, 10000]:
+        env = QuadrotorVecEnv(cfg.params, n)
+        env.reset(seeds=range(n))
+        actions = np.zeros((n, 4))
+        steps = 100
+        t0 = time.perf_counter()
+        for _ in range(steps):
+            env.step(actions)
+        print("QuadrotorVecEnv N = {:6d}: {:10.0f} env-steps/s".format(n, n*steps/(time.perf_counter()-t0)))
+
+    n = 20000
+    with ShardedVecEnv(cfg.params, n) as env:
+        env.reset(seeds=range(n))
+        actions = np.zeros((n, 4))
+        steps = 100
+        t0 = time.perf_counter()
+        for _ in range(steps):
+            env.step(actions)
+        print("ShardedVecEnv N = {:6d}: {:10.0f} env-steps/s".format(n, n*steps/(time.perf_counter()-t0)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import numpy as np
+
+class Integrator:
+    """
+        Base class for the time integrators used by Quadrotor.step(). An integrator advances a
+        system from t to t+dt under a constant control input u (zero-order hold), where the system
+        provides:
+
+            system.derivatives(y, u)    -- the full state derivative y_dot, same shape as y
+            system.rotation(y)          -- the body-to-inertial matrix for the attitude in y
+            system.velocity_derivatives(y, u, r1)
+                                        -- the velocity rates only (rows n_pos and up)
+            system.kinematics(y, r1)    -- the position/attitude rates only (first n_pos rows)
+            system.n_pos                -- the number of position/attitude states
+
+        The state y is a column vector with positions first and velocities second, i.e. for the
+        quadrotor y = [xyz, zeta, uvw, pqr]. Every call to system.derivatives() is one evaluation
+        of the force and moment models, and is counted in n_evals so that integrators can be
+        compared on cost as well as accuracy.
+    """
+
+    def __init__(self):
+        self.n_evals = 0                        # total force evaluations since construction
+        self.last_evals = 0                     # force evaluations used by the last step
+
+    def step(self, system, y, u, dt):
+        raise NotImplementedError
+
+    def reset(self):
+        self.n_evals = 0
+        self.last_evals = 0
+
+class SemiImplicitEuler(Integrator):
+    """
+        Semi-implicit (symplectic) Euler. Velocities are stepped forward with the forces at time t,
+        and positions are then stepped forward using the new velocities. This is the original
+        Quadrotor.step() update. First order, one force evaluation per step.
+
+        The velocity update doesn't change the attitude, so the rotation matrix is built once
+        and shared by both halves, and the velocity half skips the attitude kinematics.
+    """
+
+    def step(self, system, y, u, dt):
+        n = system.n_pos
+        y = y.copy()
+        r1 = system.rotation(y)
+        y[n:] += dt*system.velocity_derivatives(y, u, r1)
+        y[:n] += dt*system.kinematics(y, r1)
+        self.last_evals = 1
+        self.n_evals += 1
+        return y
+
+class RK4(Integrator):
+    """
+        Classic fourth order Runge-Kutta. Four force evaluations per step, but the error drops
+        with dt^4, so for the same accuracy we can take much larger steps than with Euler.
+    """
+
+    def step(self, system, y, u, dt):
+        k1 = system.derivatives(y, u)
+        k2 = system.derivatives(y+0.5*dt*k1, u)
+        k3 = system.derivatives(y+0.5*dt*k2, u)
+        k4 = system.derivatives(y+dt*k3, u)
+        self.last_evals = 4
+        self.n_evals += 4
+        return y+dt/6.*(k1+2.*k2+2.*k3+k4)
+
+class DormandPrince45(Integrator):
+    """
+        Adaptive step Dormand-Prince RK5(4) with error control. Each call to step() advances the
+        system by exactly dt, but internally takes as many substeps as it needs to keep the local
+        error estimate below atol+rtol*|y|. The substep size is remembered between calls, so a
+        smooth trajectory will settle on one substep per call if dt allows it. The last stage of
+        an accepted substep is the first stage of the next one (first same as last), so an accepted
+        substep costs six force evaluations.
+    """
+
+    # Butcher tableau
+    c = np.array([0., 1./5., 3./10., 4./5., 8./9., 1., 1.])
+    a = [[],
+        [1./5.],
+        [3./40., 9./40.],
+        [44./45., -56./15., 32./9.],
+        [19372./6561., -25360./2187., 64448./6561., -212./729.],
+        [9017./3168., -355./33., 46732./5247., 49./176., -5103./18656.],
+        [35./384., 0., 500./1113., 125./192., -2187./6784., 11./84.]]
+    b5 = np.array([35./384., 0., 500./1113., 125./192., -2187./6784., 11./84., 0.])
+    b4 = np.array([5179./57600., 0., 7571./16695., 393./640., -92097./339200., 187./2100., 1./40.])
+    e = b5-b4
+
+    def __init__(self, rtol=1e-6, atol=1e-8, safety=0.9, min_factor=0.2, max_factor=5.):
+        super().__init__()
+        self.rtol = rtol
+        self.atol = atol
+        self.safety = safety
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self.h = None                           # substep size carried over between calls
+        self.n_rejected = 0
+
+    def step(self, system, y, u, dt):
+        evals = 0
+        t = 0.
+        h = dt if self.h is None else min(self.h, dt)
+        k = [None]*7
+        k[0] = system.derivatives(y, u)
+        evals += 1
+
+        while t < dt:
+            last = h >= dt-t
+            if last:
+                h = dt-t
+            for i in range(1, 7):
+                dy = sum(aij*kj for aij, kj in zip(self.a[i], k[:i]) if aij != 0.)
+                k[i] = system.derivatives(y+h*dy, u)
+            evals += 6
+            y_new = y+h*sum(bi*ki for bi, ki in zip(self.b5, k) if bi != 0.)
+
+            # error estimate is the difference between the 5th and 4th order solutions
+            err = h*sum(ei*ki for ei, ki in zip(self.e, k))
+            scale = self.atol+self.rtol*np.maximum(np.abs(y), np.abs(y_new))
+            err_norm = np.sqrt(np.mean((err/scale)**2))
+
+            if err_norm <= 1.:
+                t = dt if last else t+h
+                y = y_new
+                k[0] = k[6]
+                factor = self.max_factor if err_norm == 0. else self.safety*err_norm**-0.2
+                factor = min(self.max_factor, max(self.min_factor, factor))
+                if not last:
+                    h *= factor
+                else:
+                    self.h = h*factor if h*factor < dt else None
+            else:
+                self.n_rejected += 1
+                h *= max(self.min_factor, self.safety*err_norm**-0.2)
+
+        self.last_evals = evals
+        self.n_evals += evals
+        return y
+
+    def reset(self):
+        super().reset()
+        self.h = None
+        self.n_rejected = 0
+
+INTEGRATORS = {"euler": SemiImplicitEuler,
+                "semi_implicit": SemiImplicitEuler,
+                "rk4": RK4,
+                "rk45": DormandPrince45,
+                "dopri5": DormandPrince45}
+
+def make_integrator(params):
+    """
+        Builds the integrator named by params["integrator"] (semi-implicit Euler if not given).
+        The adaptive integrator also reads "rtol" and "atol" if they are in the params dict.
+    """
+
+    name = params.get("integrator", "semi_implicit")
+    if name not in INTEGRATORS:
+        raise ValueError("Unknown integrator '{}'. Choose from: {}".format(name, ", ".join(INTEGRATORS)))
+    if INTEGRATORS[name] is DormandPrince45:
+        return DormandPrince45(rtol=params.get("rtol", 1e-6), atol=params.get("atol", 1e-8))
+    return INTEGRATORS[name]()
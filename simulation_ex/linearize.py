@@ -0,0 +1,306 @@
+"""
+    Trim and linearization of the quadrotor equations of motion. The state is the flat 12-vector
+    x = [xyz, zeta, uvw, pqr] and the input is the 4-vector of rpm, the same ordering as
+    Quadrotor and QuadrotorBatch. The Jacobians are worked out by hand from the same force and
+    moment models as Quadrotor.derivatives(), so one linearization is a handful of small matrix
+    products instead of 2*(12+4) evaluations of step(), and there's no finite-difference noise.
+
+    Linearizations always use Euler angles, even if params["attitude"] is "quaternion". Trim
+    points are well away from pitch +-90 degrees, so the singularity doesn't matter here, and
+    controllers are much easier to design against the 12 state model.
+"""
+
+import numpy as np
+from math import sin, cos, tan
+from collections import OrderedDict
+from scipy.linalg import expm
+from aircraft import AircraftParams
+
+def rotations(zeta):
+    """
+        R1 (body to inertial), R2 (inertial angular velocity to Euler rates), and their
+        partial derivatives with respect to phi, theta and psi, as stacked (3, 3, 3) arrays
+        dR1[k] = dR1/dzeta_k. Same conventions as Quadrotor.R1 and Quadrotor.R2.
+    """
+
+    phi, theta, psi = zeta
+    cph, sph = cos(phi), sin(phi)
+    cth, sth, tth = cos(theta), sin(theta), tan(theta)
+    cps, sps = cos(psi), sin(psi)
+
+    Rx = np.array([[1., 0., 0.], [0., cph, -sph], [0., sph, cph]])
+    Ry = np.array([[cth, 0., sth], [0., 1., 0.], [-sth, 0., cth]])
+    Rz = np.array([[cps, -sps, 0.], [sps, cps, 0.], [0., 0., 1.]])
+    dRx = np.array([[0., 0., 0.], [0., -sph, -cph], [0., cph, -sph]])
+    dRy = np.array([[-sth, 0., cth], [0., 0., 0.], [-cth, 0., -sth]])
+    dRz = np.array([[-sps, -cps, 0.], [cps, -sps, 0.], [0., 0., 0.]])
+    R1 = Rz.dot(Ry).dot(Rx)
+    dR1 = np.stack([Rz.dot(Ry).dot(dRx), Rz.dot(dRy).dot(Rx), dRz.dot(Ry).dot(Rx)])
+
+    R2 = np.array([[cps/cth, sps/cth, 0.],
+                    [-sps, cps, 0.],
+                    [cps*tth, sps*tth, 1.]])
+    dR2 = np.stack([np.zeros((3, 3)),
+                    np.array([[cps*sth/cth**2, sps*sth/cth**2, 0.],
+                            [0., 0., 0.],
+                            [cps/cth**2, sps/cth**2, 0.]]),
+                    np.array([[-sps/cth, cps/cth, 0.],
+                            [-cps, -sps, 0.],
+                            [-sps*tth, cps*tth, 0.]])])
+    return R1, dR1, R2, dR2
+
+def skew(v):
+    """
+        Cross product matrix, skew(a).dot(b) == np.cross(a, b)
+    """
+
+    return np.array([[0., -v[2], v[1]],
+                    [v[2], 0., -v[0]],
+                    [-v[1], v[0], 0.]])
+
+def drag(k, v):
+    """
+        Quadratic drag -k*|v|*v and its Jacobian -k*(|v|*I+v*v^T/|v|). The Jacobian is zero at
+        v = 0, where the drag is flat.
+    """
+
+    norm = np.linalg.norm(v)
+    if norm == 0.:
+        return np.zeros(3), np.zeros((3, 3))
+    return -k*norm*v, -k*(norm*np.eye(3)+np.outer(v, v)/norm)
+
+def derivatives(params, x, rpm):
+    """
+        State derivative x_dot = f(x, rpm) for the flat 12-state. Same model as
+        Quadrotor.derivatives(), without the clipping of rpm.
+    """
+
+    p = params
+    zeta, uvw, pqr = x[3:6], x[6:9], x[9:12]
+    R1, _, R2, _ = rotations(zeta)
+    rpm_sq = rpm**2
+    fa, _ = drag(p.kd, uvw)
+    ta, _ = drag(p.km, pqr)
+    thrust = np.array([0., 0., p.kt*rpm_sq.sum()])
+
+    x_dot = np.empty(12)
+    x_dot[0:3] = R1.dot(uvw)
+    x_dot[3:6] = R2.dot(R1.dot(pqr))
+    x_dot[6:9] = (thrust+fa)/p.mass+R1.T.dot(p.G[:, 0])-np.cross(pqr, uvw)
+    x_dot[9:12] = p.J_inv_diag*(p.moment_arm.dot(rpm_sq)+ta-np.cross(pqr, p.J_diag*pqr))
+    return x_dot
+
+def jacobians(params, x, rpm):
+    """
+        Continuous-time Jacobians A = df/dx (12, 12) and B = df/drpm (12, 4) at (x, rpm).
+        Working through the equations of motion block by block:
+
+            xyz_dot  = R1*v                 -> d/dzeta_k = dR1_k*v, d/dv = R1
+            zeta_dot = R2*R1*w              -> d/dzeta_k = (dR2_k*R1+R2*dR1_k)*w, d/dw = R2*R1
+            v_dot    = F/m+R1^T*G-w x v     -> d/dzeta_k = dR1_k^T*G, d/dv = dFa/dv/m-[w]x, d/dw = [v]x
+            w_dot    = J^-1*(Q-w x J*w)     -> d/dw = J^-1*(dQa/dw-[w]x*J+[J*w]x)
+
+        and the input only enters through thrust (2*kt*rpm on the body z-axis) and the motor
+        moments (moment_arm*2*rpm).
+    """
+
+    p = params
+    zeta, uvw, pqr = x[3:6], x[6:9], x[9:12]
+    R1, dR1, R2, dR2 = rotations(zeta)
+    _, dfa = drag(p.kd, uvw)
+    _, dta = drag(p.km, pqr)
+    J, J_inv = p.J_diag, p.J_inv_diag
+    g = p.G[:, 0]
+
+    A = np.zeros((12, 12))
+    A[0:3, 3:6] = np.einsum('kij,j->ik', dR1, uvw)
+    A[0:3, 6:9] = R1
+    A[3:6, 3:6] = np.einsum('kij,j->ik', np.einsum('kij,jl->kil', dR2, R1)+np.einsum('ij,kjl->kil', R2, dR1), pqr)
+    A[3:6, 9:12] = R2.dot(R1)
+    A[6:9, 3:6] = np.einsum('kji,j->ik', dR1, g)
+    A[6:9, 6:9] = dfa/p.mass-skew(pqr)
+    A[6:9, 9:12] = skew(uvw)
+    A[9:12, 9:12] = J_inv[:, None]*(dta-skew(pqr)*J+skew(J*pqr))
+
+    B = np.zeros((12, 4))
+    B[8] = 2.*p.kt*rpm/p.mass
+    B[9:12] = J_inv[:, None]*p.moment_arm*(2.*rpm)
+    return A, B
+
+def discretize(A, B, dt):
+    """
+        Zero-order hold discretization, x_{k+1} = Ad*x_k+Bd*u_k, from the matrix exponential
+        of the augmented system [[A, B], [0, 0]]*dt.
+    """
+
+    n, m = B.shape
+    M = np.zeros((n+m, n+m))
+    M[:n, :n] = A
+    M[:n, n:] = B
+    E = expm(M*dt)
+    return E[:n, :n], E[:n, n:]
+
+def trim(params, V=(0., 0., 0.), yaw_rate=0., psi=0., tol=1e-10, max_iter=50):
+    """
+        Finds the attitude and rpm that hold a steady flight condition, given the inertial
+        velocity V and the yaw rate (a coordinated turn if both are non-zero). In steady
+        flight the inertial angular velocity is (0, 0, yaw_rate), so the body rates and
+        velocities follow from the attitude:
+
+            uvw = R1^T*V, pqr = R1^T*(0, 0, yaw_rate)
+
+        which leaves six unknowns (phi, theta and the four rpm) for the six equations
+        uvw_dot = 0 and pqr_dot = 0. These are solved with Newton's method, using the analytic
+        Jacobians above. Returns the trim state x (12,) and rpm (4,). Raises a RuntimeError if
+        Newton doesn't converge, e.g. if the condition needs more thrust than the motors have.
+    """
+
+    p = AircraftParams.create(params)
+    V = np.asarray(V, dtype=float)
+    W = np.array([0., 0., yaw_rate])
+    z = np.array([0., 0.]+[p.hov_rpm]*4)
+
+    for _ in range(max_iter):
+        zeta = np.array([z[0], z[1], psi])
+        R1, dR1, _, _ = rotations(zeta)
+        x = np.concatenate([np.zeros(3), zeta, R1.T.dot(V), R1.T.dot(W)])
+        rpm = z[2:]
+        res = derivatives(p, x, rpm)[6:12]
+        if np.abs(res).max() < tol:
+            break
+
+        # chain rule through uvw(zeta) and pqr(zeta)
+        A, B = jacobians(p, x, rpm)
+        dx = np.zeros((12, 2))
+        for k in range(2):
+            dx[3+k, k] = 1.
+            dx[6:9, k] = dR1[k].T.dot(V)
+            dx[9:12, k] = dR1[k].T.dot(W)
+        jac = np.hstack([A[6:12].dot(dx), B[6:12]])
+        z = z-np.linalg.solve(jac, res)
+    else:
+        raise RuntimeError("trim did not converge for V = {}, yaw_rate = {}".format(V, yaw_rate))
+    if np.any(rpm < 0.) or np.any(rpm > p.max_rpm):
+        raise RuntimeError("trim needs rpm {} outside [0, {:.1f}]".format(rpm, p.max_rpm))
+    return x, rpm
+
+def hover(params):
+    return trim(params)
+
+def climb(params, rate):
+    return trim(params, V=(0., 0., rate))
+
+def turn(params, speed, yaw_rate, psi=0.):
+    """
+        Coordinated level turn at the given airspeed, starting from heading psi
+    """
+
+    return trim(params, V=(speed*cos(psi), speed*sin(psi), 0.), yaw_rate=yaw_rate, psi=psi)
+
+class Linearizer:
+    """
+        Caches linearizations per operating point, so gain-scheduled controllers can look up
+        A and B at run time instead of re-linearizing. Operating points are keyed by (x, rpm)
+        rounded to `decimals` places, and the cache holds at most maxsize entries, evicting the
+        least recently used. The returned matrices are read-only, since they're shared with the
+        cache.
+    """
+
+    def __init__(self, params, maxsize=256, decimals=9):
+        self.params = AircraftParams.create(params)
+        self.maxsize = maxsize
+        self.decimals = decimals
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, kind, x, rpm, *extra):
+        return (kind, np.round(np.concatenate([x, rpm]), self.decimals).tobytes())+extra
+
+    def lookup(self, key, compute):
+        try:
+            value = self.cache[key]
+        except KeyError:
+            self.misses += 1
+            value = compute()
+            for a in value:
+                a.flags.writeable = False
+            self.cache[key] = value
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+            return value
+        self.hits += 1
+        self.cache.move_to_end(key)
+        return value
+
+    def continuous(self, x, rpm):
+        """
+            Continuous-time (A, B) at (x, rpm)
+        """
+
+        x, rpm = np.asarray(x, dtype=float).ravel(), np.asarray(rpm, dtype=float).ravel()
+        return self.lookup(self.key("c", x, rpm), lambda: jacobians(self.params, x, rpm))
+
+    def discrete(self, x, rpm, dt=None):
+        """
+            Zero-order hold (Ad, Bd) at (x, rpm), for a time step dt (params["dt"] by default)
+        """
+
+        dt = self.params.dt if dt is None else dt
+        x, rpm = np.asarray(x, dtype=float).ravel(), np.asarray(rpm, dtype=float).ravel()
+        return self.lookup(self.key("d", x, rpm, dt), lambda: discretize(*self.continuous(x, rpm), dt))
+
+    def trim(self, V=(0., 0., 0.), yaw_rate=0., psi=0.):
+        """
+            Trim state and rpm for a steady flight condition (see trim()), cached as well
+        """
+
+        key = ("t", tuple(np.round(V, self.decimals)), round(yaw_rate, self.decimals), round(psi, self.decimals))
+        return self.lookup(key, lambda: trim(self.params, V, yaw_rate, psi))
+
+    def cache_info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.cache), "maxsize": self.maxsize}
+
+def main():
+    """
+        Checks the analytic Jacobians against central differences of Quadrotor.derivatives(),
+        checks the trim points really are equilibria, and times cached and uncached lookups.
+    """
+
+    import time
+    import config as cfg
+    import quadrotor as quad
+
+    iris = quad.Quadrotor(cfg.params)
+    lin = Linearizer(cfg.params)
+
+    def f(x, rpm):
+        y = x[:, None]
+        return iris.derivatives(y, rpm)[:, 0]
+
+    conditions = {"hover": {}, "climb 2 m/s": {"V": (0., 0., 2.)},
+                "cruise 5 m/s": {"V": (5., 0., 0.)}, "turn 5 m/s, 0.5 rad/s": {"V": (5., 0., 0.), "yaw_rate": 0.5}}
+    for name, cond in conditions.items():
+        x, rpm = lin.trim(**cond)
+        A, B = lin.continuous(x, rpm)
+        h = 1e-6
+        A_fd = np.stack([(f(x+h*e, rpm)-f(x-h*e, rpm))/(2*h) for e in np.eye(12)], axis=1)
+        B_fd = np.stack([(f(x, rpm+h*e)-f(x, rpm-h*e))/(2*h) for e in np.eye(4)], axis=1)
+        print("{:22s} residual {:.1e}, |A-A_fd| {:.1e}, |B-B_fd| {:.1e}, rpm {}".format(
+            name, np.abs(f(x, rpm)[6:]).max(), np.abs(A-A_fd).max(), np.abs(B-B_fd).max(), np.round(rpm, 1)))
+
+    x, rpm = lin.trim()
+    reps = 10000
+    t0 = time.perf_counter()
+    for _ in range(reps):
+        jacobians(lin.params, x, rpm)
+    t1 = time.perf_counter()
+    for _ in range(reps):
+        lin.discrete(x, rpm)
+    t2 = time.perf_counter()
+    print("Analytic linearization: {:.1f} us, cached discrete lookup: {:.1f} us".format(
+        1e6*(t1-t0)/reps, 1e6*(t2-t1)/reps))
+    print(lin.cache_info())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import json
+from time import perf_counter_ns
+
+class Stage:
+    """
+        Timings of one stage: call count, total and maximum time, and a histogram of call times
+        in power-of-two nanosecond buckets (bucket i holds calls that took [2^(i-1), 2^i) ns),
+        which costs one int.bit_length() per call and is plenty to see the shape of the spread.
+    """
+
+    __slots__ = ["count", "total", "max", "hist"]
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.hist = [0]*64
+
+    def percentile(self, p):
+        # upper edge of the bucket holding the p-th percentile, in ns, but never more than max
+        target = p/100.*self.count
+        seen = 0
+        for i, n in enumerate(self.hist):
+            seen += n
+            if n and seen >= target:
+                return min(1 << i, self.max)
+        return 0
+
+class Profiler:
+    """
+        Per-stage timings for the simulation. Functions are timed by wrapping them with wrap(),
+        and every call records its duration under its name (see Stage) and under its call stack,
+        e.g. "integrator;derivatives;R1", so we know both how long R1 takes overall and how much
+        of it was spent inside derivatives. The first max_events calls are also kept as
+        individual events for a timeline.
+
+        Results can be exported as a Chrome trace (chrome://tracing, Perfetto or speedscope show
+        it as a timeline with nested stages), or as folded stacks for flamegraph.pl and
+        speedscope.
+
+        The profiler never touches the simulation itself: Quadrotor.enable_profiling() swaps the
+        wrapped methods in, and disable_profiling() takes them out again, so a simulation that
+        isn't being profiled runs the plain methods.
+    """
+
+    def __init__(self, max_events=1000000):
+        self.stages = {}
+        self.stacks = {}
+        self.stack = []
+        self.events = []
+        self.max_events = max_events
+        self.start = perf_counter_ns()
+
+    def wrap(self, name, f):
+        """
+            Returns f wrapped so that every call is timed as stage `name`
+        """
+
+        stage = self.stages.setdefault(name, Stage())
+        stack = self.stack
+
+        def timed(*args, **kwargs):
+            stack.append(name)
+            t0 = perf_counter_ns()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                dt = perf_counter_ns()-t0
+                stage.count += 1
+                stage.total += dt
+                if dt > stage.max:
+                    stage.max = dt
+                stage.hist[dt.bit_length()] += 1
+                key = tuple(stack)
+                self.stacks[key] = self.stacks.get(key, 0)+dt
+                if len(self.events) < self.max_events:
+                    self.events.append((name, t0, dt, len(stack)))
+                stack.pop()
+        timed.__wrapped__ = f
+        return timed
+
+    def reset(self):
+        # the wrappers hold on to their Stage, so clear them in place rather than replacing them
+        for stage in self.stages.values():
+            stage.reset()
+        self.stacks.clear()
+        self.events.clear()
+        self.start = perf_counter_ns()
+
+    def self_times(self):
+        # time spent in every call stack minus the time spent in the stages it called, in ns
+        out = dict(self.stacks)
+        for key, total in self.stacks.items():
+            if len(key) > 1:
+                out[key[:-1]] = out.get(key[:-1], 0)-total
+        return out
+
+    def summary(self):
+        """
+            Table of every stage, sorted by total time. Self time is the total minus the time
+            spent in the stages it called.
+        """
+
+        own = {}
+        for key, t in self.self_times().items():
+            own[key[-1]] = own.get(key[-1], 0)+t
+        lines = ["{:20s} {:>10s} {:>11s} {:>11s} {:>9s} {:>9s} {:>9s}".format(
+            "stage", "calls", "total ms", "self ms", "mean us", "p99 us", "max us")]
+        for name, s in sorted(self.stages.items(), key=lambda kv: -kv[1].total):
+            if s.count == 0:
+                continue
+            lines.append("{:20s} {:10d} {:11.3f} {:11.3f} {:9.2f} {:9.2f} {:9.2f}".format(
+                name, s.count, s.total*1e-6, own.get(name, 0)*1e-6, s.total/s.count*1e-3,
+                s.percentile(99)*1e-3, s.max*1e-3))
+        return "\n".join(lines)
+
+    def chrome_trace(self, path):
+        """
+            Writes the recorded events as a Chrome trace (JSON, "X" complete events with times
+            in microseconds)
+        """
+
+        events = [{"name": name, "cat": "quadrotor", "ph": "X", "pid": 0, "tid": 0,
+                "ts": (t0-self.start)*1e-3, "dur": dt*1e-3, "args": {"depth": depth}}
+                for name, t0, dt, depth in self.events]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ns"}, f)
+
+    def folded(self, path):
+        """
+            Writes folded stacks, one "outer;inner;innermost self_time_us" line per call stack,
+            as read by flamegraph.pl and speedscope
+        """
+
+        with open(path, "w") as f:
+            for key, t in sorted(self.self_times().items()):
+                if t > 0:
+                    f.write("{} {}\n".format(";".join(key), int(round(t*1e-3))))
+
+def main():
+    """
+        Profiles a short flight with each integrator, and compares the cost of a step with
+        profiling disabled, enabled, and on a simulation that was never profiled.
+    """
+
+    import sys
+    import time
+    import config as cfg
+    import quadrotor as quad
+    import numpy as np
+
+    for integrator in ["semi_implicit", "rk4", "rk45"]:
+        iris = quad.Quadrotor(dict(cfg.params, integrator=integrator))
+        rpm = iris.hov_rpm+np.array([0., 10., 0., 10.])
+        with iris.profile() as prof:
+            for _ in range(500):
+                iris.step(rpm)
+        print("{} integrator, 500 steps:".format(integrator))
+        print(prof.summary())
+        print()
+    if len(sys.argv) > 1:
+        prof.chrome_trace(sys.argv[1]+".json")
+        prof.folded(sys.argv[1]+".folded")
+        print("Wrote {0}.json (Chrome trace) and {0}.folded (folded stacks)".format(sys.argv[1]))
+
+    fresh = quad.Quadrotor(cfg.params)
+    iris = quad.Quadrotor(cfg.params)
+    iris.enable_profiling()
+    iris.disable_profiling()
+    rates = []
+    rpm = np.full(4, fresh.hov_rpm)
+    for sim, on in [(fresh, False), (iris, False), (iris, True)]:
+        if on:
+            sim.enable_profiling()
+        sim.reset()
+        t0 = time.perf_counter()
+        for _ in range(5000):
+            sim.step(rpm)
+        rates.append(5000/(time.perf_counter()-t0))
+    print("Steps/s: never profiled {:.0f}, profiling disabled {:.0f}, enabled {:.0f}".format(*rates))
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,12 @@
+import logging
 import numpy as np
-from math import sin, cos, tan, sqrt
+from math import sin, cos, tan, atan2, asin
+from contextlib import contextmanager
+from integrators import make_integrator
+from aircraft import AircraftParams
+from profiler import Profiler
+
+logger = logging.getLogger(__name__)
 
 class Quadrotor:
     """
@@ -11,9 +18,9 @@ class Quadrotor:
 
         I've chosen a representation for the rotation matrices that makes it easy to see what I'm doing;
         it shouldn't have a huge impact on performance since we don't have much in the way of graphics.
-        For an 'x' config quadrotor, calculate thrust and moments due to the motors as normal, and then 
-        rotate these vectors by pi/4 around the body z-axis. Thrust should be unaffected, but the moments
-        will be, since the moment arm to the COM will change.
+        For an 'x' config quadrotor, set "layout" to "x" in the params dict. AircraftParams rotates the
+        motor arms by pi/4 around the body z-axis when it builds the mixer. Thrust is unaffected, but the
+        moments are, since the moment arm to the COM changes.
 
         You can also use this sim for standard fixed-wing aircraft or rockets by implementing new force
         and torque methods. For example, for a fixed wing, you could implement a strip theory aerodynamics 
@@ -26,6 +33,8 @@ class Quadrotor:
     """
     
     def __init__(self, params):
+        params = AircraftParams.create(params)
+        self.params = params
         self.mass = params["mass"]
         self.prop_radius = params["prop_radius"]
         self.n_motors = params["n_motors"]
@@ -40,13 +49,19 @@ class Quadrotor:
         self.km = params["km"]
         self.g = params["g"]
         self.dt = params["dt"]
-	
-        print("Params loaded:")
-        print(params)
+        self.quaternion = params.attitude == "quaternion"
+        self.n_pos = 7 if self.quaternion else 6
+        self.integrator = make_integrator(params)
+        self.profiler = None
+        logger.debug("Params loaded: %s", params)
+
+        # inertia, gravity and mixer matrices are derived (and validated) once by AircraftParams
+        self.J = params.J
+        self.J_inv = params.J_inv
+        self.G = params.G
+        self.u_to_rpm = params.u_to_rpm
+        self.moment_arm = params.moment_arm
 
-        self.J = np.array([[self.Jxx,   0.,         0.],
-                            [0.,    self.Jyy,       0.],
-                            [0.,        0.,     self.Jzz]])
         self.xyz = np.array([[0.],
                             [0.],
                             [0.]])
@@ -59,37 +74,40 @@ class Quadrotor:
         self.pqr = np.array([[0.],
                             [0.],
                             [0.]])
-        self.G = np.array([[0.],
+        self.q = np.array([[1.],
+                            [0.],
                             [0.],
-                            [-self.g]])
+                            [0.]])
         self.rpm = np.array([0.0, 0., 0., 0.])
 
-        self.u_to_rpm = np.linalg.inv(np.array([[self.kt, self.kt, self.kt, self.kt],
-                                                [0., self.l*self.kt, 0., -self.l*self.kt],
-                                                [-self.l*self.kt, 0., self.l*self.kt, 0.],
-                                                [-self.kq, self.kq, -self.kq, self.kq]]))
-
         # important physical limits
-        self.hov_rpm = sqrt((self.mass*self.g)/self.n_motors/self.kt)
-        self.max_rpm = sqrt(1./self.hov_p)*self.hov_rpm
-        self.max_thrust = self.kt*self.max_rpm**2
-        self.terminal_velocity = sqrt((self.max_thrust+self.mass*self.g)/self.kd)
-        self.terminal_rotation = sqrt(self.l*self.max_thrust/self.km)
+        self.hov_rpm = params.hov_rpm
+        self.max_rpm = params.max_rpm
+        self.max_thrust = params.max_thrust
+        self.terminal_velocity = params.terminal_velocity
+        self.terminal_rotation = params.terminal_rotation
 
     def set_state(self, xyz, zeta, uvw, pqr):
         """
-            Sets the state space of our vehicle
+            Sets the state space of our vehicle. In quaternion mode, zeta can be either a 4x1
+            quaternion or a 3x1 vector of Euler angles, which is converted to a quaternion.
         """
 
         self.xyz = xyz.copy()
-        self.zeta = zeta.copy()
+        if self.quaternion:
+            self.q = self.euler_to_q(zeta) if zeta.shape[0] == 3 else zeta.copy()
+        else:
+            self.zeta = zeta.copy()
         self. uvw = uvw.copy()
         self.pqr = pqr.copy()
     
     def get_state(self):
         """
-            Returns the current state space
+            Returns the current state space. In quaternion mode the attitude is returned
+            as the 4x1 quaternion q instead of zeta.
         """
+        if self.quaternion:
+            return self.xyz, self.q, self.uvw, self.pqr
         return self.xyz, self.zeta, self.uvw, self.pqr
     
     def reset(self):
@@ -109,6 +127,10 @@ class Quadrotor:
         self.pqr = np.array([[0.],
                             [0.],
                             [0.]]) 
+        self.q = np.array([[1.],
+                            [0.],
+                            [0.],
+                            [0.]])
         self.rpm = np.array([0., 0., 0., 0.])
         return self.get_state()
 
@@ -124,10 +146,17 @@ class Quadrotor:
             about the inertial x-axis.
         """
         
-        # Implement the code that returns the rotation matrix here. You should break zeta
-        # into its constituent elements, and then create the numpy arrays Rx, Ry, Rz. From
-        # there, you can return Rz.dot(Ry.dot(Rx))
-        return
+        phi, theta, psi = zeta[0,0], zeta[1,0], zeta[2,0]
+        Rx = np.array([[1.,         0.,         0.],
+                        [0.,    cos(phi),   -sin(phi)],
+                        [0.,    sin(phi),   cos(phi)]])
+        Ry = np.array([[cos(theta),     0.,     sin(theta)],
+                        [0.,            1.,         0.],
+                        [-sin(theta),   0.,     cos(theta)]])
+        Rz = np.array([[cos(psi),   -sin(psi),      0.],
+                        [sin(psi),  cos(psi),       0.],
+                        [0.,            0.,         1.]])
+        return Rz.dot(Ry.dot(Rx))
  
 
     def R2(self, zeta):
@@ -138,12 +167,94 @@ class Quadrotor:
             textbooks (which use an N-E-D system).
         """
         
-        # Implement the code that return the Euler rates matrix here. You should break zeta
-        # into theta and psi (since phi isn’t used) and then create a numpy array as in Eq. 10
-        # in the handout. Return this matrix.
-        return
+        theta, psi = zeta[1,0], zeta[2,0]
+        x11 = cos(psi)/cos(theta)
+        x12 = sin(psi)/cos(theta)
+        x13 = 0.
+        x21 = -sin(psi)
+        x22 = cos(psi)
+        x23 = 0.
+        x31 = cos(psi)*tan(theta)
+        x32 = sin(psi)*tan(theta)
+        x33 = 1.
+        return np.array([[x11, x12, x13],
+                        [x21, x22, x23],
+                        [x31, x32, x33]])
     
 
+    def q_mult(self, p):
+        """
+            Left quaternion multiplication matrix. For quaternions p and q stored as 4x1
+            column vectors [w, x, y, z], p*q (the Hamilton product) is q_mult(p).dot(q).
+        """
+
+        p0, p1, p2, p3 = p[0,0], p[1,0], p[2,0], p[3,0]
+        return np.array([[p0, -p1, -p2, -p3],
+                        [p1, p0, -p3, p2],
+                        [p2, p3, p0, -p1],
+                        [p3, -p2, p1, p0]])
+
+    def q_conj(self, q):
+        """
+            Quaternion conjugate. For a unit quaternion this is also the inverse.
+        """
+
+        return np.array([[q[0,0]],
+                        [-q[1,0]],
+                        [-q[2,0]],
+                        [-q[3,0]]])
+
+    def R1_q(self, q):
+        """
+            Body-to-inertial rotation matrix built from the attitude quaternion. We store q as
+            the inertial-to-body rotation (this is what Visualization.draw3d_quat expects), so
+            this is the rotation matrix of q^{-1}, i.e. the transpose of the usual q*v*q^{-1}
+            matrix. There are no trig functions here, only products of the elements of q.
+        """
+
+        q0, q1, q2, q3 = q[0,0], q[1,0], q[2,0], q[3,0]
+        x11 = q0**2+q1**2-q2**2-q3**2
+        x12 = 2.*(q1*q2+q0*q3)
+        x13 = 2.*(q1*q3-q0*q2)
+        x21 = 2.*(q1*q2-q0*q3)
+        x22 = q0**2-q1**2+q2**2-q3**2
+        x23 = 2.*(q2*q3+q0*q1)
+        x31 = 2.*(q1*q3+q0*q2)
+        x32 = 2.*(q2*q3-q0*q1)
+        x33 = q0**2-q1**2-q2**2+q3**2
+        return np.array([[x11, x12, x13],
+                        [x21, x22, x23],
+                        [x31, x32, x33]])
+
+    def euler_to_q(self, zeta):
+        """
+            Converts Euler angles (phi, theta, psi) to the attitude quaternion, such that
+            R1_q(euler_to_q(zeta)) == R1(zeta). Only used to set up initial conditions.
+        """
+
+        phi, theta, psi = zeta[0,0]/2., zeta[1,0]/2., zeta[2,0]/2.
+        cph, sph = cos(phi), sin(phi)
+        cth, sth = cos(theta), sin(theta)
+        cps, sps = cos(psi), sin(psi)
+        return np.array([[cph*cth*cps+sph*sth*sps],
+                        [-(sph*cth*cps-cph*sth*sps)],
+                        [-(cph*sth*cps+sph*cth*sps)],
+                        [-(cph*cth*sps-sph*sth*cps)]])
+
+    def q_to_euler(self, q):
+        """
+            Converts the attitude quaternion back to Euler angles (phi, theta, psi). Handy for
+            logging and plotting; the quaternion mode never calls this while stepping.
+        """
+
+        p0, p1, p2, p3 = q[0,0], -q[1,0], -q[2,0], -q[3,0]
+        phi = atan2(2.*(p0*p1+p2*p3), 1.-2.*(p1**2+p2**2))
+        theta = asin(max(-1., min(1., 2.*(p0*p2-p3*p1))))
+        psi = atan2(2.*(p0*p3+p1*p2), 1.-2.*(p2**2+p3**2))
+        return np.array([[phi],
+                        [theta],
+                        [psi]])
+
     def aero_forces(self, uvw):
         """
             Calculates drag in the body xyz axis (E-N-U) due to linear velocity
@@ -164,29 +275,110 @@ class Quadrotor:
             Models aero moments about the body xyz axis (E-N-U) as a function of angular velocity
         """
         
-        # Implement the function that calculates aerodynamic moments here. You should use the aero_forces
-        # function as a template.
-        return
+        norm = np.linalg.norm(pqr)
+        if norm == 0:
+            return np.array([[0.],
+                            [0.],
+                            [0.]])
+        else:
+            unit_vector = pqr/norm
+            return -(self.km*norm**2)*unit_vector
         
 
     def thrust_forces(self, rpm):
         """
             Calculates thrust forces in the body xyz axis (E-N-U)
         """
-        # Implement the function that calculates thrust forces here. You should refer to your notes.
-        # The thrust force equation is given in Eq. 5
-        return
+        T = self.kt*np.sum(rpm**2)
+        return np.array([[0.],
+                        [0.],
+                        [T]])
 
 
     def thrust_moments(self, rpm):
         """
             Calculates moments about the body xyz axis due to motor thrust and torque
         """
-        # Implement the function that calculates thrust moments here. You should refer to your notes.
-        # The thrust moment equation is given in Eq. 6
-        return
+        # for a '+' layout the rows are l*kt*[0, 1, 0, -1], l*kt*[-1, 0, 1, 0] and
+        # kq*[-1, 1, -1, 1]; an 'x' layout just has different roll and pitch arms
+        return self.moment_arm.dot(rpm**2)[:, None]
 
         
+    def rotation(self, y):
+        """
+            Body-to-inertial matrix R1 for the attitude in the stacked state y
+        """
+
+        att = y[3:self.n_pos]
+        return self.R1_q(att) if self.quaternion else self.R1(att)
+
+    def kinematics(self, y, r1=None):
+        """
+            Position and attitude rates for the stacked state y = [xyz, zeta, uvw, pqr]
+            (or [xyz, q, uvw, pqr] in quaternion mode). r1 can be passed in if the caller
+            already has it for this attitude.
+        """
+
+        n = self.n_pos
+        att, uvw, pqr = y[3:n], y[n:n+3], y[n+3:n+6]
+        r1 = self.rotation(y) if r1 is None else r1
+        return self.attitude_kinematics(att, r1, uvw, pqr)
+
+    def attitude_kinematics(self, att, r1, uvw, pqr):
+        """
+            Position and attitude rates given the body-to-inertial matrix r1. With Euler
+            angles, R2 maps inertial angular velocity to Euler rates, so pqr is rotated out
+            of the body frame with r1 first. With quaternions, q is the inertial-to-body
+            rotation, which gives:
+
+            q_dot = -1/2*[0, omega]*q
+        """
+
+        xyz_dot = r1.dot(uvw)
+        if self.quaternion:
+            omega = np.array([[0.],
+                            [pqr[0,0]],
+                            [pqr[1,0]],
+                            [pqr[2,0]]])
+            att_dot = -0.5*self.q_mult(omega).dot(att)
+        else:
+            r2 = self.R2(att)				# calc Euler rates matrix
+            att_dot = r2.dot(r1.dot(pqr))
+        return np.vstack([xyz_dot, att_dot])
+
+    def derivatives(self, y, rpm):
+        """
+            Full state derivative for the stacked state y = [xyz, zeta, uvw, pqr] (or
+            [xyz, q, uvw, pqr] in quaternion mode) under a (clipped) rpm command. This is
+            the function the integrators call; see step() for the equations of motion.
+        """
+
+        n = self.n_pos
+        att, uvw, pqr = y[3:n], y[n:n+3], y[n+3:n+6]
+        r1 = self.rotation(y)
+        return np.vstack([self.attitude_kinematics(att, r1, uvw, pqr), self.velocity_derivatives(y, rpm, r1)])
+
+    def velocity_derivatives(self, y, rpm, r1=None):
+        """
+            Linear and angular accelerations [uvw_dot, pqr_dot] only, i.e. the forces and
+            moments without the attitude kinematics. The semi-implicit Euler update uses this
+            for its velocity half, and kinematics() with the same r1 for its position half,
+            so the rotation matrices are built once per step.
+        """
+
+        n = self.n_pos
+        uvw, pqr = y[n:n+3], y[n+3:n+6]
+        r1 = self.rotation(y) if r1 is None else r1
+        fm = self.thrust_forces(rpm)			# calc thrust force
+        tm = self.thrust_moments(rpm)			# calc thrust moment
+        fa = self.aero_forces(uvw)			# calc aerodynamic force
+        ta = self.aero_moments(pqr)			# calc aerodynamic moment
+        H = self.J.dot(pqr)				# calc angular momentum vector
+
+        uvw_dot = (fm+fa)/self.mass+r1.T.dot(self.G)-np.cross(pqr, uvw, axis=0)
+        pqr_dot = self.J_inv.dot(tm+ta-np.cross(pqr, H, axis=0))
+        return np.vstack([uvw_dot, pqr_dot])
+
     def step(self, rpm):
         """
             Semi-implicit Euler update of the non-linear equations of motion. Uses the
@@ -222,35 +414,83 @@ class Quadrotor:
             Where h is the time step. This update is semi-implicit since it updates linear 
             and angular velocities using a forward Euler step, and then updates position and
             attitude using v_{t+1} and omega_{t+1} (as opposed to using v_{t} and omega_{t}).
+
+            This is the default. The integrator can be swapped out by setting "integrator" in
+            the params dict to "rk4" or "rk45" (see integrators.py); all of them call the same
+            derivatives() function, so the physics doesn't change, only the accuracy per step.
+
+            Setting "attitude" to "quaternion" in the params dict integrates the attitude
+            quaternion q instead of zeta. R1 is then built from q without any trig, R2 isn't
+            needed at all, and there is no singularity at pitch +-90 degrees. q drifts off
+            the unit sphere slowly, so after each step we pull it back with one Newton
+            iteration of 1/|q|, i.e. q <- q*(3-|q|^2)/2, which avoids a square root.
         """
 
-        rpm = np.clip(rpm, 0., self.max_rpm) 		# clip our RPM to a maximum value
-        r1 = self.R1(self.zeta)				# calc Euler rotation matrix
-        r2 = self.R2(self.zeta)				# calc Euler rates matrix
-        fm = self.thrust_forces(rpm)			# calc thrust force
-        tm = self.thrust_moments(rpm)			# calc thrust moment
-        fa = self.aero_forces(self.uvw)			# calc aerodynamic force
-        ta = self.aero_moments(self.pqr)		# calc aerodynamic moment
-        H = self.J.dot(self.pqr)			# calc angular momentum vector
-	
-        # Implement uvw_dot and pqr_dot equations here. When using cross products in numpy, you
-        # will need to specify axis=0 since we are working with column vectors (3x1). Remember,
-        # you can rotate the gravity vector into the body frame using the transpose of r1, which
-        # is r1.T in numpy (i.e. g_b = r1.T.dot(self.G))
-         
-        uvw_dot = None
-        pqr_dot = None	
-
-        self.uvw += uvw_dot*self.dt			# step linear vels forward by one timestep
-        self.pqr += pqr_dot*self.dt			# step angular vels forward by one timestep
-
-        # Implement xyz_dot and zeta_dot equations here. These are specified in the handout in Eqs.
-        # 3 & 4. If you’ve already completed the body accelerations task, you can use the same method
-        # here to rotate from the body frame to the inertial frame (i.e. r1.dot(uvw)).        
-            
-        xyz_dot = None
-        zeta_dot = None
+        return self.advance(rpm, 1)
+
+    def advance(self, rpm, steps, dt=None):
+        """
+            Holds rpm constant and takes `steps` integrator steps of size dt (params["dt"] by
+            default) in one call. This is the same as calling step() that many times, but the
+            rpm is clipped once and the state is only stacked and unpacked once, so the Python
+            overhead per physics step is just the integrator itself. Used by the multirate
+            scheduler to run all the substeps of a control tick together.
+        """
+
+        dt = self.dt if dt is None else dt
+        self.rpm = np.clip(rpm, 0., self.max_rpm) 	# clip our RPM to a maximum value
+        integrate = self.integrator.step
+        if self.profiler is not None:
+            integrate = self.profiler.wrap("integrator", integrate)
+        if self.quaternion:
+            y = np.vstack([self.xyz, self.q, self.uvw, self.pqr])
+            for _ in range(steps):
+                y = integrate(self, y, self.rpm, dt)
+                q = y[3:7]
+                q *= 0.5*(3.-q[:,0].dot(q[:,0]))
+            self.xyz, self.q, self.uvw, self.pqr = y[0:3], y[3:7], y[7:10], y[10:13]
+        else:
+            y = np.vstack([self.xyz, self.zeta, self.uvw, self.pqr])
+            for _ in range(steps):
+                y = integrate(self, y, self.rpm, dt)
+            self.xyz, self.zeta, self.uvw, self.pqr = y[0:3], y[3:6], y[6:9], y[9:12]
+        return self.get_state()
+
+    # the stages timed by the profiler
+    profiled = ("derivatives", "velocity_derivatives", "kinematics", "attitude_kinematics", "R1", "R2", "R1_q",
+                "thrust_forces", "thrust_moments", "aero_forces", "aero_moments")
+
+    def enable_profiling(self, profiler=None):
+        """
+            Times every call to the force, moment, rotation and kinematics methods, and every
+            integrator step, with a Profiler (see profiler.py). The timed versions are set as
+            instance attributes, which shadow the methods, so nothing changes in the methods
+            themselves and disable_profiling() just deletes them again. With profiling off,
+            the only cost is one check of self.profiler per call to advance().
+        """
+
+        self.profiler = Profiler() if profiler is None else profiler
+        for name in self.profiled:
+            setattr(self, name, self.profiler.wrap(name, getattr(type(self), name).__get__(self)))
+        return self.profiler
+
+    def disable_profiling(self):
+        for name in self.profiled:
+            self.__dict__.pop(name, None)
+        self.profiler = None
+
+    @contextmanager
+    def profile(self, profiler=None):
+        """
+            Profiles everything inside a with block, and returns the profiler:
+
+            with iris.profile() as prof:
+                iris.advance(rpm, 100)
+            print(prof.summary())
+        """
 
-        self.xyz += xyz_dot*self.dt
-        self.zeta += zeta_dot*self.dt
-        return self.xyz, self.zeta, self.uvw, self.pqr
\ No newline at end of file
+        prof = self.enable_profiling(profiler)
+        try:
+            yield prof
+        finally:
+            self.disable_profiling()
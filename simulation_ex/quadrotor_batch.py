@@ -0,0 +1,292 @@
+import numpy as np
+from aircraft import AircraftParams
+from integrators import INTEGRATORS, SemiImplicitEuler
+
+class QuadrotorBatch:
+    """
+        Vectorized version of the Quadrotor simulation that steps N independent vehicles at once.
+        The physics is identical to Quadrotor.step() -- same axis system, same force and moment
+        models, same semi-implicit Euler update -- but instead of holding each vehicle's state as
+        four 3x1 column vectors, we hold the whole batch in a single contiguous (N, 12) array:
+
+            state[:, 0:3]   = xyz   (inertial position)
+            state[:, 3:6]   = zeta  (Euler angles phi, theta, psi)
+            state[:, 6:9]   = uvw   (body frame linear velocity)
+            state[:, 9:12]  = pqr   (body frame angular velocity)
+
+        The attributes xyz, zeta, uvw and pqr are views into this array, so writing to them writes
+        to the state. Rotation matrices are built as (N, 3, 3) stacks, and matrix-vector products
+        are done with einsum over the whole batch. The cost of a step is a fixed number of NumPy
+        calls regardless of N, so the Python overhead is amortized and throughput (vehicle-steps/s)
+        grows almost linearly with the batch size until we're memory bound.
+
+        Every vehicle shares the same parameter set. If you want per-vehicle parameters (e.g. for
+        dispersion studies) build one batch per parameter set. Only the Euler angle attitude and
+        the semi-implicit Euler integrator are implemented, and params asking for anything else
+        raise ValueError rather than being silently ignored.
+    """
+
+    def __init__(self, params, n):
+        params = AircraftParams.create(params)
+        if params["attitude"] != "euler":
+            raise ValueError("QuadrotorBatch only supports attitude 'euler', got {!r}".format(params["attitude"]))
+        if INTEGRATORS[params["integrator"]] is not SemiImplicitEuler:
+            raise ValueError("QuadrotorBatch only supports the semi-implicit Euler integrator, got {!r}".format(params["integrator"]))
+        self.params = params
+        self.n = n
+        self.mass = params["mass"]
+        self.prop_radius = params["prop_radius"]
+        self.n_motors = params["n_motors"]
+        self.hov_p = params["hov_p"]
+        self.l = params["l"]
+        self.Jxx = params["Jxx"]
+        self.Jyy = params["Jyy"]
+        self.Jzz = params["Jzz"]
+        self.kt = params["kt"]
+        self.kq = params["kq"]
+        self.kd = params["kd"]
+        self.km = params["km"]
+        self.g = params["g"]
+        self.dt = params["dt"]
+
+        # J is diagonal, so we only keep the diagonal and invert it elementwise
+        self.J = params.J_diag
+        self.J_inv = params.J_inv_diag
+
+        self.state = np.zeros((n, 12))
+        self.rpm = np.zeros((n, 4))
+
+        self.u_to_rpm = params.u_to_rpm
+
+        # maps rpm^2 to body moments, one row per axis. Same as thrust_moments in Quadrotor
+        self.moment_arm = params.moment_arm
+
+        # important physical limits
+        self.hov_rpm = params.hov_rpm
+        self.max_rpm = params.max_rpm
+        self.max_thrust = params.max_thrust
+        self.terminal_velocity = params.terminal_velocity
+        self.terminal_rotation = params.terminal_rotation
+
+    @property
+    def xyz(self):
+        return self.state[:, 0:3]
+
+    @property
+    def zeta(self):
+        return self.state[:, 3:6]
+
+    @property
+    def uvw(self):
+        return self.state[:, 6:9]
+
+    @property
+    def pqr(self):
+        return self.state[:, 9:12]
+
+    def set_state(self, xyz, zeta, uvw, pqr):
+        """
+            Sets the state space of the batch. Each argument is an (N, 3) array, or a (3,)
+            array that is broadcast to every vehicle.
+        """
+
+        self.state[:, 0:3] = xyz
+        self.state[:, 3:6] = zeta
+        self.state[:, 6:9] = uvw
+        self.state[:, 9:12] = pqr
+
+    def get_state(self):
+        """
+            Returns the current state space as (N, 3) views
+        """
+
+        return self.xyz, self.zeta, self.uvw, self.pqr
+
+    def reset(self):
+        """
+            Resets every vehicle in the batch to the origin, at rest
+        """
+
+        self.state[:] = 0.
+        self.rpm[:] = 0.
+        return self.get_state()
+
+    def vehicle(self, i):
+        """
+            Returns the state of vehicle i as 3x1 column vectors, in the same format as
+            Quadrotor.get_state()
+        """
+
+        s = self.state[i]
+        return s[0:3, None], s[3:6, None], s[6:9, None], s[9:12, None]
+
+    def R1(self, zeta):
+        """
+            Stack of (N, 3, 3) body-to-inertial rotation matrices. Same convention as
+            Quadrotor.R1 (Rz.Ry.Rx, East-North-Up), written out element by element so
+            that the trig functions are only evaluated once per angle.
+        """
+
+        c = np.cos(zeta)
+        s = np.sin(zeta)
+        cph, cth, cps = c[:, 0], c[:, 1], c[:, 2]
+        sph, sth, sps = s[:, 0], s[:, 1], s[:, 2]
+
+        R = np.empty((zeta.shape[0], 3, 3))
+        R[:, 0, 0] = cps*cth
+        R[:, 0, 1] = cps*sth*sph-sps*cph
+        R[:, 0, 2] = cps*sth*cph+sps*sph
+        R[:, 1, 0] = sps*cth
+        R[:, 1, 1] = sps*sth*sph+cps*cph
+        R[:, 1, 2] = sps*sth*cph-cps*sph
+        R[:, 2, 0] = -sth
+        R[:, 2, 1] = cth*sph
+        R[:, 2, 2] = cth*cph
+        return R
+
+    def R2(self, zeta):
+        """
+            Stack of (N, 3, 3) Euler rates matrices. Same convention as Quadrotor.R2, i.e. it
+            maps inertial frame angular velocity to Euler angle rates.
+        """
+
+        theta, psi = zeta[:, 1], zeta[:, 2]
+        cth, cps, sps = np.cos(theta), np.cos(psi), np.sin(psi)
+        tth = np.tan(theta)
+
+        R = np.zeros((zeta.shape[0], 3, 3))
+        R[:, 0, 0] = cps/cth
+        R[:, 0, 1] = sps/cth
+        R[:, 1, 0] = -sps
+        R[:, 1, 1] = cps
+        R[:, 2, 0] = cps*tth
+        R[:, 2, 1] = sps*tth
+        R[:, 2, 2] = 1.
+        return R
+
+    def aero_forces(self, uvw):
+        """
+            Drag in the body xyz axis (E-N-U) for every vehicle. -kd*|v|^2*v/|v| is written as
+            -kd*|v|*v, which is well defined at zero velocity so we don't need to branch.
+        """
+
+        norm = np.sqrt(np.einsum('ij,ij->i', uvw, uvw))
+        return -self.kd*norm[:, None]*uvw
+
+    def aero_moments(self, pqr):
+        """
+            Aero moments about the body xyz axis (E-N-U) for every vehicle
+        """
+
+        norm = np.sqrt(np.einsum('ij,ij->i', pqr, pqr))
+        return -self.km*norm[:, None]*pqr
+
+    def thrust_forces(self, rpm_sq):
+        """
+            Thrust forces in the body xyz axis (E-N-U) given the (N, 4) squared rpm
+        """
+
+        f = np.zeros((rpm_sq.shape[0], 3))
+        f[:, 2] = self.kt*rpm_sq.sum(axis=1)
+        return f
+
+    def thrust_moments(self, rpm_sq):
+        """
+            Moments about the body xyz axis due to motor thrust and torque, given the (N, 4)
+            squared rpm
+        """
+
+        return rpm_sq.dot(self.moment_arm.T)
+
+    def step(self, rpm, dt=None):
+        """
+            Semi-implicit Euler update of the whole batch, with a time step of dt (params["dt"]
+            by default). rpm is an (N, 4) array, or a (4,) array applied to every vehicle. See
+            Quadrotor.step() for the equations of motion; the only differences here are that
+            everything is an (N, 3) array, and that we use the structure of the problem to skip
+            work:
+
+            - R1^T G only needs the bottom row of R1, since G only has a z component.
+            - J is diagonal, so J^{-1} is an elementwise multiply.
+        """
+
+        dt = self.dt if dt is None else dt
+        self.rpm = np.clip(np.broadcast_to(rpm, (self.n, 4)), 0., self.max_rpm)
+        rpm_sq = self.rpm**2
+        zeta, uvw, pqr = self.zeta, self.uvw, self.pqr
+
+        r1 = self.R1(zeta)
+        r2 = self.R2(zeta)
+        fm = self.thrust_forces(rpm_sq)
+        tm = self.thrust_moments(rpm_sq)
+        fa = self.aero_forces(uvw)
+        ta = self.aero_moments(pqr)
+        H = self.J*pqr
+
+        g_b = -self.g*r1[:, 2, :]
+        uvw_dot = (fm+fa)/self.mass+g_b-np.cross(pqr, uvw)
+        pqr_dot = self.J_inv*(tm+ta-np.cross(pqr, H))
+
+        uvw += uvw_dot*dt
+        pqr += pqr_dot*dt
+
+        xyz_dot = np.einsum('nij,nj->ni', r1, uvw)
+        zeta_dot = np.einsum('nij,nj->ni', r2, np.einsum('nij,nj->ni', r1, pqr))
+
+        self.xyz[:] += xyz_dot*dt
+        zeta += zeta_dot*dt
+        return self.get_state()
+
+    def advance(self, rpm, steps, dt=None):
+        """
+            Takes `steps` steps with rpm held constant, using a time step of dt (params["dt"]
+            by default). Same interface as Quadrotor.advance, for the multirate scheduler.
+        """
+
+        for _ in range(steps):
+            self.step(rpm, dt)
+        return self.get_state()
+
+
+def main():
+    """
+        Checks the batch against the scalar simulation, and prints throughput for a range of
+        batch sizes.
+    """
+
+    import time
+    import config as cfg
+    import quadrotor as quad
+
+    params = cfg.params
+    n, steps = 8, 200
+    batch = QuadrotorBatch(params, n)
+    iris = quad.Quadrotor(params)
+    rng = np.random.default_rng(0)
+    batch.set_state(rng.normal(0., 1., (n, 3)), rng.normal(0., 0.2, (n, 3)),
+                    rng.normal(0., 1., (n, 3)), rng.normal(0., 0.5, (n, 3)))
+    rpm = batch.hov_rpm+rng.normal(0., 20., (n, 4))
+    start = batch.state.copy()
+    for _ in range(steps):
+        batch.step(rpm)
+    err = 0.
+    for i in range(n):
+        s = start[i]
+        iris.set_state(s[0:3, None], s[3:6, None], s[6:9, None], s[9:12, None])
+        for _ in range(steps):
+            iris.step(rpm[i])
+        err = max(err, np.abs(np.vstack(iris.get_state())[:, 0]-batch.state[i]).max())
+    print("Max abs difference vs. Quadrotor.step() after {} steps: {:.3e}".format(steps, err))
+
+    for n in [1, 10, 100, 1000, 10000]:
+        batch = QuadrotorBatch(params, n)
+        rpm = np.full((n, 4), batch.hov_rpm)
+        steps = 200
+        t0 = time.perf_counter()
+        for _ in range(steps):
+            batch.step(rpm)
+        elapsed = time.perf_counter()-t0
+        print("N = {:6d}: {:12.0f} vehicle-steps/s".format(n, n*steps/elapsed))
+
+if __name__ == "__main__":
+    main()
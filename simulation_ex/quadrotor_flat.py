@@ -0,0 +1,348 @@
+import numpy as np
+from aircraft import AircraftParams
+from integrators import INTEGRATORS, SemiImplicitEuler
+
+# Gather indices into the trig buffer (see QuadrotorFlat._trig) used to fill in the elementary
+# rotation matrices and the Euler rates matrix with np.take instead of building new arrays.
+# The indices are always in range, so the kernel uses mode='wrap': with the default
+# mode='raise', np.take copies into a temporary buffer before writing to out.
+# trig = [0, 1, cph, cth, cps, sph, sth, sps, -sph, -sth, -sps, cps/cth, sps/cth, cps*tth, sps*tth]
+_RX = np.array([1, 0, 0,
+                0, 2, 8,
+                0, 5, 2])
+_RY = np.array([3, 0, 6,
+                0, 1, 0,
+                9, 0, 3])
+_RZ = np.array([4, 10, 0,
+                7, 4, 0,
+                0, 0, 1])
+_R2 = np.array([11, 12, 0,
+                10, 4, 0,
+                13, 14, 1])
+
+# cross(a, b) = a[_C1]*b[_C2]-a[_C2]*b[_C1]
+_C1 = np.array([1, 2, 0])
+_C2 = np.array([2, 0, 1])
+
+class QuadrotorFlat:
+    """
+        Allocation-free version of the Quadrotor simulation. The state lives in one preallocated
+        12-element float64 buffer,
+
+            state = [xyz, zeta, uvw, pqr]
+
+        and xyz, zeta, uvw and pqr are 1-D views into it, so they always reflect the current state
+        and never need to be reassigned. Every intermediate quantity in step() (the rotation
+        matrices, forces, moments, cross products and derivatives) also has its own scratch
+        buffer, and the step kernel writes into these with the out= argument of the NumPy
+        ufuncs. Even the views into the scratch buffers are made once in __init__, so once the
+        simulation is running, step() keeps nothing new from one step to the next; the only
+        allocations left are NumPy's own short-lived bookkeeping inside each call (see
+        check_allocations). The class uses __slots__ so that the attribute lookups in the kernel
+        are as cheap as they can be.
+
+        The physics and the semi-implicit Euler update are the same as Quadrotor.step() with the
+        default integrator and Euler angles; params asking for another integrator or attitude
+        representation raise ValueError. The motor mixer is the 4x4 matrix AircraftParams
+        inverts for u_to_rpm; here we use it forwards, to get thrust and the three body moments
+        from rpm^2 in a single matrix multiply.
+    """
+
+    __slots__ = ("mass", "prop_radius", "n_motors", "hov_p", "l", "Jxx", "Jyy", "Jzz", "kt", "kq",
+                "kd", "km", "g", "dt", "params", "J", "J_inv", "mixer", "u_to_rpm", "hov_rpm", "max_rpm",
+                "max_thrust", "terminal_velocity", "terminal_rotation",
+                "state", "xyz", "zeta", "uvw", "pqr", "rpm",
+                "_trig", "_cos", "_sin", "_nsin", "_cth", "_cps_sps", "_tth", "_sec", "_tan",
+                "_Rx", "_Ry", "_Rz", "_Ryx", "_R1", "_R2", "_R1_z", "_Rx_f", "_Ry_f", "_Rz_f",
+                "_R2_f", "_theta", "_rpm_sq", "_u", "_tm", "_f", "_f_z", "_u_t", "_g_b", "_norm",
+                "_H", "_a", "_b", "_c", "_w", "_uvw_dot", "_pqr_dot", "_xyz_dot", "_zeta_dot")
+
+    def __init__(self, params):
+        params = AircraftParams.create(params)
+        if params["attitude"] != "euler":
+            raise ValueError("QuadrotorFlat only supports attitude 'euler', got {!r}".format(params["attitude"]))
+        if INTEGRATORS[params["integrator"]] is not SemiImplicitEuler:
+            raise ValueError("QuadrotorFlat only supports the semi-implicit Euler integrator, got {!r}".format(params["integrator"]))
+        self.params = params
+        self.mass = params["mass"]
+        self.prop_radius = params["prop_radius"]
+        self.n_motors = params["n_motors"]
+        self.hov_p = params["hov_p"]
+        self.l = params["l"]
+        self.Jxx = params["Jxx"]
+        self.Jyy = params["Jyy"]
+        self.Jzz = params["Jzz"]
+        self.kt = params["kt"]
+        self.kq = params["kq"]
+        self.kd = params["kd"]
+        self.km = params["km"]
+        self.g = params["g"]
+        self.dt = params["dt"]
+
+        self.J = params.J_diag
+        self.J_inv = params.J_inv_diag
+        self.mixer = params.mixer
+        self.u_to_rpm = params.u_to_rpm
+
+        # important physical limits
+        self.hov_rpm = params.hov_rpm
+        self.max_rpm = params.max_rpm
+        self.max_thrust = params.max_thrust
+        self.terminal_velocity = params.terminal_velocity
+        self.terminal_rotation = params.terminal_rotation
+
+        # state and views
+        self.state = np.zeros(12)
+        self.xyz = self.state[0:3]
+        self.zeta = self.state[3:6]
+        self.uvw = self.state[6:9]
+        self.pqr = self.state[9:12]
+        self.rpm = np.zeros(4)
+
+        # trig buffer and views (layout documented next to _RX above)
+        self._trig = np.zeros(15)
+        self._trig[1] = 1.
+        self._cos = self._trig[2:5]
+        self._sin = self._trig[5:8]
+        self._nsin = self._trig[8:11]
+        self._cth = self._trig[3:4]
+        self._cps_sps = self._trig[4:8:3]
+        self._sec = self._trig[11:13]
+        self._tan = self._trig[13:15]
+        self._theta = self.zeta[1:2]
+        self._tth = np.zeros(1)
+
+        # rotation matrices
+        self._Rx = np.zeros((3, 3))
+        self._Ry = np.zeros((3, 3))
+        self._Rz = np.zeros((3, 3))
+        self._Ryx = np.zeros((3, 3))
+        self._R1 = np.zeros((3, 3))
+        self._R2 = np.zeros((3, 3))
+        self._Rx_f = self._Rx.reshape(9)
+        self._Ry_f = self._Ry.reshape(9)
+        self._Rz_f = self._Rz.reshape(9)
+        self._R2_f = self._R2.reshape(9)
+        self._R1_z = self._R1[2]
+
+        # forces, moments and derivatives
+        self._rpm_sq = np.zeros(4)
+        self._u = np.zeros(4)
+        self._u_t = self._u[0:1]
+        self._tm = self._u[1:4]
+        self._f = np.zeros(3)
+        self._f_z = self._f[2:3]
+        self._g_b = np.zeros(3)
+        self._norm = np.zeros(())
+        self._H = np.zeros(3)
+        self._a = np.zeros(3)
+        self._b = np.zeros(3)
+        self._c = np.zeros(3)
+        self._w = np.zeros(3)
+        self._uvw_dot = np.zeros(3)
+        self._pqr_dot = np.zeros(3)
+        self._xyz_dot = np.zeros(3)
+        self._zeta_dot = np.zeros(3)
+
+    def set_state(self, xyz, zeta, uvw, pqr):
+        """
+            Sets the state space of our vehicle. Accepts 3x1 column vectors (as used by
+            Quadrotor) or flat 3-vectors. The values are copied into the state buffer.
+        """
+
+        self.xyz[:] = np.ravel(xyz)
+        self.zeta[:] = np.ravel(zeta)
+        self.uvw[:] = np.ravel(uvw)
+        self.pqr[:] = np.ravel(pqr)
+
+    def get_state(self):
+        """
+            Returns the current state space as views into the state buffer
+        """
+
+        return self.xyz, self.zeta, self.uvw, self.pqr
+
+    def reset(self):
+        """
+            Resets the initial state of the quadrotor
+        """
+
+        self.state[:] = 0.
+        self.rpm[:] = 0.
+        return self.get_state()
+
+    def _cross(self, a, b, out):
+        """
+            out = a x b for 3-vectors, written into out (which must not alias a or b)
+        """
+
+        np.take(a, _C1, out=self._a, mode='wrap')
+        np.take(b, _C2, out=self._b, mode='wrap')
+        np.multiply(self._a, self._b, out=out)
+        np.take(a, _C2, out=self._a, mode='wrap')
+        np.take(b, _C1, out=self._b, mode='wrap')
+        np.multiply(self._a, self._b, out=self._a)
+        np.subtract(out, self._a, out=out)
+
+    def _rotations(self):
+        """
+            Fills in R1 (body to inertial) and R2 (Euler rates) from the current zeta
+        """
+
+        trig = self._trig
+        np.cos(self.zeta, out=self._cos)
+        np.sin(self.zeta, out=self._sin)
+        np.negative(self._sin, out=self._nsin)
+        np.divide(self._cps_sps, self._cth, out=self._sec)
+        np.tan(self._theta, out=self._tth)
+        np.multiply(self._cps_sps, self._tth, out=self._tan)
+
+        np.take(trig, _RX, out=self._Rx_f, mode='wrap')
+        np.take(trig, _RY, out=self._Ry_f, mode='wrap')
+        np.take(trig, _RZ, out=self._Rz_f, mode='wrap')
+        np.take(trig, _R2, out=self._R2_f, mode='wrap')
+        np.matmul(self._Ry, self._Rx, out=self._Ryx)
+        np.matmul(self._Rz, self._Ryx, out=self._R1)
+
+    def _drag(self, v, k, out):
+        """
+            out = -k*|v|*v, i.e. drag of magnitude k*|v|^2 opposing v
+        """
+
+        np.multiply(v, v, out=self._a)
+        np.add.reduce(self._a, out=self._norm)
+        np.sqrt(self._norm, out=self._norm)
+        np.multiply(v, self._norm, out=out)
+        np.multiply(out, -k, out=out)
+
+    def step(self, rpm, dt=None):
+        """
+            Semi-implicit Euler update of the non-linear equations of motion, identical to
+            Quadrotor.step() but working entirely in preallocated buffers, with a time step of
+            dt (params["dt"] by default). See that method for the equations.
+        """
+
+        dt = self.dt if dt is None else dt
+        np.maximum(rpm, 0., out=self.rpm)				# clip our RPM to a maximum value
+        np.minimum(self.rpm, self.max_rpm, out=self.rpm)
+        np.multiply(self.rpm, self.rpm, out=self._rpm_sq)
+        self._rotations()
+
+        # thrust and thrust moments in one go: u = [T, Mx, My, Mz]
+        np.matmul(self.mixer, self._rpm_sq, out=self._u)
+
+        # linear acceleration
+        self._drag(self.uvw, self.kd, self._f)
+        np.add(self._f_z, self._u_t, out=self._f_z)
+        np.multiply(self._f, 1./self.mass, out=self._uvw_dot)
+        np.multiply(self._R1_z, -self.g, out=self._g_b)
+        np.add(self._uvw_dot, self._g_b, out=self._uvw_dot)
+        self._cross(self.pqr, self.uvw, self._c)
+        np.subtract(self._uvw_dot, self._c, out=self._uvw_dot)
+
+        # angular acceleration
+        self._drag(self.pqr, self.km, self._w)
+        np.add(self._w, self._tm, out=self._w)
+        np.multiply(self.J, self.pqr, out=self._H)
+        self._cross(self.pqr, self._H, self._c)
+        np.subtract(self._w, self._c, out=self._w)
+        np.multiply(self._w, self.J_inv, out=self._pqr_dot)
+
+        # step velocities forward
+        np.multiply(self._uvw_dot, dt, out=self._uvw_dot)
+        np.add(self.uvw, self._uvw_dot, out=self.uvw)
+        np.multiply(self._pqr_dot, dt, out=self._pqr_dot)
+        np.add(self.pqr, self._pqr_dot, out=self.pqr)
+
+        # step positions forward using the new velocities
+        np.matmul(self._R1, self.uvw, out=self._xyz_dot)
+        np.matmul(self._R1, self.pqr, out=self._w)
+        np.matmul(self._R2, self._w, out=self._zeta_dot)
+        np.multiply(self._xyz_dot, dt, out=self._xyz_dot)
+        np.add(self.xyz, self._xyz_dot, out=self.xyz)
+        np.multiply(self._zeta_dot, dt, out=self._zeta_dot)
+        np.add(self.zeta, self._zeta_dot, out=self.zeta)
+        return self.xyz, self.zeta, self.uvw, self.pqr
+
+    def advance(self, rpm, steps, dt=None):
+        """
+            Takes `steps` steps with rpm held constant, using a time step of dt (params["dt"]
+            by default). Same interface as Quadrotor.advance, for the multirate scheduler.
+        """
+
+        for _ in range(steps):
+            self.step(rpm, dt)
+        return self.get_state()
+
+
+def check_allocations(sim, rpm, steps=10000, warmup=100):
+    """
+        Runs the simulation under tracemalloc and returns (growth, peak) in bytes, where growth is
+        the change in traced memory over the run and peak is the largest excursion above the
+        starting point. The warmup steps run under tracing too: NumPy keeps a few small caches
+        (np.take holds on to one 120 byte object, for example) that get replaced the first time
+        they're used after tracing starts, which would otherwise show up as a one-off "growth".
+
+        After warmup, growth is exactly zero: nothing is kept from one step to the next. The
+        peak isn't zero, and can't be from Python. Every ufunc, take, matmul and reduction call
+        makes short-lived bookkeeping allocations of its own (argument tuples, the iterator,
+        a 0-d array for a Python float operand), a few hundred bytes that are freed before the
+        call returns. They are the same every step, so the peak doesn't change with the number
+        of steps.
+    """
+
+    import tracemalloc
+    from itertools import repeat
+
+    tracemalloc.start()
+    try:
+        for _ in repeat(None, warmup):
+            sim.step(rpm)
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        # itertools.repeat so that the loop itself doesn't allocate a new int every step
+        for _ in repeat(None, steps):
+            sim.step(rpm)
+        end, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return end-start, peak-start
+
+def main():
+    """
+        Checks the flat kernel against Quadrotor.step(), and reports allocations and steps/s
+    """
+
+    import time
+    import config as cfg
+    import quadrotor as quad
+
+    params = cfg.params
+    flat = QuadrotorFlat(params)
+    iris = quad.Quadrotor(params)
+    xyz = np.array([[0.5], [-1.], [2.]])
+    zeta = np.array([[0.2], [-0.1], [0.4]])
+    uvw = np.array([[1.], [0.3], [-0.2]])
+    pqr = np.array([[0.3], [-0.2], [0.1]])
+    rpm = flat.hov_rpm+np.array([10., -5., 3., 8.])
+    flat.set_state(xyz, zeta, uvw, pqr)
+    iris.set_state(xyz, zeta, uvw, pqr)
+    for _ in range(500):
+        flat.step(rpm)
+        iris.step(rpm)
+    err = np.abs(np.vstack(iris.get_state())[:, 0]-flat.state).max()
+    print("Max abs difference vs. Quadrotor.step() after 500 steps: {:.3e}".format(err))
+
+    for steps in [1000, 10000]:
+        growth, peak = check_allocations(flat, rpm, steps=steps)
+        print("{:6d} steps: traced memory growth {} bytes, peak {} bytes".format(steps, growth, peak))
+
+    steps = 20000
+    for sim in [iris, flat]:
+        t0 = time.perf_counter()
+        for _ in range(steps):
+            sim.step(rpm)
+        print("{}: {:.0f} steps/s".format(type(sim).__name__, steps/(time.perf_counter()-t0)))
+
+if __name__ == "__main__":
+    main()
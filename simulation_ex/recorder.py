@@ -0,0 +1,170 @@
+import os
+import json
+import numpy as np
+
+class TrajectoryRecorder:
+    """
+        Records time, state and rpm to disk as it goes, one file per column, instead of appending
+        to Python lists. Each column is a raw float64 file mapped into memory with np.memmap, so a
+        recorded row is written straight into the page cache. The files are grown a chunk of rows
+        at a time (the file is extended and re-mapped), so the cost of growing is amortized and
+        memory use doesn't depend on the length of the run. On close() the files are trimmed to
+        the number of rows actually recorded and a small meta.json header is written next to
+        them with the shapes, the decimation and the params dict.
+
+        Use decimation=k to keep only every k-th call to record(). Recordings are reopened lazily
+        (and without copying) with load().
+
+            rec = TrajectoryRecorder("run0", params)
+            for t in time:
+                iris.step(rpm)
+                rec.record(t, iris)
+            rec.close()
+    """
+
+    columns = ["time", "state", "rpm"]
+
+    def __init__(self, path, params, decimation=1, chunk=4096):
+        self.path = path
+        self.params = dict(params)
+        self.decimation = decimation
+        self.chunk = chunk
+        self.n = 0
+        self.calls = 0
+        self.capacity = 0
+        self.widths = None
+        self.maps = {}
+        self.closed = False
+        os.makedirs(path, exist_ok=True)
+
+    def _open(self, n_states):
+        self.widths = {"time": 1, "state": n_states, "rpm": 4}
+        for name in self.columns:
+            open(self._file(name), "wb").close()
+        self._grow()
+
+    def _file(self, name):
+        return os.path.join(self.path, name+".f64")
+
+    def _grow(self):
+        """
+            Extends every column file by one chunk of rows and re-maps it
+        """
+
+        self.capacity += self.chunk
+        for name in self.columns:
+            if name in self.maps:
+                self.maps[name].flush()
+                del self.maps[name]
+            with open(self._file(name), "r+b") as f:
+                f.truncate(self.capacity*self.widths[name]*8)
+            self.maps[name] = np.memmap(self._file(name), dtype=np.float64, mode="r+",
+                                        shape=(self.capacity, self.widths[name]))
+
+    def record(self, t, aircraft):
+        """
+            Records the current state and rpm of the aircraft at time t (subject to decimation)
+        """
+
+        self.calls += 1
+        if (self.calls-1)%self.decimation != 0:
+            return
+        state = np.vstack(aircraft.get_state())[:, 0]
+        if self.widths is None:
+            self._open(state.shape[0])
+        if self.n == self.capacity:
+            self._grow()
+        self.maps["time"][self.n, 0] = t
+        self.maps["state"][self.n] = state
+        self.maps["rpm"][self.n] = aircraft.rpm
+        self.n += 1
+
+    def close(self):
+        """
+            Trims the column files to the recorded length and writes the metadata header. Closing
+            again does nothing.
+        """
+
+        if self.closed:
+            return
+        self.closed = True
+        if self.widths is None:
+            # nothing was recorded, so the state width comes from the params
+            self._open(13 if self.params.get("attitude") == "quaternion" else 12)
+        for name in self.columns:
+            self.maps[name].flush()
+        self.maps = {}
+        for name in self.columns:
+            with open(self._file(name), "r+b") as f:
+                f.truncate(self.n*self.widths[name]*8)
+
+        meta = {"rows": self.n,
+                "widths": self.widths,
+                "dtype": "float64",
+                "decimation": self.decimation,
+                "attitude": self.params.get("attitude", "euler"),
+                "params": self.params}
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=4)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class Trajectory:
+    """
+        A recording opened with load(). time, state and rpm are read-only memory maps of the
+        column files, so nothing is read from disk until it's used, and slicing them doesn't
+        copy. xyz, zeta (or q), uvw and pqr are column views into state.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.params = self.meta["params"]
+        self.rows = self.meta["rows"]
+        cols = {}
+        for name, width in self.meta["widths"].items():
+            if self.rows == 0:
+                cols[name] = np.zeros((0, width))
+            else:
+                cols[name] = np.memmap(os.path.join(path, name+".f64"), dtype=self.meta["dtype"],
+                                        mode="r", shape=(self.rows, width))
+        self.time = cols["time"][:, 0]
+        self.state = cols["state"]
+        self.rpm = cols["rpm"]
+
+        n = self.state.shape[1]-6
+        self.xyz = self.state[:, 0:3]
+        self.uvw = self.state[:, n:n+3]
+        self.pqr = self.state[:, n+3:n+6]
+        if self.meta["attitude"] == "quaternion":
+            self.q = self.state[:, 3:n]
+        else:
+            self.zeta = self.state[:, 3:n]
+
+    def __len__(self):
+        return self.rows
+
+    def replay(self, aircraft, every=1):
+        """
+            Steps through the recording by setting the state of aircraft row by row, and yields
+            the time of each row. The aircraft can be the one a Visualization was built with,
+            so the recording can be redrawn with draw3d/draw3d_quat, or turned into renderer
+            snapshots:
+
+                for t in traj.replay(iris):
+                    vis.draw3d(ax)
+        """
+
+        n = self.state.shape[1]-6
+        for i in range(0, self.rows, every):
+            row = np.asarray(self.state[i])[:, None]
+            aircraft.set_state(row[0:3], row[3:n], row[n:n+3], row[n+3:n+6])
+            aircraft.rpm = np.array(self.rpm[i])
+            yield self.time[i]
+
+def load(path):
+    return Trajectory(path)
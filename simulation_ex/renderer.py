@@ -0,0 +1,139 @@
+import queue
+import threading
+import numpy as np
+
+def attitude(aircraft):
+    """
+        Body-to-inertial rotation matrix of the aircraft, for either attitude representation
+    """
+
+    if getattr(aircraft, "quaternion", False):
+        return aircraft.R1_q(aircraft.q)
+    return aircraft.R1(aircraft.zeta)
+
+def snapshot(t, aircraft):
+    """
+        Compact copy of what the renderer needs from the aircraft: time, position and attitude.
+        These go through the queue, so they must not share memory with the simulation.
+    """
+
+    return t, np.ravel(aircraft.xyz).copy(), attitude(aircraft)
+
+class Renderer:
+    """
+        Draws the aircraft by updating a fixed set of artists, instead of clearing the axes and
+        redrawing everything every frame. The axes limits and labels are set once in __init__,
+        and the aircraft is drawn with Visualization.draw_pose, which keeps its artists on the
+        axes and only moves their data around. That is much cheaper than clearing the axes with
+        axis3d.cla() and redrawing everything.
+
+        pyplot is only imported here, when we have to make a figure ourselves, so the physics
+        side of this module (snapshot, run_live's producer) imports without matplotlib.
+    """
+
+    def __init__(self, vis, ax=None, xlim=(-3, 3), ylim=(-3, 3), zlim=(0, 6)):
+        if ax is None:
+            import matplotlib.pyplot as pl
+            fig = pl.figure()
+            ax = fig.add_subplot(111, projection='3d')
+        self.vis = vis
+        self.ax = ax
+        self.fig = ax.figure
+
+        ax.set_xlim(*xlim)
+        ax.set_ylim(*ylim)
+        ax.set_zlim(*zlim)
+        ax.set_xlabel('West/East [m]')
+        ax.set_ylabel('South/North [m]')
+        ax.set_zlabel('Down/Up [m]')
+        self.title = ax.set_title("")
+
+    def update(self, t, xyz, R):
+        """
+            Moves the artists to position xyz and body-to-inertial attitude R at time t
+        """
+
+        self.vis.draw_pose(self.ax, xyz, R)
+        self.title.set_text("Time %.3f s" %t)
+
+    def draw(self):
+        self.fig.canvas.draw_idle()
+        self.fig.canvas.flush_events()
+
+def run_live(physics, renderer, maxsize=4):
+    """
+        Runs the physics generator in a background thread, and renders on this thread (GUI
+        toolkits want to be driven from the main thread). The physics thread pushes snapshots
+        into a bounded queue and never waits on it: if the queue is full, the snapshot is dropped.
+        The renderer always draws the most recent snapshot it can get and discards older ones,
+        so it never falls further behind than the queue size. The last snapshot is always
+        drawn. Returns (rendered, dropped), where dropped counts the snapshots the physics
+        thread couldn't queue plus the stale ones the renderer skipped. Each thread keeps its
+        own count, and they're only added up after the physics thread has finished.
+    """
+
+    frames = queue.Queue(maxsize)
+    done = object()
+    full = [0]
+
+    def produce():
+        pending = None
+        for snap in physics:
+            try:
+                frames.put_nowait(snap)
+                pending = None
+            except queue.Full:
+                full[0] += 1
+                pending = snap
+        # the final state is worth waiting for
+        if pending is not None:
+            frames.put(pending)
+            full[0] -= 1
+        frames.put(done)
+
+    worker = threading.Thread(target=produce, daemon=True)
+    worker.start()
+    rendered = 0
+    skipped = 0
+    finished = False
+    while not finished:
+        snap = frames.get()
+        if snap is done:
+            break
+        while True:
+            try:
+                newer = frames.get_nowait()
+            except queue.Empty:
+                break
+            if newer is done:
+                finished = True
+                break
+            skipped += 1
+            snap = newer
+        renderer.update(*snap)
+        renderer.draw()
+        rendered += 1
+    worker.join()
+    return rendered, full[0]+skipped
+
+def record(physics, renderer, path, fps=20, every=1, dpi=100):
+    """
+        Offline mode: renders every `every`-th snapshot straight into a movie file. GIFs are
+        written with Pillow, anything else with ffmpeg. No display is needed, so this works
+        with the Agg backend on a headless machine. Returns the number of frames written.
+    """
+
+    from matplotlib import animation
+    if path.endswith(".gif"):
+        writer = animation.PillowWriter(fps=fps)
+    else:
+        writer = animation.FFMpegWriter(fps=fps)
+
+    written = 0
+    with writer.saving(renderer.fig, path, dpi):
+        for i, snap in enumerate(physics):
+            if i%every == 0:
+                renderer.update(*snap)
+                writer.grab_frame()
+                written += 1
+    return written
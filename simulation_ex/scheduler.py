@@ -0,0 +1,136 @@
+import time
+from math import floor
+
+class Task:
+    """
+        A callback that runs every `period` seconds of simulation time, starting at `offset`.
+        Event times are computed as offset+k*period from an integer counter k, rather than by
+        adding period to a running total, so they don't drift over long runs.
+    """
+
+    def __init__(self, callback, period, name=None, offset=0.):
+        self.callback = callback
+        self.period = period
+        self.offset = offset
+        self.name = name or getattr(callback, "__name__", "task")
+        self.k = 0
+        self.calls = 0
+        self.elapsed = 0.
+
+    def next_time(self):
+        return self.offset+self.k*self.period
+
+class Scheduler:
+    """
+        Multirate scheduler for running controllers and sensors at their own rates on top of the
+        physics. Each task is called as callback(t, aircraft) at its event times. If it returns
+        something, that becomes the rpm command, which is held (zero-order hold) until a task
+        changes it. Sensors and loggers just return None.
+
+        Between events the physics is advanced with aircraft.advance(), which runs all the
+        substeps up to the next event in one call. Rates don't have to be integer multiples of
+        the physics time step: if the next event falls between two physics steps, the last
+        substep is shortened so the physics lands exactly on the event time. For example with a
+        0.01 s physics step and a 0.025 s controller, each tick runs two 0.01 s steps and one
+        0.005 s step, where the old dt_ratio = int(ctrl_dt/sim_dt) would have silently run the
+        controller at 0.02 s.
+
+        Timing counters are kept for each task and for the physics (see stats()).
+    """
+
+    def __init__(self, aircraft, rpm=None, tol=1e-9):
+        self.aircraft = aircraft
+        self.dt = aircraft.dt
+        self.rpm = aircraft.rpm.copy() if rpm is None else rpm
+        self.tol = tol
+        self.tasks = []
+        self.t = 0.
+        self.ticks = 0
+        self.substeps = 0
+        self.physics_elapsed = 0.
+
+    def add(self, callback, period, name=None, offset=0.):
+        """
+            Adds a task running every period seconds (i.e. at 1/period Hz), starting at
+            t = offset. Returns the Task so its counters can be inspected.
+        """
+
+        task = Task(callback, period, name, offset)
+        while task.next_time() < self.t-self.tol:
+            task.k += 1
+        self.tasks.append(task)
+        return task
+
+    def events(self, T):
+        """
+            Runs until simulation time T, yielding the time after the physics reaches each event
+            time. Tasks due at T itself are run before the generator finishes.
+        """
+
+        while True:
+            self._fire()
+            if self.t >= T-self.tol:
+                return
+            t_next = min([task.next_time() for task in self.tasks]+[T])
+            self._advance(t_next)
+            yield self.t
+
+    def run(self, T):
+        """
+            Runs until simulation time T, and returns the timing counters
+        """
+
+        for _ in self.events(T):
+            pass
+        return self.stats()
+
+    def _fire(self):
+        for task in self.tasks:
+            if task.next_time() <= self.t+self.tol:
+                t0 = time.perf_counter()
+                out = task.callback(self.t, self.aircraft)
+                task.elapsed += time.perf_counter()-t0
+                task.calls += 1
+                task.k += 1
+                if out is not None:
+                    self.rpm = out
+
+    def _advance(self, t_next):
+        """
+            Advances the physics from self.t to exactly t_next: as many full steps as fit, then
+            one shortened step for whatever is left over.
+        """
+
+        span = t_next-self.t
+        n = int(floor(span/self.dt+self.tol))
+        rem = span-n*self.dt
+        t0 = time.perf_counter()
+        if n > 0:
+            self.aircraft.advance(self.rpm, n)
+        if rem > self.tol:
+            self.aircraft.advance(self.rpm, 1, rem)
+            n += 1
+        self.physics_elapsed += time.perf_counter()-t0
+        self.substeps += n
+        self.ticks += 1
+        self.t = t_next
+
+    def stats(self):
+        """
+            Timing counters: number of physics ticks (advance intervals) and substeps, total and
+            per-substep physics time, and for each task its number of calls and total and
+            per-call time. All times are wall clock seconds.
+        """
+
+        out = {"t": self.t,
+                "ticks": self.ticks,
+                "substeps": self.substeps,
+                "physics_time": self.physics_elapsed,
+                "physics_time_per_step": self.physics_elapsed/max(1, self.substeps),
+                "tasks": {}}
+        for task in self.tasks:
+            out["tasks"][task.name] = {"period": task.period,
+                                        "calls": task.calls,
+                                        "time": task.elapsed,
+                                        "time_per_call": task.elapsed/max(1, task.calls)}
+        return out
@@ -1,47 +1,70 @@
+import sys
 import quadrotor as quad
-import animation as ani
 import config as cfg
+import renderer as ren
+import scheduler as sch
 import numpy as np
-import matplotlib.pyplot as pl
 
-def main():
-    pl.close("all")
-    pl.ion()
+def fly(iris, rpm, T, ctrl_dt):
+    """
+        Runs the validation manoeuvre and yields a renderer snapshot every control step. The
+        physics knows nothing about plotting, so it runs as fast as it can and it's up to the
+        consumer to decide which snapshots to draw. The controller runs on the multirate
+        scheduler, so ctrl_dt doesn't need to be a multiple of the physics time step.
+    """
+
+    command = rpm.copy()
+
+    def controller(t, aircraft):
+        u = command.copy()
+        command[3] += 0.25
+        return u
+
+    sched = sch.Scheduler(iris)
+    sched.add(controller, ctrl_dt)
+    for t in sched.events(T):
+        yield ren.snapshot(t, iris)
+
+def main(output=None):
+    """
+        Flies the validation manoeuvre. With no output file the aircraft is drawn live, with
+        physics and rendering decoupled (see renderer.run_live). With an output file (.gif,
+        .mp4, ...) the frames are written straight to disk, without a display. Plotting is
+        only imported here, so fly() can be used headless without matplotlib.
+    """
+
+    import matplotlib.pyplot as pl
+    import animation as ani
+
+    if output is not None:
+        pl.switch_backend("Agg")
+    else:
+        pl.close("all")
+        pl.ion()
     fig = pl.figure(0)
     axis3d = fig.add_subplot(111, projection='3d')
-    
+
     params = cfg.params
     iris = quad.Quadrotor(params)
     T = 3.5
-    sim_dt = iris.dt
     ctrl_dt = 0.05
-    dt_ratio = int(ctrl_dt/sim_dt)
-    time = np.linspace(0, T, T/ctrl_dt)
     hover_rpm = iris.hov_rpm
     trim = np.array([hover_rpm, hover_rpm, hover_rpm, hover_rpm])
-    vis = ani.Visualization(iris, 10)
+    vis = ani.Visualization(iris, 10, quaternion=iris.quaternion)
+    renderer = ren.Renderer(vis, axis3d)
 
-    counter = 0
     frames = 2
     rpm = trim+50
+    physics = fly(iris, rpm, T, ctrl_dt)
 
-    for t in time:
-        for k in range(dt_ratio):
-            iris.step(rpm)
-        if counter%frames == 0:
-            pl.figure(0)
-            axis3d.cla()
-            vis.draw3d(axis3d)
-            axis3d.set_xlim(-3, 3)
-            axis3d.set_ylim(-3, 3)
-            axis3d.set_zlim(0, 6)
-            axis3d.set_xlabel('West/East [m]')
-            axis3d.set_ylabel('South/North [m]')
-            axis3d.set_zlabel('Down/Up [m]')
-            axis3d.set_title("Time %.3f s" %t)
-            pl.pause(0.001)
-            pl.draw()
-        rpm += np.array([0., 0., 0., 0.25])
+    if output is None:
+        rendered, dropped = ren.run_live(physics, renderer)
+        print("Rendered {} frames, dropped {}".format(rendered, dropped))
+        pl.ioff()
+        pl.show()
+    else:
+        written = ren.record(physics, renderer, output, fps=int(1./(frames*ctrl_dt)), every=frames)
+        print("Wrote {} frames to {}".format(written, output))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
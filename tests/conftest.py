@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the exercises are flat modules that import each other by name, the way they're run from
+# their own folders
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ["simulation_ex", "examples", "machine_learning"]:
+    sys.path.insert(0, os.path.join(ROOT, folder))
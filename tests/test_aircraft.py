@@ -0,0 +1,93 @@
+import pickle
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+import config as cfg
+from aircraft import AircraftParams
+
+def test_errors_are_listed_together():
+    params = dict(cfg.params, layout="y", integrator="euler2", hov_p=1.5)
+    del params["mass"]
+    with pytest.raises(ValueError) as err:
+        AircraftParams(params)
+    message = str(err.value)
+    for part in ["missing 'mass'", "'layout' must be", "'integrator' must be"]:
+        assert part in message
+
+    with pytest.raises(ValueError) as err:
+        AircraftParams(dict(cfg.params, hov_p=1.5, kt=-1., n_motors=6))
+    message = str(err.value)
+    for part in ["'hov_p' must be between 0 and 1", "'kt' must be positive", "'n_motors' must be 4"]:
+        assert part in message
+
+def test_mixer_layouts():
+    plus = AircraftParams(dict(cfg.params, layout="+"))
+    x = AircraftParams(dict(cfg.params, layout="x"))
+    l, kt, kq = cfg.params["l"], cfg.params["kt"], cfg.params["kq"]
+    assert np.array_equal(plus.mixer, np.array([[kt, kt, kt, kt],
+                                                [0., l*kt, 0., -l*kt],
+                                                [-l*kt, 0., l*kt, 0.],
+                                                [-kq, kq, -kq, kq]]))
+    arm = l*kt/np.sqrt(2.)
+    assert np.allclose(x.mixer, np.array([[kt, kt, kt, kt],
+                                        [arm, arm, -arm, -arm],
+                                        [-arm, arm, arm, -arm],
+                                        [-kq, kq, -kq, kq]]), rtol=1e-14, atol=0.)
+    for p in [plus, x]:
+        assert np.allclose(p.mixer.dot(p.u_to_rpm), np.eye(4), rtol=0., atol=1e-12)
+        assert np.array_equal(p.moment_arm, p.mixer[1:])
+        # hovering thrust and limits don't depend on the layout
+        assert p.hov_rpm == plus.hov_rpm and p.max_thrust == plus.max_thrust
+
+def test_immutable():
+    p = AircraftParams(cfg.params)
+    with pytest.raises(AttributeError):
+        p.mass = 1.
+    with pytest.raises(AttributeError):
+        p.J = np.eye(3)
+    with pytest.raises(TypeError):
+        p["mass"] = 1.
+    for key in ["J", "J_inv", "G", "mixer", "u_to_rpm", "moment_arm"]:
+        with pytest.raises(ValueError):
+            getattr(p, key)[0, 0] = 1.
+    assert p.mass == cfg.params["mass"]
+
+def test_mapping_round_trip():
+    p = AircraftParams(dict(cfg.params, extra_key="kept"))
+    assert dict(p) == dict(cfg.params, extra_key="kept")
+    assert len(p) == len(cfg.params)+1
+    assert p["extra_key"] == "kept"
+    with pytest.raises(KeyError):
+        p["missing"]
+    assert AircraftParams.create(p) is p
+    for copy in [AircraftParams(dict(p)), pickle.loads(pickle.dumps(p))]:
+        assert dict(copy) == dict(p)
+        assert np.array_equal(copy.u_to_rpm, p.u_to_rpm)
+    changed = p.replace(mass=1.)
+    assert changed.mass == 1. and p.mass == cfg.params["mass"]
+    assert changed.hov_rpm > p.hov_rpm
+
+def attached(handle):
+    p = AircraftParams.attach(handle)
+    return p.hov_rpm, p.u_to_rpm.copy(), p.layout, p.mixer.flags.writeable
+
+@pytest.mark.parametrize("method", ["fork", "spawn"])
+def test_share_attach(method):
+    if method not in mp.get_all_start_methods():
+        pytest.skip("no {} start method here".format(method))
+    p = AircraftParams(dict(cfg.params, layout="x"))
+    shm, handle = p.share()
+    try:
+        with ProcessPoolExecutor(2, mp_context=mp.get_context(method)) as pool:
+            results = list(pool.map(attached, [handle]*2))
+    finally:
+        shm.close()
+        shm.unlink()
+    for hov_rpm, u_to_rpm, layout, writeable in results:
+        assert hov_rpm == p.hov_rpm
+        assert np.array_equal(u_to_rpm, p.u_to_rpm)
+        assert layout == "x"
+        assert not writeable
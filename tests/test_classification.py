@@ -0,0 +1,51 @@
+import numpy as np
+from scipy.optimize import check_grad
+
+from classification import SoftmaxLoss, SoftmaxRegression, exponents, one_hot, poly_features
+
+def problem(n=200, dim=3, classes=4, l2=1e-3):
+    rng = np.random.default_rng(0)
+    X = poly_features(rng.standard_normal((n, dim)), 2)
+    Y = one_hot(rng.integers(classes, size=n), classes)
+    return SoftmaxLoss(X, Y, l2), rng.standard_normal(classes*X.shape[1])
+
+def test_gradient():
+    loss, theta = problem()
+    err = check_grad(lambda t: loss(t)[0], lambda t: loss(t)[1], theta)
+    assert err < 1e-6*np.linalg.norm(loss(theta)[1])
+
+def test_hessp():
+    loss, theta = problem()
+    rng = np.random.default_rng(1)
+    for _ in range(3):
+        v = rng.standard_normal(theta.shape[0])
+        # H*v is the gradient of v.grad(theta)
+        err = check_grad(lambda t: loss(t)[1].dot(v), lambda t: loss.hessp(t, v), theta)
+        assert err < 1e-6*np.linalg.norm(loss.hessp(theta, v))
+    assert loss.n_hessp > 0
+
+def test_poly_features():
+    rng = np.random.default_rng(0)
+    for dim, degree in [(1, 4), (2, 6), (3, 3)]:
+        X = rng.uniform(-1.5, 1.5, (50, dim))
+        direct = np.array([[np.prod([x[j]**e[j] for j in range(dim)]) for e in exponents(dim, degree)] for x in X])
+        assert np.allclose(poly_features(X, degree), direct, rtol=1e-13, atol=1e-13)
+        assert exponents(dim, degree)[0].sum() == 0
+        assert exponents(dim, degree).sum(axis=1).max() == degree
+    X = rng.uniform(-1.5, 1.5, (50, 2))
+    homogeneous = np.column_stack([np.ones(50)]+[X[:, 0]**(6-i)*X[:, 1]**i for i in range(6)])
+    assert np.allclose(poly_features(X, 6, homogeneous=True), homogeneous, rtol=1e-13, atol=1e-13)
+
+def test_methods_agree():
+    rng = np.random.default_rng(0)
+    centres = np.array([[0., 0.], [1., 1.], [1., 0.], [0., 1.]])
+    idx = rng.integers(4, size=400)
+    X = centres[idx]+0.1*rng.standard_normal((400, 2))
+    y = (idx >= 2).astype(int)
+    fits = [SoftmaxRegression(degree=4, l2=1e-3, method=method, tol=1e-10).fit(X, y)
+            for method in ["L-BFGS-B", "Newton-CG"]]
+    assert all(fit.result.success for fit in fits)
+    # L-BFGS-B stops on the relative change in the loss, so the weights only agree loosely
+    assert abs(fits[0].result.fun-fits[1].result.fun) < 1e-8
+    assert np.allclose(fits[0].W, fits[1].W, rtol=0., atol=1e-3)
+    assert fits[1].score(X, y) == 1.
@@ -0,0 +1,25 @@
+import numpy as np
+
+from clustering import GaussianMixture
+
+def mixture(n, seed=0):
+    rng = np.random.default_rng(seed)
+    truth = GaussianMixture(5, seed=seed)
+    truth.means = np.array([[0., 0.], [8., 0.], [0., 8.], [8., 8.], [4., 4.]])
+    truth.weights = np.array([0.1, 0.2, 0.3, 0.15, 0.25])
+    A = rng.normal(0., 0.6, (5, 2, 2))
+    truth.set_covs(np.einsum('kij,klj->kil', A, A)+0.05*np.eye(2))
+    return truth, truth.sample(n)[0]
+
+def test_em_recovers_separated_mixture():
+    truth, X = mixture(20000)
+    gmm = GaussianMixture(5, tol=1e-6, seed=0).fit(X)
+    assert gmm.converged
+    assert gmm.log_likelihood >= truth.score_samples(X).mean()-1e-3
+    order = np.argsort(gmm.weights)
+    assert np.allclose(gmm.weights[order], np.sort(truth.weights), atol=0.01)
+
+def test_em_from_truth_doesnt_lose_likelihood():
+    truth, X = mixture(20000, seed=1)
+    gmm = GaussianMixture(5, tol=1e-6).fit(X, (truth.weights, truth.means, truth.covs))
+    assert gmm.log_likelihood >= truth.score_samples(X).mean()
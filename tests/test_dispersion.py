@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+import config as cfg
+import quadrotor as quad
+from dispersion import Dispersion, hold, load
+from env import QuadrotorVecEnv
+
+def sweep(spec):
+    hov_rpm = quad.Quadrotor(cfg.params).hov_rpm
+    return Dispersion(cfg.params, spec, hold([hov_rpm]*4), T=0.1, ctrl_dt=0.05)
+
+def test_resume_same_sweep(tmp_path):
+    study = sweep({"mass": ("scale", 0.9, 1.1)})
+    cases, summaries = zip(*study.run(6, workers=2, chunk_size=2, out_dir=str(tmp_path)))
+    resumed = list(study.run(6, workers=2, chunk_size=2, out_dir=str(tmp_path)))
+    assert len(resumed) == 3
+    ids, data = load(str(tmp_path))
+    assert np.array_equal(ids, np.arange(6))
+    assert np.array_equal(data, np.vstack(summaries)[np.argsort(np.concatenate(cases))])
+
+def test_resume_different_sweep(tmp_path):
+    list(sweep({"mass": ("scale", 0.9, 1.1)}).run(4, workers=2, chunk_size=2, out_dir=str(tmp_path)))
+    with pytest.raises(ValueError):
+        list(sweep({"kd": ("scale", 0.5, 1.5)}).run(4, workers=2, chunk_size=2, out_dir=str(tmp_path)))
+    with pytest.raises(ValueError):
+        list(sweep({"mass": ("scale", 0.9, 1.2)}).run(4, workers=2, chunk_size=2, out_dir=str(tmp_path)))
+
+class RecordTimes:
+    def __init__(self, rpm):
+        self.rpm = rpm
+        self.times = []
+
+    def __call__(self, t, aircraft):
+        self.times.append(t)
+        return self.rpm
+
+def test_non_integer_rate_ratio():
+    schedule = RecordTimes(np.array([quad.Quadrotor(cfg.params).hov_rpm]*4))
+    study = Dispersion(cfg.params, {}, schedule, T=1., ctrl_dt=0.025, summarize=lambda traj: [len(traj)])
+    assert study.run_case(0)[-1] == 41
+    assert np.allclose(schedule.times, 0.025*np.arange(41), rtol=0., atol=1e-12)
+
+def test_env_rejects_non_multiple_ctrl_dt():
+    assert QuadrotorVecEnv(cfg.params, 2, ctrl_dt=0.05).substeps == 5
+    with pytest.raises(ValueError):
+        QuadrotorVecEnv(cfg.params, 2, ctrl_dt=0.025)
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from fib import fib, fib_loop, fib_doubling, fib_cached, fib_mod
+
+def test_small_n_agree():
+	expected = [0, 1, 1, 2, 3, 5, 8, 13, 21, 34, 55]
+	for n in range(20):
+		assert fib(n) == fib_loop(n) == fib_doubling(n) == fib_cached(n)
+		if n < len(expected):
+			assert fib(n) == expected[n]
+
+def test_large_n_agree():
+	for n in [100, 1000, 12345]:
+		assert fib_doubling(n) == fib_loop(n) == fib_cached(n)
+
+@pytest.mark.parametrize("m", [2, 10, 10**9+7, 2**32])
+def test_mod_matches_exact(m):
+	n = np.array([0, 1, 2, 3, 10, 99, 1000, 4097])
+	assert fib_mod(n, m).tolist() == [fib_loop(int(k)) % m for k in n]
+
+def test_negative_n():
+	with pytest.raises(ValueError):
+		fib_doubling(-1)
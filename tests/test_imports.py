@@ -0,0 +1,46 @@
+import os
+import sys
+import json
+import subprocess
+
+SIMULATION = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "simulation_ex")
+
+# everything a headless worker (sweeps, vectorized envs, recording) might import
+PHYSICS = ["config", "aircraft", "integrators", "profiler", "quadrotor", "quadrotor_batch",
+            "quadrotor_flat", "scheduler", "recorder", "renderer", "dispersion", "env", "validate_sim",
+            "animation"]
+
+# none of which should drag in plotting
+FORBIDDEN = {"matplotlib", "mpl_toolkits", "IPython"}
+
+CODE = """
+import sys, json, time
+import numpy
+t0 = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+t1 = time.perf_counter()
+print(json.dumps({{"seconds": t1-t0, "modules": sorted({{m.split(".")[0] for m in sys.modules}})}}))
+"""
+
+def import_fresh(modules=PHYSICS):
+    """
+        Imports the modules in a fresh interpreter, and returns how long that took in seconds
+        (after numpy, which everything needs anyway) and the top level modules that ended up
+        in sys.modules
+    """
+
+    out = subprocess.run([sys.executable, "-c", CODE.format(modules=list(modules))], cwd=SIMULATION,
+                        capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout)
+    return result["seconds"], set(result["modules"])
+
+def test_physics_imports_without_plotting():
+    _, loaded = import_fresh()
+    assert set(PHYSICS) <= loaded
+    assert not loaded & FORBIDDEN
+
+def test_physics_import_time():
+    # generous, so it only trips when something heavy sneaks in; set IMPORT_BUDGET_MS to tighten it
+    budget = float(os.environ.get("IMPORT_BUDGET_MS", 300))*1e-3
+    assert min(import_fresh()[0] for _ in range(5)) < budget
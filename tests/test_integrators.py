@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from scipy.integrate import solve_ivp
+
+import config as cfg
+import quadrotor as quad
+
+STATE = (np.array([[0.5], [-1.], [2.]]), np.array([[0.2], [-0.1], [0.4]]),
+        np.array([[1.], [0.3], [-0.2]]), np.array([[0.3], [-0.2], [0.1]]))
+T = 1.
+
+def fly(integrator, dt, **options):
+    iris = quad.Quadrotor(dict(cfg.params, integrator=integrator, **options))
+    iris.set_state(*STATE)
+    rpm = iris.hov_rpm+np.array([10., -5., 3., 8.])
+    iris.advance(rpm, int(round(T/dt)), dt)
+    return np.vstack(iris.get_state())[:, 0]
+
+@pytest.fixture(scope="module")
+def reference():
+    # an independent high order solution of the same equations of motion
+    iris = quad.Quadrotor(cfg.params)
+    rpm = np.clip(iris.hov_rpm+np.array([10., -5., 3., 8.]), 0., iris.max_rpm)
+    sol = solve_ivp(lambda t, y: iris.derivatives(y[:, None], rpm)[:, 0], (0., T),
+                    np.vstack(STATE)[:, 0], method="DOP853", rtol=1e-13, atol=1e-13)
+    return sol.y[:, -1]
+
+def test_rk4_is_fourth_order(reference):
+    errors = [np.abs(fly("rk4", dt)-reference).max() for dt in [0.02, 0.01]]
+    assert errors[1] < 1e-6
+    assert 12. < errors[0]/errors[1] < 20.
+
+def test_semi_implicit_is_first_order(reference):
+    errors = [np.abs(fly("semi_implicit", dt)-reference).max() for dt in [0.002, 0.001]]
+    assert 1.6 < errors[0]/errors[1] < 2.4
+
+def test_dormand_prince_meets_tolerance(reference):
+    assert np.abs(fly("rk45", 0.05, rtol=1e-10, atol=1e-12)-reference).max() < 1e-7
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+import config as cfg
+import quadrotor as quad
+from linearize import Linearizer, jacobians
+
+CONDITIONS = [{}, {"V": (0., 0., 2.)}, {"V": (5., 0., 0.)}, {"V": (5., 0., 0.), "yaw_rate": 0.5}]
+
+@pytest.mark.parametrize("condition", CONDITIONS)
+def test_jacobians_match_finite_differences(condition):
+    iris = quad.Quadrotor(cfg.params)
+    lin = Linearizer(cfg.params)
+    x, rpm = lin.trim(**condition)
+
+    def f(x, rpm):
+        return iris.derivatives(x[:, None], rpm)[:, 0]
+
+    A, B = jacobians(lin.params, x, rpm)
+    h = 1e-6
+    A_fd = np.stack([(f(x+h*e, rpm)-f(x-h*e, rpm))/(2*h) for e in np.eye(12)], axis=1)
+    B_fd = np.stack([(f(x, rpm+h*e)-f(x, rpm-h*e))/(2*h) for e in np.eye(4)], axis=1)
+    assert np.abs(f(x, rpm)[6:]).max() < 1e-8
+    # central differences round off at about |f|*eps/h, ~1e-7 here
+    np.testing.assert_allclose(A, A_fd, rtol=1e-6, atol=1e-6)
+    np.testing.assert_allclose(B, B_fd, rtol=1e-6, atol=1e-6*np.abs(B).max())
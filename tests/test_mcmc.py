@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from mcmc import Sampler, ess
+
+def log_prob(theta):
+    return -0.5*((theta-50.)**2/np.array([1., 4.])).sum(axis=1)
+
+@pytest.mark.parametrize("block", [1000, 64, 37])
+def test_running_ess_matches_stored(block):
+    sampler = Sampler(log_prob, 2, chains=16, scale=0.3, block=block, seed=1)
+    samples = sampler.run(600, burn_in=200, verbose=False)
+    assert np.allclose(sampler.ess(), ess(samples), rtol=1e-8)
+
+def test_iterate_before_run():
+    sampler = Sampler(log_prob, 2, chains=4, seed=0)
+    sampler.init(50.)
+    sampler.iterate(10, adapt=True)
+    assert sampler.t == 10
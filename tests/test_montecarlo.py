@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+
+from montecarlo import integrate
+
+@pytest.mark.parametrize("method", ["sobol", "halton"])
+def test_qmc_1d_replicates_differ(method):
+    est = integrate(lambda x: x**2, 0., 6., tol=1e-3, method=method, seed=0, max_samples=10**7)
+    assert est.stderr > 0.
+    assert est.converged
+    assert abs(est.value-72.) < 5.*est.stderr
+
+def test_qmc_constant_integrand_converges():
+    est = integrate(lambda x: np.full(x.shape[0], 2.), 0., 1., tol=1e-3, method="sobol", seed=0)
+    assert est.converged and est.value == 2.
@@ -0,0 +1,24 @@
+import numpy as np
+
+from optim import Adam, Momentum, Trainer, lstsq
+
+def dataset(n=20000):
+    rng = np.random.default_rng(0)
+    x = rng.uniform(-1, 1, n)
+    X = np.stack([x, np.ones(n)], axis=1)
+    return X, 3.*x-2.+0.8*rng.standard_normal(n)
+
+def test_converges_to_lstsq(capsys):
+    data = dataset()
+    trainer = Trainer(Momentum(lr=0.1), batch_size=data[0].shape[0], tol=1e-6, max_epochs=1000)
+    assert not trainer.converged and trainer.epochs == 0
+    theta = trainer.fit(np.zeros(2), data)
+    assert trainer.converged and trainer.epochs < 1000
+    assert np.allclose(theta, lstsq(data), rtol=0., atol=1e-5)
+    assert "without converging" not in capsys.readouterr().out
+
+def test_reports_running_out_of_epochs(capsys):
+    trainer = Trainer(Adam(lr=1e-3), batch_size=1024, tol=1e-4, max_epochs=2)
+    trainer.fit(np.zeros(2), dataset())
+    assert not trainer.converged and trainer.epochs == 2
+    assert "Stopped after 2 epochs without converging" in capsys.readouterr().out
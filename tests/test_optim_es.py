@@ -0,0 +1,45 @@
+import numpy as np
+
+from optim_es import CEM
+
+def quadratic(theta):
+    return np.sum((theta-np.array([1., -2., 3.]))**2, axis=1)
+
+class Recorded:
+    # remembers every parameter vector it was asked to evaluate
+    def __init__(self):
+        self.theta = []
+
+    def __call__(self, theta):
+        self.theta.append(theta.copy())
+        return quadratic(theta)
+
+def test_chunked_elites_match_full_sort():
+    objective = Recorded()
+    cem = CEM(objective, np.zeros(3), 2., samples=1000, n_elite=50, chunk_size=64, seed=0)
+    cost = cem.step()
+    theta = np.vstack(objective.theta)
+    assert theta.shape == (1000, 3)
+    order = np.argsort(quadratic(theta))[:50]
+    elites = theta[order]
+    assert np.isclose(cost, quadratic(elites).mean(), rtol=1e-12)
+    assert np.allclose(cem.mean, elites.mean(axis=0), rtol=1e-12, atol=1e-12)
+    assert np.allclose(cem.std, elites.std(axis=0), rtol=1e-12, atol=1e-12)
+    best, best_cost = cem.best()
+    assert np.array_equal(best, elites[0])
+    assert best_cost == quadratic(elites[:1])[0]
+
+def test_chunk_size_doesnt_change_the_result():
+    runs = [CEM(quadratic, np.zeros(3), 2., samples=500, chunk_size=chunk, seed=1) for chunk in [32, 500]]
+    for cem in runs:
+        for _ in range(5):
+            cem.step()
+    assert np.allclose(runs[0].mean, runs[1].mean, rtol=1e-12, atol=1e-12)
+
+def test_n_elite_larger_than_population():
+    cem = CEM(quadratic, np.zeros(3), 2., samples=100, n_elite=500, chunk_size=32, seed=0)
+    assert cem.n_elite == 100
+    cem.step()
+    best, cost = cem.best()
+    assert np.isfinite(cost)
+    assert cost == quadratic(best[None])[0]
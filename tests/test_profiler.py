@@ -0,0 +1,55 @@
+import json
+
+import numpy as np
+
+import config as cfg
+import quadrotor as quad
+from profiler import Profiler, Stage
+
+def test_percentile_within_max():
+    stage = Stage()
+    for dt in [1000, 1200, 3267]:
+        stage.count += 1
+        stage.total += dt
+        stage.max = max(stage.max, dt)
+        stage.hist[dt.bit_length()] += 1
+    assert stage.percentile(50) == 2048
+    assert stage.percentile(99) == 3267
+
+def test_reset_keeps_stages():
+    iris = quad.Quadrotor(cfg.params)
+    rpm = np.full(4, iris.hov_rpm)
+    prof = iris.enable_profiling()
+    iris.advance(rpm, 20)
+    stages = set(prof.stages)
+    prof.reset()
+    assert all(stage.count == 0 for stage in prof.stages.values())
+    assert not prof.stacks and not prof.events
+
+    iris.advance(rpm, 10)
+    iris.disable_profiling()
+    assert prof.stages["integrator"].count == 10
+    counted = {name for name, stage in prof.stages.items() if stage.count}
+    assert "velocity_derivatives" in counted and counted <= stages
+    rows = {line.split()[0] for line in prof.summary().splitlines()[1:]}
+    assert rows == counted
+
+def test_nested_stacks(tmp_path):
+    prof = Profiler()
+    inner = prof.wrap("inner", lambda: sum(range(1000)))
+    outer = prof.wrap("outer", lambda: [inner() for _ in range(3)])
+    for _ in range(5):
+        outer()
+    assert prof.stages["outer"].count == 5
+    assert prof.stages["inner"].count == 15
+    assert set(prof.stacks) == {("outer",), ("outer", "inner")}
+    own = prof.self_times()
+    assert own[("outer",)] == prof.stacks[("outer",)]-prof.stacks[("outer", "inner")]
+
+    prof.chrome_trace(str(tmp_path/"trace.json"))
+    with open(str(tmp_path/"trace.json")) as f:
+        events = json.load(f)["traceEvents"]
+    assert len(events) == 20
+    prof.folded(str(tmp_path/"stacks.folded"))
+    with open(str(tmp_path/"stacks.folded")) as f:
+        assert {line.rsplit(" ", 1)[0] for line in f} <= {"outer", "outer;inner"}
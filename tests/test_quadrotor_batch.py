@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+import config as cfg
+import quadrotor as quad
+from quadrotor_batch import QuadrotorBatch
+
+def test_matches_quadrotor():
+    n, steps = 8, 200
+    batch = QuadrotorBatch(cfg.params, n)
+    iris = quad.Quadrotor(cfg.params)
+    rng = np.random.default_rng(0)
+    batch.set_state(rng.normal(0., 1., (n, 3)), rng.normal(0., 0.2, (n, 3)),
+                    rng.normal(0., 1., (n, 3)), rng.normal(0., 0.5, (n, 3)))
+    rpm = batch.hov_rpm+rng.normal(0., 20., (n, 4))
+    start = batch.state.copy()
+    batch.advance(rpm, steps)
+    for i in range(n):
+        iris.set_state(*(start[i, j:j+3, None] for j in range(0, 12, 3)))
+        iris.advance(rpm[i], steps)
+        # einsum and the scalar matrix products round differently, so allow for the states
+        # being O(10) after 200 steps
+        np.testing.assert_allclose(np.vstack(iris.get_state())[:, 0], batch.state[i], rtol=1e-12, atol=1e-12)
+
+def test_advance_dt_leaves_params_alone():
+    batch = QuadrotorBatch(cfg.params, 4)
+    other = QuadrotorBatch(cfg.params, 4)
+    rpm = batch.hov_rpm+np.array([10., 0., 10., 0.])
+    batch.advance(rpm, 3, 0.5*batch.dt)
+    for _ in range(3):
+        other.step(rpm, 0.5*other.dt)
+    assert batch.dt == cfg.params["dt"]
+    assert np.array_equal(batch.state, other.state)
+
+@pytest.mark.parametrize("option", [{"attitude": "quaternion"}, {"integrator": "rk4"}])
+def test_unsupported_params(option):
+    with pytest.raises(ValueError):
+        QuadrotorBatch(dict(cfg.params, **option), 2)
+
+def test_euler_is_an_alias():
+    QuadrotorBatch(dict(cfg.params, integrator="euler"), 2)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+import config as cfg
+import quadrotor as quad
+from quadrotor_flat import QuadrotorFlat, check_allocations
+
+def setup(steps=500):
+    flat = QuadrotorFlat(cfg.params)
+    iris = quad.Quadrotor(cfg.params)
+    state = (np.array([[0.5], [-1.], [2.]]), np.array([[0.2], [-0.1], [0.4]]),
+            np.array([[1.], [0.3], [-0.2]]), np.array([[0.3], [-0.2], [0.1]]))
+    flat.set_state(*state)
+    iris.set_state(*state)
+    rpm = flat.hov_rpm+np.array([10., -5., 3., 8.])
+    for _ in range(steps):
+        flat.step(rpm)
+        iris.step(rpm)
+    return flat, iris, rpm
+
+def test_matches_quadrotor():
+    flat, iris, _ = setup()
+    assert np.abs(np.vstack(iris.get_state())[:, 0]-flat.state).max() <= 1e-12
+
+def test_no_steady_state_allocations():
+    flat, _, rpm = setup(0)
+    # the first run under tracemalloc also catches a few bytes of one-off interpreter caches
+    check_allocations(flat, rpm, steps=100)
+    # a new array kept per step would be at least 100 bytes a step, so 5000 steps would show
+    # hundreds of kB; the peak only holds NumPy's per-call bookkeeping (see check_allocations)
+    growth, peak = check_allocations(flat, rpm, steps=5000)
+    assert growth <= 0
+    assert peak < 4096
+
+def test_advance_dt_leaves_params_alone():
+    flat = QuadrotorFlat(cfg.params)
+    iris = quad.Quadrotor(cfg.params)
+    rpm = flat.hov_rpm+np.array([10., 0., 10., 0.])
+    flat.advance(rpm, 20, 0.5*flat.dt)
+    iris.advance(rpm, 20, 0.5*iris.dt)
+    assert flat.dt == cfg.params["dt"]
+    assert np.abs(np.vstack(iris.get_state())[:, 0]-flat.state).max() <= 1e-12
+
+@pytest.mark.parametrize("option", [{"attitude": "quaternion"}, {"integrator": "rk45"}])
+def test_unsupported_params(option):
+    with pytest.raises(ValueError):
+        QuadrotorFlat(dict(cfg.params, **option))
+
+def test_euler_is_an_alias():
+    QuadrotorFlat(dict(cfg.params, integrator="euler"))
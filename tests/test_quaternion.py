@@ -0,0 +1,70 @@
+import numpy as np
+
+import config as cfg
+import quadrotor as quad
+from animation import Visualization
+
+ZETAS = [np.array([[0.1], [-0.2], [0.3]]), np.array([[-1.2], [0.7], [2.9]]), np.array([[0.], [1.5], [-2.]])]
+
+def fly(params, steps, zeta, rpm_delta):
+    # Euler and quaternion RK4 runs from the same initial state, returns both aircraft
+    pair = [quad.Quadrotor(dict(params, integrator="rk4")),
+            quad.Quadrotor(dict(params, integrator="rk4", attitude="quaternion"))]
+    for aircraft in pair:
+        aircraft.set_state(np.zeros((3, 1)), zeta, np.array([[0.5], [0.], [-0.2]]), np.array([[0.2], [-0.1], [0.3]]))
+        rpm = aircraft.hov_rpm+rpm_delta
+        for _ in range(steps):
+            aircraft.step(rpm)
+    return pair
+
+def gap(euler, quat):
+    # largest difference in position, velocities and body-to-inertial matrix
+    return max(np.abs(euler.xyz-quat.xyz).max(), np.abs(euler.uvw-quat.uvw).max(),
+                np.abs(euler.pqr-quat.pqr).max(), np.abs(euler.R1(euler.zeta)-quat.R1_q(quat.q)).max())
+
+def test_euler_to_q_matches_R1():
+    iris = quad.Quadrotor(dict(cfg.params, attitude="quaternion"))
+    for zeta in ZETAS:
+        q = iris.euler_to_q(zeta)
+        assert np.isclose(np.linalg.norm(q), 1., rtol=0., atol=1e-15)
+        assert np.allclose(iris.R1_q(q), iris.R1(zeta), rtol=0., atol=1e-14)
+
+def test_visualization_R_interop():
+    iris = quad.Quadrotor(dict(cfg.params, attitude="quaternion"))
+    vis = Visualization(iris, 12, quaternion=True)
+    for zeta in ZETAS:
+        q = iris.euler_to_q(zeta)
+        assert np.allclose(vis.R(vis.q_conj(q)), iris.R1_q(q), rtol=0., atol=1e-14)
+
+def test_matches_euler_trajectory():
+    # both are RK4 on the same motion, so they agree up to the truncation error, which is
+    # fourth order in dt
+    euler, quat = fly(cfg.params, 100, ZETAS[0], np.array([2., -1., 0.5, 0.]))
+    assert gap(euler, quat) < 1e-8
+    errors = [gap(*fly(dict(cfg.params, dt=dt), int(round(1./dt)), ZETAS[0], np.array([20., -10., 5., 0.])))
+                for dt in [0.01, 0.005]]
+    assert 12. < errors[0]/errors[1] < 20.
+
+def test_unit_norm():
+    # one Newton step per physics step leaves an error of about (|pqr|*dt)^4 for semi-implicit
+    # Euler, which stays put instead of building up over a long run
+    for integrator in ["semi_implicit", "rk4"]:
+        iris = quad.Quadrotor(dict(cfg.params, attitude="quaternion", integrator=integrator))
+        iris.set_state(np.zeros((3, 1)), ZETAS[1], np.zeros((3, 1)), np.array([[1.], [-2.], [3.]]))
+        for _ in range(2000):
+            iris.step(iris.hov_rpm+np.array([5., 0., -5., 2.]))
+            assert abs(np.linalg.norm(iris.q)-1.) < 1e-6
+
+def test_pitch_through_90_degrees():
+    iris = quad.Quadrotor(dict(cfg.params, attitude="quaternion"))
+    iris.set_state(np.zeros((3, 1)), np.zeros((3, 1)), np.zeros((3, 1)), np.array([[0.], [3.], [0.]]))
+    rpm = np.full(4, iris.hov_rpm)
+    nose = []
+    for _ in range(100):
+        iris.step(rpm)
+        assert np.all(np.isfinite(np.vstack(iris.get_state())))
+        nose.append(iris.R1_q(iris.q)[2, 0])
+    # the body x-axis points straight down partway through, and carries on over the top
+    assert min(nose) < -0.999
+    assert nose[-1] > -0.9
+    assert abs(np.linalg.norm(iris.q)-1.) < 1e-6
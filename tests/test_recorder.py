@@ -0,0 +1,26 @@
+import numpy as np
+
+import config as cfg
+import quadrotor as quad
+from recorder import TrajectoryRecorder, load
+
+def test_round_trip(tmp_path):
+    iris = quad.Quadrotor(cfg.params)
+    rpm = iris.hov_rpm+np.array([10., 0., 10., 0.])
+    states = []
+    with TrajectoryRecorder(str(tmp_path), cfg.params, chunk=16) as rec:
+        for i in range(50):
+            iris.step(rpm)
+            rec.record(i*iris.dt, iris)
+            states.append(np.vstack(iris.get_state())[:, 0])
+        rec.close()
+    traj = load(str(tmp_path))
+    assert np.array_equal(traj.state, np.array(states))
+
+def test_empty_quaternion_recording(tmp_path):
+    rec = TrajectoryRecorder(str(tmp_path), dict(cfg.params, attitude="quaternion"))
+    rec.close()
+    traj = load(str(tmp_path))
+    assert len(traj) == 0
+    assert traj.state.shape == (0, 13)
+    assert traj.q.shape == (0, 4)
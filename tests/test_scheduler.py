@@ -0,0 +1,60 @@
+import numpy as np
+
+import config as cfg
+import quadrotor as quad
+from scheduler import Scheduler
+
+class Controller:
+    # records when it was called, and returns a command that depends on the state
+    def __init__(self):
+        self.times = []
+
+    def __call__(self, t, aircraft):
+        self.times.append(t)
+        return aircraft.hov_rpm+np.array([5., 0., -5., 0.])-50.*aircraft.uvw[2, 0]
+
+def test_non_integer_ratio_doesnt_drift():
+    iris = quad.Quadrotor(cfg.params)
+    ctrl = Controller()
+    scheduler = Scheduler(iris)
+    task = scheduler.add(ctrl, 0.025, "ctrl")
+    stats = scheduler.run(100.)
+    assert len(ctrl.times) == task.calls == 4001
+    assert np.array_equal(ctrl.times, 0.025*np.arange(4001))
+    # every 0.025 s tick is two 0.01 s steps and one 0.005 s step
+    assert stats["ticks"] == 4000
+    assert stats["substeps"] == 12000
+    assert stats["t"] == 100.
+    assert iris.dt == cfg.params["dt"]
+
+def test_two_rates():
+    iris = quad.Quadrotor(cfg.params)
+    ctrl = Controller()
+    sensed = []
+    scheduler = Scheduler(iris)
+    scheduler.add(ctrl, 0.025, "ctrl")
+    scheduler.add(lambda t, aircraft: sensed.append(t), 0.01, "sensor")
+    stats = scheduler.run(1.)
+    assert np.allclose(ctrl.times, 0.025*np.arange(41), rtol=0., atol=1e-12)
+    assert np.allclose(sensed, 0.01*np.arange(101), rtol=0., atol=1e-12)
+    # events at multiples of 0.01 and of 0.025, counting the multiples of 0.05 once, and
+    # no interval between two events is longer than a physics step
+    assert stats["ticks"] == 100+40-20
+    assert stats["substeps"] == stats["ticks"]
+    assert stats["tasks"]["sensor"]["calls"] == 101
+
+def test_integer_ratio_matches_step_loop():
+    scheduled, looped = quad.Quadrotor(cfg.params), quad.Quadrotor(cfg.params)
+    scheduler = Scheduler(scheduled)
+    scheduler.add(Controller(), 0.05)
+    scheduler.run(10.)
+
+    ctrl = Controller()
+    for k in range(201):
+        rpm = ctrl(0.05*k, looped)
+        if k < 200:
+            for _ in range(5):
+                looped.step(rpm)
+    for a, b in zip(scheduled.get_state(), looped.get_state()):
+        assert np.array_equal(a, b)
+    assert scheduler.substeps == 1000